@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import Dataset, OptimizationJob
 
 # Register your models here.
+
+
+admin.site.register(OptimizationJob)
+admin.site.register(Dataset)
@@ -0,0 +1,7 @@
+from django.urls import path
+from api.datasets import views
+
+urlpatterns = [
+    path("datasets/", views.datasets),
+    path("datasets/<uuid:dataset_id>/", views.dataset_detail),
+]
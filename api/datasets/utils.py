@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from api.models import Dataset
+
+# Datasets hold the experimental data of the optimization endpoints so that
+# large series are uploaded once. Each column is stored as a float64 .npy file
+# in a directory named after the SHA-256 of the content, which the requests
+# read through memory mapping. Missing values are NaN. Equal uploads share the
+# files, and an owner uploading the same content again gets the dataset they
+# already have
+
+
+def get_dataset_dir():
+    return Path(
+        getattr(settings, "DATASET_DIR", Path(settings.MEDIA_ROOT) / "datasets")
+    )
+
+
+def to_column(name, values):
+    try:
+        values = np.array(
+            [np.nan if value is None else value for value in values], dtype=float
+        )
+    except (ValueError, TypeError):
+        raise ValueError(f"Column {name} must hold numbers")
+    if values.ndim != 1:
+        raise ValueError(f"Column {name} must hold numbers")
+    return values
+
+
+def read_csv(content):
+    # Columns of a CSV file with a header row, empty cells are missing values
+    try:
+        frame = pd.read_csv(io.BytesIO(content), float_precision="round_trip")
+    except (ValueError, pd.errors.ParserError) as e:
+        raise ValueError(f"The CSV file could not be read: {e}")
+    columns = {}
+    for name in frame.columns:
+        values = pd.to_numeric(frame[name], errors="coerce")
+        if values.isna().sum() > frame[name].isna().sum():
+            raise ValueError(f"Column {name} must hold numbers")
+        columns[str(name)] = values.to_numpy(dtype=float)
+    return columns
+
+
+def read_json(data):
+    # Columns of {"name": [values]}, whose columns may differ in length, or of
+    # a list of rows such as experimentalMCData
+    if isinstance(data, (str, bytes)):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"The JSON file could not be read: {e}")
+    if isinstance(data, dict):
+        return {str(name): to_column(name, values) for name, values in data.items()}
+    if isinstance(data, list) and all(isinstance(row, dict) for row in data):
+        frame = pd.DataFrame(data)
+        return {
+            str(name): to_column(name, frame[name].tolist()) for name in frame.columns
+        }
+    raise ValueError("data must be an object of columns or a list of rows")
+
+
+def read_upload(data, files):
+    # Columns of an upload: a "file" with the .csv or .json extension, or
+    # the columns in "data", or the text of a CSV file in "csv". Raises ValueError
+    upload = files.get("file")
+    if upload is not None:
+        content = upload.read()
+        if upload.name.lower().endswith(".json"):
+            columns = read_json(content)
+        elif upload.name.lower().endswith(".csv"):
+            columns = read_csv(content)
+        else:
+            raise ValueError("The file must be a .csv or .json file")
+    elif data.get("data") is not None:
+        columns = read_json(data["data"])
+    elif data.get("csv") is not None:
+        columns = read_csv(str(data["csv"]).encode("utf-8"))
+    else:
+        raise ValueError("Upload a file or give the columns in data")
+
+    if not columns or all(len(values) == 0 for values in columns.values()):
+        raise ValueError("The dataset has no values")
+    size = sum(values.nbytes for values in columns.values())
+    if size > getattr(settings, "DATASET_MAX_BYTES", 512 * 1024**2):
+        raise ValueError("The dataset is too large")
+    return columns
+
+
+def hash_columns(columns):
+    digest = hashlib.sha256()
+    for name, values in columns.items():
+        digest.update(json.dumps([name, len(values)]).encode("utf-8"))
+        digest.update(np.ascontiguousarray(values, dtype="<f8").tobytes())
+    return digest.hexdigest()
+
+
+def write_columns(content_hash, columns):
+    # Writes the files of a content hash unless they exist. They are written to
+    # a temporary directory and renamed, so readers never see partial files
+    directory = get_dataset_dir() / content_hash
+    if directory.exists():
+        return directory
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    temporary = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".upload-"))
+    try:
+        for index, values in enumerate(columns.values()):
+            np.save(
+                temporary / f"{index}.npy", np.ascontiguousarray(values, dtype="<f8")
+            )
+        os.replace(temporary, directory)
+    except OSError:
+        # Another request stored the same content meanwhile
+        shutil.rmtree(temporary, ignore_errors=True)
+        if not directory.exists():
+            raise
+    return directory
+
+
+def save_dataset(owner, name, columns):
+    # Returns the dataset of the columns and whether it was created
+    content_hash = hash_columns(columns)
+    existing = Dataset.objects.filter(owner=owner, content_hash=content_hash).first()
+    if existing is not None:
+        return existing, False
+
+    write_columns(content_hash, columns)
+    try:
+        with transaction.atomic():
+            dataset = Dataset.objects.create(
+                owner=owner,
+                name=name or "dataset",
+                columns=list(columns),
+                n_rows=max(len(values) for values in columns.values()),
+                content_hash=content_hash,
+                size=sum(len(values) * 8 for values in columns.values()),
+            )
+    except IntegrityError:
+        return Dataset.objects.get(owner=owner, content_hash=content_hash), False
+    return dataset, True
+
+
+def delete_dataset(dataset):
+    # The files stay while another owner has the same content
+    dataset.delete()
+    if not Dataset.objects.filter(content_hash=dataset.content_hash).exists():
+        shutil.rmtree(get_dataset_dir() / dataset.content_hash, ignore_errors=True)
+
+
+class DatasetColumns(dict):
+    # Columns of a dataset by name, with the hash of their content, which
+    # identifies them in the caches of the results
+    def __init__(self, columns, content_hash):
+        super().__init__(columns)
+        self.content_hash = content_hash
+
+
+def load_columns(dataset):
+    # Read-only memory maps of the columns, by name
+    directory = get_dataset_dir() / dataset.content_hash
+    try:
+        return {
+            name: np.load(directory / f"{index}.npy", mmap_mode="r")
+            for index, name in enumerate(dataset.columns)
+        }
+    except FileNotFoundError:
+        raise ValueError(f"The files of dataset {dataset.id} are missing")
+
+
+def get_owner(request):
+    # Member of the authenticated user of a request. Raises PermissionError
+    user = request.user
+    member = getattr(user, "member", None) if user.is_authenticated else None
+    if member is None:
+        raise PermissionError("You must be authenticated to use datasets")
+    return member
+
+
+def get_dataset(dataset_id, owner=None):
+    # Raises Dataset.DoesNotExist, also for datasets of another owner
+    datasets = Dataset.objects.all() if owner is None else owner.datasets.all()
+    try:
+        return datasets.get(pk=dataset_id)
+    except (ValidationError, ValueError, TypeError):
+        # Malformed ids
+        raise Dataset.DoesNotExist("Dataset not found")
+
+
+def load_request_dataset(data, key, owner=None):
+    # Returns the request with data[key] read from the datasets of
+    # "datasetId", one id or, for the fits of several experiments, a list of
+    # ids. Other entries of data[key], like the initial values of a series,
+    # are kept. Without owner any dataset is read. Raises Dataset.DoesNotExist
+    dataset_id = data.get("datasetId")
+    if dataset_id is None:
+        return data
+    if isinstance(dataset_id, list):
+        experiments = []
+        for item in dataset_id:
+            dataset = get_dataset(item, owner)
+            experiments.append({"name": dataset.name, **load_columns(dataset)})
+        return {**data, key: experiments}
+
+    inline = data.get(key)
+    inline = inline if isinstance(inline, dict) else {}
+    dataset = get_dataset(dataset_id, owner)
+    columns = load_columns(dataset)
+    if set(inline) <= set(columns):
+        # The columns are the content of the dataset, known by its hash
+        return {**data, key: DatasetColumns(columns, dataset.content_hash)}
+    return {**data, key: {**inline, **columns}}
+
+
+def get_request_data(request, key):
+    # Data of a request that may give its key through "datasetId". Raises
+    # PermissionError for anonymous requests with a dataset and
+    # Dataset.DoesNotExist
+    data = request.data
+    if data.get("datasetId") is None:
+        return data
+    return load_request_dataset(data, key, get_owner(request))
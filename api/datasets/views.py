@@ -0,0 +1,62 @@
+from rest_framework.response import Response
+from rest_framework.decorators import api_view
+from rest_framework import status
+
+from api.models import Dataset
+from api.serializers import DatasetSerializer
+from api.datasets.utils import (
+    delete_dataset,
+    get_dataset,
+    get_owner,
+    read_upload,
+    save_dataset,
+)
+
+
+@api_view(["GET", "POST"])
+def datasets(request):
+    try:
+        owner = get_owner(request)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if request.method == "GET":
+        serializer = DatasetSerializer(owner.datasets.all(), many=True)
+        return Response(serializer.data)
+
+    try:
+        columns = read_upload(request.data, request.FILES)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    upload = request.FILES.get("file")
+    name = request.data.get("name") or (upload.name if upload is not None else None)
+    dataset, created = save_dataset(owner, name, columns)
+
+    serializer = DatasetSerializer(dataset)
+
+    # Uploading the same content again returns the existing dataset
+    return Response(
+        serializer.data,
+        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+    )
+
+
+@api_view(["GET", "DELETE"])
+def dataset_detail(request, dataset_id):
+    try:
+        dataset = get_dataset(dataset_id, get_owner(request))
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except Dataset.DoesNotExist:
+        return Response(
+            {"error": "Dataset not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    if request.method == "DELETE":
+        delete_dataset(dataset)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    serializer = DatasetSerializer(dataset)
+
+    return Response(serializer.data)
@@ -0,0 +1,40 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utilis.trajectory_grid import DEFAULT_GRIDS, build_grid, get_grid_directory
+
+
+class Command(BaseCommand):
+    help = "Build the precomputed trajectory grids used by the simulation previews"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            help=(
+                f"Models to build among {', '.join(DEFAULT_GRIDS)}, "
+                "all of them by default"
+            ),
+        )
+        parser.add_argument("--directory", help="Directory of the grids")
+
+    def handle(self, *args, **options):
+        # Checked here, argparse rejects an empty list of a positional with choices
+        unknown = [model for model in options["models"] if model not in DEFAULT_GRIDS]
+        if unknown:
+            raise CommandError(
+                f"Unknown models {', '.join(unknown)}, "
+                f"choose among {', '.join(DEFAULT_GRIDS)}"
+            )
+        directory = options["directory"] or get_grid_directory()
+        for model in options["models"] or list(DEFAULT_GRIDS):
+            start = time.perf_counter()
+            error = np.asarray(build_grid(model, directory=directory).cell_error)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{model}: {error.size} cells built in {elapsed:.1f} s "
+                f"to {directory}, relative error median {np.median(error):.1e}, "
+                f"max {np.max(error):.1e}"
+            )
@@ -0,0 +1,221 @@
+import asyncio
+import importlib
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.urls import clear_url_caches
+
+from api.utilis.numerical_methods import perform_simulation
+
+# Requests of the compute endpoints, each with its own values so that none of
+# them is answered from the cache
+ENDPOINTS = ("simulation", "parameter-optimization", "media-optimization")
+
+
+def make_simulation(rng):
+    return {
+        "model": "monod",
+        "mu": rng.uniform(0.3, 0.6),
+        "Y": 0.5,
+        "Yp": 0.3,
+        "Ks": 2,
+        "X0": 0.1,
+        "S0": 20,
+        "P0": 0,
+        "step_size": 0.01,
+        "tf": 200,
+        "rtol": 1e-10,
+        "atol": 1e-12,
+    }
+
+
+def make_parameter_optimization(rng):
+    t = np.arange(0, 30.5, 1.0)
+    solution = perform_simulation(
+        "monod", [0.1, 20, 0], t, (rng.uniform(0.3, 0.6), 0.5, 0.3, 2)
+    )
+    return {
+        "kineticData": {
+            "model": "monod",
+            "mu": {"optimize": True, "min": 0.1, "max": 1},
+            "Yx": {"optimize": True, "min": 0.1, "max": 1},
+            "Yp": {"optimize": False, "fixed": 0.3},
+            "Ks": {"optimize": True, "min": 0.1, "max": 5},
+        },
+        "experimentalData": {
+            "t": t.tolist(),
+            "x": solution.y[0].tolist(),
+            "s": solution.y[1].tolist(),
+            "p": solution.y[2].tolist(),
+        },
+        "GAParams": {
+            "max_num_iteration": 500,
+            "population_size": 200,
+            "max_iteration_without_improv": 500,
+            "seed": int(rng.integers(2**31)),
+        },
+    }
+
+
+def make_media_optimization(rng):
+    X = rng.random((20000, 3)) * 10
+    y = X @ [1.0, 2.0, 3.0] - (X**2).sum(axis=1) + rng.normal(0, 0.1, len(X))
+    rows = [
+        {"a": a, "b": b, "c": c, "y": value}
+        for (a, b, c), value in zip(X.tolist(), y.tolist())
+    ]
+    return {
+        "experimentalMCData": rows,
+        "LAParams": {
+            "x_vars": ["a", "b", "c"],
+            "y_var": "y",
+            "test_size": 0.2,
+            "random_state": 0,
+            "normalization": True,
+            "polynomial_degree": 6,
+        },
+    }
+
+
+PAYLOADS = {
+    "simulation": make_simulation,
+    "parameter-optimization": make_parameter_optimization,
+    "media-optimization": make_media_optimization,
+}
+
+
+def use_async_views(enabled):
+    # Routes the compute endpoints to the async or the sync views
+    settings.ASYNC_COMPUTE_VIEWS = enabled
+    for module in (
+        "api.simulation.urls",
+        "api.optimization.urls",
+        settings.ROOT_URLCONF,
+    ):
+        importlib.reload(importlib.import_module(module))
+    clear_url_caches()
+
+
+def get_host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*" and not host.startswith("."):
+            return host
+    return "localhost"
+
+
+async def run_load(payloads, probe, interval, min_probes=0):
+    # Sends the compute requests at once and, until they are answered and at
+    # least min_probes were sent, the probe request one after another. Returns
+    # the status codes of the compute requests, their wall time and the
+    # latencies of the probes
+    headers = {"host": get_host()}
+
+    async def compute(endpoint, payload):
+        client = AsyncClient(raise_request_exception=False, headers=headers)
+        response = await client.post(
+            f"/api/{endpoint}/", payload, content_type="application/json"
+        )
+        return response.status_code
+
+    start = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(compute(endpoint, payload))
+        for endpoint, payload in payloads
+    ]
+
+    client = AsyncClient(raise_request_exception=False, headers=headers)
+    latencies = []
+    while len(latencies) < min_probes or not all(task.done() for task in tasks):
+        sent = time.perf_counter()
+        await client.post(
+            probe,
+            {"username": "loadtest", "password": "loadtest"},
+            content_type="application/json",
+        )
+        latencies.append(time.perf_counter() - sent)
+        await asyncio.sleep(interval)
+
+    statuses = await asyncio.gather(*tasks)
+    return statuses, time.perf_counter() - start, np.array(latencies)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency of a cheap request while compute requests run, "
+        "with the sync and the async compute views under ASGI"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=4,
+            help="Concurrent requests of each compute endpoint",
+        )
+        parser.add_argument(
+            "--endpoints",
+            nargs="*",
+            choices=ENDPOINTS,
+            default=list(ENDPOINTS),
+            help="Compute endpoints to load, all of them by default",
+        )
+        parser.add_argument(
+            "--probe",
+            default="/users/token/",
+            help="Path of the cheap request, posted with wrong credentials",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=0.05, help="Seconds between probes"
+        )
+        parser.add_argument(
+            "--modes",
+            nargs="*",
+            choices=["sync", "async"],
+            default=["sync", "async"],
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        enabled = getattr(settings, "ASYNC_COMPUTE_VIEWS", False)
+        # The probes are rejected on purpose, their warnings are left out
+        logger = logging.getLogger("django.request")
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            # Latency of the probe without load
+            _, _, latencies = asyncio.run(
+                run_load([], options["probe"], options["interval"], min_probes=10)
+            )
+            self.write_latencies("idle: ", latencies)
+            for index, mode in enumerate(options["modes"]):
+                use_async_views(mode == "async")
+                # Other values for each mode, which would otherwise be cached
+                rng = np.random.default_rng([options["seed"], index])
+                payloads = [
+                    (endpoint, PAYLOADS[endpoint](rng))
+                    for _ in range(options["requests"])
+                    for endpoint in options["endpoints"]
+                ]
+                statuses, elapsed, latencies = asyncio.run(
+                    run_load(payloads, options["probe"], options["interval"])
+                )
+                codes = {code: statuses.count(code) for code in sorted(set(statuses))}
+                self.write_latencies(
+                    f"{mode}: {len(statuses)} compute requests in {elapsed:.1f} s "
+                    f"(status {codes}), ",
+                    latencies,
+                )
+        finally:
+            logger.setLevel(level)
+            use_async_views(enabled)
+
+    def write_latencies(self, prefix, latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        self.stdout.write(
+            f"{prefix}{len(latencies)} probes, latency p50 {p50:.0f} ms, "
+            f"p95 {p95:.0f} ms, p99 {p99:.0f} ms, max {latencies.max() * 1000:.0f} ms"
+        )
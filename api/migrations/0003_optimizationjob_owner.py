@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-18 15:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_member_image_alter_member_user'),
+        ('api', '0002_dataset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optimizationjob',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='optimization_jobs', to='users.member'),
+        ),
+    ]
@@ -1,3 +1,85 @@
+import uuid
+
 from django.db import models
 
+from users.models import Member
+
 # Create your models here.
+
+
+class OptimizationJob(models.Model):
+
+    STATUSES = (('queued', 'queued'),
+                ('running', 'running'),
+                ('succeeded', 'succeeded'),
+                ('failed', 'failed'),
+                ('cancelled', 'cancelled'))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    # Only the owner sees and cancels a job. Jobs queued before jobs had owners
+    # have none and are not reachable
+    owner = models.ForeignKey(
+        Member, on_delete=models.CASCADE, related_name='optimization_jobs',
+        null=True, blank=True)
+
+    status = models.CharField(max_length=20, choices=STATUSES, default='queued')
+
+    # Body of the parameter-optimization request and the response it produced
+    payload = models.JSONField()
+
+    result = models.JSONField(null=True, blank=True)
+
+    error = models.TextField(blank=True)
+
+    cancel_requested = models.BooleanField(default=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    started_at = models.DateTimeField(null=True, blank=True)
+
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # Updated while the job runs, a stale heartbeat means its server went away
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+
+        return str(self.id) + ' - ' + self.status
+
+
+class Dataset(models.Model):
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    owner = models.ForeignKey(
+        Member, on_delete=models.CASCADE, related_name='datasets')
+
+    name = models.CharField(max_length=200)
+
+    # Names of the columns, each stored as one float64 .npy file in the
+    # directory named after the content hash, see api/datasets/utils.py
+    columns = models.JSONField()
+
+    n_rows = models.PositiveIntegerField()
+
+    # SHA-256 of the column names and values, equal uploads share the files
+    content_hash = models.CharField(max_length=64, db_index=True)
+
+    size = models.PositiveBigIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'content_hash'], name='unique_dataset_per_owner')
+        ]
+
+    def __str__(self):
+
+        return self.name + ' - ' + self.content_hash[:12]
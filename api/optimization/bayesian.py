@@ -0,0 +1,201 @@
+import warnings
+
+import numpy as np
+from scipy.stats import norm, qmc
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+
+# Defaults of the surrogate search: ODE solves it may spend, points of the
+# initial design (2 * dimension + 1 when not given) and points simulated
+# together per iteration, which a process pool evaluates in parallel
+DEFAULT_MAX_SOLVES = 100
+DEFAULT_BATCH_SIZE = 1
+
+# Minimum improvement of the log error that the expected improvement counts
+DEFAULT_XI = 0.01
+
+# Candidates scored by the acquisition function every iteration: a scrambled
+# Sobol sample of the search box and perturbations of the best points so far
+# at several scales of the unit box, the smallest ones for the final digits
+SOBOL_CANDIDATES = 2048
+LOCAL_CANDIDATES = 512
+LOCAL_POINTS = 5
+LOCAL_SCALES = (0.1, 0.02, 0.004, 0.0008)
+
+
+def get_bayesian_options(GA_params, dimension, solves_per_point=1):
+    # Reads the settings of the surrogate search from "GAParams". Every point
+    # costs solves_per_point ODE solves, one per experiment when fitting
+    # several, so the budget of max_solves simulates max_solves //
+    # solves_per_point points. Raises ValueError
+    max_solves = int(GA_params.get("max_solves", DEFAULT_MAX_SOLVES))
+    initial_points = int(GA_params.get("initial_points", 2 * dimension + 1))
+    batch_size = int(GA_params.get("batch_size", DEFAULT_BATCH_SIZE))
+    if initial_points < 2:
+        raise ValueError("initial_points must be at least 2")
+    if max_solves < initial_points * solves_per_point:
+        if solves_per_point == 1:
+            raise ValueError("max_solves must be at least initial_points")
+        raise ValueError(
+            f"max_solves must be at least initial_points times the "
+            f"{solves_per_point} experiments"
+        )
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    return {
+        "max_points": max_solves // solves_per_point,
+        "initial_points": initial_points,
+        "batch_size": batch_size,
+        "xi": float(GA_params.get("xi", DEFAULT_XI)),
+    }
+
+
+class BayesianOptimizer:
+    # Surrogate-assisted search for fits whose simulations are expensive. A
+    # Gaussian process models the log of the objective over the search box
+    # scaled to the unit cube, and every iteration simulates the points of
+    # largest expected improvement, batch_size of them picked one after the
+    # other with the constant liar heuristic. Stops once max_points points have
+    # been simulated. Same interface as GeneticAlgorithm: the objective
+    # receives an array of points and iterate_generations yields after the
+    # initial design and after every iteration, the population being every
+    # point simulated so far, best first
+
+    def __init__(self, function, dimension, variable_boundaries, options, seed=None):
+        self.function = function
+        self.dim = int(dimension)
+        self.var_bound = np.asarray(variable_boundaries, dtype=float).reshape(
+            self.dim, 2
+        )
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        self.max_points = options["max_points"]
+        self.initial_points = options["initial_points"]
+        self.batch_size = options["batch_size"]
+        self.xi = options["xi"]
+
+        self.population = np.empty((0, self.dim))
+        self.scores = np.empty(0)
+        self.best_variable = None
+        self.best_function = np.inf
+        self.report = []
+        self.generation = 0
+
+    def scale(self, unit_points):
+        return qmc.scale(unit_points, self.var_bound[:, 0], self.var_bound[:, 1])
+
+    def unit(self, points):
+        low, high = self.var_bound[:, 0], self.var_bound[:, 1]
+        return (points - low) / (high - low)
+
+    def evaluate(self, points):
+        scores = np.asarray(self.function(points), dtype=float)
+        scores = np.where(np.isnan(scores), np.inf, scores)
+        population = np.vstack([self.population, points])
+        scores = np.concatenate([self.scores, scores])
+        order = np.argsort(scores, kind="stable")
+        self.population, self.scores = population[order], scores[order]
+
+    def targets(self):
+        # Log errors, which vary far less over the search box than the errors.
+        # Failed simulations count as worse than the worst finite point
+        finite = np.isfinite(self.scores)
+        z = np.log(np.maximum(self.scores, 1e-300))
+        worst = np.max(z[finite]) + 1 if finite.any() else 0.0
+        return np.where(finite, z, worst)
+
+    def fit_surrogate(self, u, z, kernel=None):
+        # With a kernel the hyperparameters stay as they are, for the lies
+        if kernel is None:
+            matern = Matern(
+                length_scale=np.full(self.dim, 0.3),
+                length_scale_bounds=(1e-3, 1e2),
+                nu=2.5,
+            )
+            kernel = ConstantKernel(1.0, (1e-3, 1e3)) * matern + WhiteKernel(
+                1e-6, (1e-10, 1e-1)
+            )
+            optimizer = "fmin_l_bfgs_b"
+        else:
+            optimizer = None
+        gp = GaussianProcessRegressor(
+            kernel=kernel,
+            normalize_y=True,
+            optimizer=optimizer,
+            n_restarts_optimizer=2 if optimizer else 0,
+            random_state=self.seed,
+        )
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", ConvergenceWarning)
+            return gp.fit(u, z)
+
+    def candidates(self):
+        sobol = qmc.Sobol(d=self.dim, scramble=True, seed=self.rng).random(
+            SOBOL_CANDIDATES
+        )
+        best = self.unit(self.population[: min(LOCAL_POINTS, len(self.population))])
+        local = best[self.rng.integers(0, len(best), LOCAL_CANDIDATES)]
+        scales = np.resize(LOCAL_SCALES, LOCAL_CANDIDATES)[:, None]
+        local = local + scales * self.rng.standard_normal(local.shape)
+        return np.vstack([sobol, np.clip(local, 0, 1)])
+
+    def expected_improvement(self, gp, u, z_best):
+        mean, std = gp.predict(u, return_std=True)
+        std = np.maximum(std, 1e-12)
+        improvement = z_best - mean - self.xi
+        z = improvement / std
+        return improvement * norm.cdf(z) + std * norm.pdf(z)
+
+    def initialize(self):
+        n = min(self.initial_points, self.max_points)
+        sampler = qmc.LatinHypercube(d=self.dim, seed=self.rng)
+        self.evaluate(self.scale(sampler.random(n)))
+
+    def step(self):
+        # Simulate the next batch of points of largest expected improvement
+        u, z = self.unit(self.population), self.targets()
+        z_best = np.min(z)
+        gp = self.fit_surrogate(u, z)
+        candidates = self.candidates()
+
+        n = min(self.batch_size, self.max_points - len(self.scores))
+        batch = []
+        for _ in range(n):
+            ei = self.expected_improvement(gp, candidates, z_best)
+            chosen = int(np.argmax(ei))
+            batch.append(candidates[chosen])
+            candidates = np.delete(candidates, chosen, axis=0)
+            if len(batch) < n:
+                # Pretend the chosen point scored the best value so far, which
+                # pushes the next pick away from it
+                u = np.vstack([u, batch[-1]])
+                z = np.append(z, z_best)
+                gp = self.fit_surrogate(u, z, gp.kernel_)
+
+        self.evaluate(self.scale(np.array(batch)))
+
+    def update_best(self):
+        self.report.append(self.scores[0])
+        if self.best_variable is None or self.scores[0] < self.best_function:
+            self.best_function = self.scores[0]
+            self.best_variable = self.population[0].copy()
+            return True
+        return False
+
+    def iterate_generations(self):
+        self.initialize()
+        self.update_best()
+        yield self
+
+        while len(self.scores) < self.max_points:
+            self.step()
+            self.generation += 1
+            self.update_best()
+            yield self
+
+    def run(self):
+        for _ in self.iterate_generations():
+            pass
+        return self
@@ -0,0 +1,190 @@
+import time
+
+import numpy as np
+from django.conf import settings
+
+from api.utilis.parallel import (
+    SharedArray,
+    attach_shared_array,
+    get_worker_count,
+    map_population,
+)
+
+# Defaults of the bootstrap of a fit: refits, seconds allowed for all of them
+# and confidence level of the intervals
+DEFAULT_REPLICATES = 200
+DEFAULT_TIME_BUDGET = 30.0
+DEFAULT_CONFIDENCE = 0.95
+
+# Iterations of each refit. They start at the optimum of the original fit,
+# which is close to the optimum of the resampled data
+REFIT_MAX_NFEV = 20
+
+
+def get_bootstrap_options(data):
+    # Reads "bootstrapParams" of a parameter-optimization request, None when the
+    # request does not ask for confidence intervals. Raises ValueError
+    options = data.get("bootstrapParams")
+    if options is None:
+        return None
+    if not isinstance(options, dict):
+        raise ValueError("bootstrapParams must be an object")
+
+    max_replicates = getattr(settings, "BOOTSTRAP_MAX_REPLICATES", 2000)
+    replicates = int(options.get("B", DEFAULT_REPLICATES))
+    if not 2 <= replicates <= max_replicates:
+        raise ValueError(f"B must be between 2 and {max_replicates}")
+    time_budget = float(options.get("time_budget", DEFAULT_TIME_BUDGET))
+    if not time_budget > 0:
+        raise ValueError("time_budget must be positive")
+    confidence = float(options.get("confidence", DEFAULT_CONFIDENCE))
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be between 0 and 1")
+
+    return {
+        "B": replicates,
+        "time_budget": time_budget,
+        "confidence": confidence,
+        "seed": int(options.get("seed", 0)),
+        "n_jobs": options.get("n_jobs", -1),
+    }
+
+
+def resample(y_fitted, residuals, seed, replicate):
+    # Synthetic data set of one replicate: the fitted curves plus residuals drawn
+    # with replacement, variable by variable since their scales differ. The
+    # first point is the initial condition of the model and stays as measured,
+    # points that were not measured (NaN residuals) stay missing
+    rng = np.random.default_rng([seed, replicate])
+    y = y_fitted + residuals
+    for i in range(len(y)):
+        measured = np.flatnonzero(~np.isnan(residuals[i, 1:])) + 1
+        n = len(measured)
+        if n:
+            y[i, measured] = (
+                y_fitted[i, measured] + residuals[i, measured][rng.integers(0, n, n)]
+            )
+    return y
+
+
+def refit_replicates(
+    replicates,
+    data,
+    kinetic_model,
+    fixed_params,
+    varbound,
+    best_params,
+    seed,
+    deadline,
+    weights=None,
+):
+    # Refits a chunk of replicates, data holds the time, the fitted curves and
+    # the residuals. Replicates left when the deadline passes, or whose refit
+    # fails, are NaN. Imported here because the optimization utils import this
+    # module
+    from api.optimization.utils import refine_parameters
+
+    t_eval, y_fitted, residuals = data[0], data[1:4], data[4:7]
+
+    results = np.full((len(replicates), len(best_params)), np.nan)
+    for i, replicate in enumerate(replicates):
+        if time.time() > deadline:
+            break
+        x, s, p = resample(y_fitted, residuals, seed, int(replicate))
+        with np.errstate(all="ignore"):
+            refit, _ = refine_parameters(
+                best_params,
+                varbound,
+                kinetic_model,
+                t_eval,
+                x,
+                s,
+                p,
+                fixed_params,
+                max_nfev=REFIT_MAX_NFEV,
+                weights=weights,
+            )
+        if np.all(np.isfinite(refit)):
+            results[i] = refit
+    return results
+
+
+def bootstrap_task(replicates, data_descriptor, *args):
+    # Runs in a pool worker, the data is read from shared memory
+    return refit_replicates(replicates, attach_shared_array(data_descriptor), *args)
+
+
+def to_list(array):
+    # JSON lists with null in place of undefined values
+    array = np.asarray(array, dtype=float)
+    return np.where(np.isfinite(array), array, None).tolist()
+
+
+def bootstrap_parameters(
+    kinetic_model,
+    t_eval,
+    y_values,
+    y_fitted,
+    best_params,
+    fixed_params,
+    varbound,
+    names,
+    options,
+    weights=None,
+):
+    # Confidence intervals of the optimized parameters from refits of data sets
+    # built by resampling the residuals of the fit. The refits are spread over
+    # the process pool and stop once the time budget is spent, the intervals
+    # come from the refits that completed
+    data = np.vstack([t_eval, y_fitted, y_values - y_fitted]).astype(float)
+    best_params = np.asarray(best_params, dtype=float)
+    deadline = time.time() + options["time_budget"]
+    replicates = np.arange(options["B"])
+    args = (
+        kinetic_model,
+        fixed_params,
+        varbound,
+        best_params,
+        options["seed"],
+        deadline,
+        weights,
+    )
+
+    start = time.perf_counter()
+    workers = get_worker_count(options["n_jobs"])
+    if workers <= 1:
+        refits = refit_replicates(replicates, data, *args)
+    else:
+        with SharedArray(data) as shared:
+            refits = map_population(
+                bootstrap_task, replicates, workers, shared.descriptor, *args
+            )
+    elapsed = time.perf_counter() - start
+
+    refits = refits[np.all(np.isfinite(refits), axis=1)]
+    result = {
+        "B": options["B"],
+        "completed": len(refits),
+        "confidence": options["confidence"],
+        "elapsed": elapsed,
+        "intervals": None,
+        "std": None,
+        "correlation": None,
+    }
+    if len(refits) < 2:
+        return result
+
+    # Percentile intervals
+    alpha = (1 - options["confidence"]) / 2
+    low, high = np.quantile(refits, [alpha, 1 - alpha], axis=0)
+    std = refits.std(axis=0, ddof=1)
+    # Parameters that every refit left at the same value have no correlation
+    with np.errstate(all="ignore"):
+        correlation = np.corrcoef(refits, rowvar=False).reshape(len(names), len(names))
+
+    result["intervals"] = {
+        name: to_list([low[i], high[i]]) for i, name in enumerate(names)
+    }
+    result["std"] = dict(zip(names, to_list(std)))
+    result["correlation"] = to_list(correlation)
+    return result
@@ -0,0 +1,204 @@
+import numpy as np
+
+
+class GeneticAlgorithm:
+    # Real-coded genetic algorithm following the scheme of the geneticalgorithm
+    # package (elitism, roulette-wheel selection, one_point/two_point/uniform
+    # crossover, uniform and in-between mutation). The difference is that the
+    # objective function receives the whole population, shaped
+    # (individuals, dimension), and returns one value per individual, so each
+    # generation is evaluated in a single call
+
+    def __init__(
+        self,
+        function,
+        dimension,
+        variable_boundaries,
+        algorithm_parameters,
+        seed=None,
+    ):
+        self.function = function
+        self.dim = int(dimension)
+        self.var_bound = np.asarray(variable_boundaries, dtype=float).reshape(
+            self.dim, 2
+        )
+        self.rng = np.random.default_rng(seed)
+
+        self.pop_s = int(algorithm_parameters["population_size"])
+        self.prob_mut = algorithm_parameters["mutation_probability"]
+        self.prob_cross = algorithm_parameters["crossover_probability"]
+        self.c_type = algorithm_parameters["crossover_type"]
+        if self.c_type not in ("one_point", "two_point", "uniform"):
+            raise ValueError("Crossover type must be one_point, two_point or uniform")
+
+        # Parents are kept in the next generation, the rest is filled with pairs of
+        # children. At least one parent is needed for crossover
+        self.par_s = max(1, int(algorithm_parameters["parents_portion"] * self.pop_s))
+        if (self.pop_s - self.par_s) % 2 != 0:
+            self.par_s += 1
+
+        elit = self.pop_s * algorithm_parameters["elit_ratio"]
+        if elit < 1 and algorithm_parameters["elit_ratio"] > 0:
+            self.num_elit = 1
+        else:
+            self.num_elit = int(elit)
+        if self.par_s < self.num_elit:
+            raise ValueError(
+                "The number of parents must be greater than the number of elites"
+            )
+
+        self.iterate = algorithm_parameters["max_num_iteration"]
+        if self.iterate is None:
+            self.iterate = max(1, int(100 * self.dim * 50 / self.pop_s))
+        self.mniwi = algorithm_parameters["max_iteration_without_improv"]
+        if self.mniwi is None:
+            self.mniwi = self.iterate + 1
+
+        self.population = None
+        self.scores = None
+        self.best_variable = None
+        self.best_function = np.inf
+        self.report = []
+        self.generation = 0
+
+    def evaluate(self, population):
+        scores = np.asarray(self.function(population), dtype=float)
+        # Failed simulations never beat a finite objective
+        return np.where(np.isnan(scores), np.inf, scores)
+
+    def random_population(self):
+        low, high = self.var_bound[:, 0], self.var_bound[:, 1]
+        return low + self.rng.random((self.pop_s, self.dim)) * (high - low)
+
+    def initialize(self):
+        self.population = self.random_population()
+        self.scores = self.evaluate(self.population)
+        self.sort()
+
+    def sort(self):
+        order = np.argsort(self.scores, kind="stable")
+        self.population = self.population[order]
+        self.scores = self.scores[order]
+
+    def select_parents(self):
+        # Roulette wheel on the objective normalized so that the best individual
+        # gets the largest slice
+        finite = np.isfinite(self.scores)
+        normobj = np.where(
+            finite, self.scores, np.max(self.scores[finite], initial=0.0)
+        )
+        if normobj[0] < 0:
+            normobj = normobj + abs(normobj[0])
+        normobj = np.max(normobj) - normobj + 1
+        cumprob = np.cumsum(normobj / np.sum(normobj))
+
+        index = np.arange(self.par_s)
+        drawn = np.searchsorted(cumprob, self.rng.random(self.par_s - self.num_elit))
+        index[self.num_elit :] = np.minimum(drawn, self.pop_s - 1)
+        return index
+
+    def crossover(self, parents1, parents2):
+        n_pairs = len(parents1)
+        genes = np.arange(self.dim)
+
+        if self.c_type == "one_point":
+            cut = self.rng.integers(0, self.dim, n_pairs)
+            swap = genes[None, :] < cut[:, None]
+        elif self.c_type == "two_point":
+            start = self.rng.integers(0, self.dim, n_pairs)
+            end = self.rng.integers(start, self.dim)
+            swap = (genes[None, :] >= start[:, None]) & (genes[None, :] < end[:, None])
+        else:
+            swap = self.rng.random((n_pairs, self.dim)) < 0.5
+
+        children1 = np.where(swap, parents2, parents1)
+        children2 = np.where(swap, parents1, parents2)
+        return children1, children2
+
+    def mutate(self, children):
+        # Uniform mutation within the variable boundaries
+        low, high = self.var_bound[:, 0], self.var_bound[:, 1]
+        mutation = self.rng.random(children.shape) < self.prob_mut
+        random_genes = low + self.rng.random(children.shape) * (high - low)
+        return np.where(mutation, random_genes, children)
+
+    def mutate_middle(self, children, parents1, parents2):
+        # Mutation between the values of both parents, or within the boundaries
+        # when the parents agree
+        low, high = self.var_bound[:, 0], self.var_bound[:, 1]
+        mutation = self.rng.random(children.shape) < self.prob_mut
+        lower = np.minimum(parents1, parents2)
+        upper = np.maximum(parents1, parents2)
+        same = lower == upper
+        lower = np.where(same, low, lower)
+        upper = np.where(same, high, upper)
+        random_genes = lower + self.rng.random(children.shape) * (upper - lower)
+        return np.where(mutation, random_genes, children)
+
+    def breed(self):
+        # Parents of the next generation, their scores and their children, which
+        # are not evaluated yet
+        parents_index = self.select_parents()
+        parents = self.population[parents_index]
+        parents_scores = self.scores[parents_index]
+
+        # At least one parent takes part in crossover
+        crossing = self.rng.random(self.par_s) <= self.prob_cross
+        while not crossing.any():
+            crossing = self.rng.random(self.par_s) <= self.prob_cross
+        crossing_parents = parents[crossing]
+
+        n_pairs = (self.pop_s - self.par_s) // 2
+        parents1 = crossing_parents[
+            self.rng.integers(0, len(crossing_parents), n_pairs)
+        ]
+        parents2 = crossing_parents[
+            self.rng.integers(0, len(crossing_parents), n_pairs)
+        ]
+        children1, children2 = self.crossover(parents1, parents2)
+        children1 = self.mutate(children1)
+        children2 = self.mutate_middle(children2, parents1, parents2)
+
+        # Children are interleaved as in the pairwise loop of the original algorithm
+        children = np.empty((2 * n_pairs, self.dim))
+        children[0::2] = children1
+        children[1::2] = children2
+        return parents, parents_scores, children
+
+    def replace(self, parents, parents_scores, children, children_scores):
+        self.population = np.vstack([parents, children])
+        self.scores = np.concatenate([parents_scores, children_scores])
+        self.sort()
+
+    def step(self):
+        # Build and evaluate the next generation
+        parents, parents_scores, children = self.breed()
+        self.replace(parents, parents_scores, children, self.evaluate(children))
+
+    def update_best(self):
+        self.report.append(self.scores[0])
+        if self.best_variable is None or self.scores[0] < self.best_function:
+            self.best_function = self.scores[0]
+            self.best_variable = self.population[0].copy()
+            return True
+        return False
+
+    def iterate_generations(self):
+        # Generator version of run, yields after the initial population and after
+        # every generation so callers can report progress or stop early by not
+        # resuming it
+        self.initialize()
+        self.update_best()
+        yield self
+
+        counter = 0
+        while self.generation < self.iterate and counter <= self.mniwi:
+            self.step()
+            self.generation += 1
+            counter = 0 if self.update_best() else counter + 1
+            yield self
+
+    def run(self):
+        for _ in self.iterate_generations():
+            pass
+        return self
@@ -0,0 +1,156 @@
+import numpy as np
+
+from api.optimization.genetic_algorithm import GeneticAlgorithm
+
+# Defaults of the island model: generations between migrations, best
+# individuals every island sends to the next one, and generations without
+# improvement after which an island has converged, which stops every island
+DEFAULT_MIGRATION_INTERVAL = 5
+DEFAULT_MIGRANTS = 2
+DEFAULT_STALL_GENERATIONS = 10
+MAX_ISLANDS = 32
+
+
+def get_island_options(GA_params, algorithm_param):
+    # Reads the settings of the island model from "GAParams". Raises ValueError
+    islands = int(GA_params["islands"])
+    migration_interval = int(
+        GA_params.get("migration_interval", DEFAULT_MIGRATION_INTERVAL)
+    )
+    migrants = int(GA_params.get("migrants", DEFAULT_MIGRANTS))
+    stall = algorithm_param["max_iteration_without_improv"]
+    if not 2 <= islands <= MAX_ISLANDS:
+        raise ValueError(f"islands must be between 2 and {MAX_ISLANDS}")
+    if migration_interval < 1:
+        raise ValueError("migration_interval must be at least 1")
+    if not 0 <= migrants < algorithm_param["population_size"]:
+        raise ValueError("migrants must be between 0 and the population size")
+    return {
+        "islands": islands,
+        "migration_interval": migration_interval,
+        "migrants": migrants,
+        "stall_generations": DEFAULT_STALL_GENERATIONS if stall is None else int(stall),
+    }
+
+
+class IslandModel:
+    # Several populations of the genetic algorithm that evolve apart and every
+    # migration_interval generations send their best individuals to the next
+    # island of a ring, where they replace the worst ones. Separate populations
+    # settle in different minima instead of one population collapsing into the
+    # first it finds. The islands advance in lockstep and the children of all
+    # of them are evaluated in a single call of the objective, which the
+    # process pool splits across its workers, so the result does not depend on
+    # the number of workers. Stops after max_num_iteration generations or once
+    # any island has gone stall_generations without improving. Same interface
+    # as GeneticAlgorithm, the population being the individuals of every
+    # island, best first
+
+    def __init__(
+        self,
+        function,
+        dimension,
+        variable_boundaries,
+        algorithm_parameters,
+        options,
+        seed=None,
+    ):
+        self.function = function
+        self.dim = int(dimension)
+        self.islands = [
+            GeneticAlgorithm(
+                function=None,
+                dimension=dimension,
+                variable_boundaries=variable_boundaries,
+                algorithm_parameters=algorithm_parameters,
+                seed=None if seed is None else (seed, island),
+            )
+            for island in range(options["islands"])
+        ]
+        self.iterate = self.islands[0].iterate
+        self.migration_interval = options["migration_interval"]
+        self.migrants = options["migrants"]
+        self.stall_generations = options["stall_generations"]
+
+        self.population = None
+        self.scores = None
+        self.best_variable = None
+        self.best_function = np.inf
+        self.report = []
+        self.generation = 0
+
+    def evaluate(self, populations):
+        # Scores of the populations of every island, from one call of the objective
+        scores = np.asarray(self.function(np.vstack(populations)), dtype=float)
+        scores = np.where(np.isnan(scores), np.inf, scores)
+        return np.split(scores, np.cumsum([len(p) for p in populations])[:-1])
+
+    def initialize(self):
+        populations = [island.random_population() for island in self.islands]
+        for island, population, scores in zip(
+            self.islands, populations, self.evaluate(populations)
+        ):
+            island.population, island.scores = population, scores
+            island.sort()
+
+    def step(self):
+        offspring = [island.breed() for island in self.islands]
+        children_scores = self.evaluate([children for _, _, children in offspring])
+        for island, (parents, parents_scores, children), scores in zip(
+            self.islands, offspring, children_scores
+        ):
+            island.replace(parents, parents_scores, children, scores)
+
+    def migrate(self):
+        # Ring topology, island i receives the best individuals of island i - 1
+        if self.migrants == 0:
+            return
+        m = self.migrants
+        elites = [
+            (island.population[:m].copy(), island.scores[:m].copy())
+            for island in self.islands
+        ]
+        for island, (population, scores) in zip(
+            self.islands, elites[-1:] + elites[:-1]
+        ):
+            island.population[-m:] = population
+            island.scores[-m:] = scores
+            island.sort()
+
+    def gather(self):
+        population = np.vstack([island.population for island in self.islands])
+        scores = np.concatenate([island.scores for island in self.islands])
+        order = np.argsort(scores, kind="stable")
+        self.population, self.scores = population[order], scores[order]
+
+    def update_best(self):
+        # Updates the best of every island and returns the islands that improved
+        improved = [island.update_best() for island in self.islands]
+        self.gather()
+        self.report.append(self.scores[0])
+        if self.best_variable is None or self.scores[0] < self.best_function:
+            self.best_function = self.scores[0]
+            self.best_variable = self.population[0].copy()
+        return improved
+
+    def iterate_generations(self):
+        self.initialize()
+        self.update_best()
+        yield self
+
+        counters = np.zeros(len(self.islands), dtype=int)
+        while self.generation < self.iterate and np.all(
+            counters <= self.stall_generations
+        ):
+            self.step()
+            self.generation += 1
+            if self.generation % self.migration_interval == 0:
+                self.migrate()
+            improved = self.update_best()
+            counters = np.where(improved, 0, counters + 1)
+            yield self
+
+    def run(self):
+        for _ in self.iterate_generations():
+            pass
+        return self
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from api.datasets.utils import load_request_dataset
+from api.models import Dataset, OptimizationJob
+from api.optimization.utils import run_parameter_optimization
+
+logger = logging.getLogger(__name__)
+
+# Threads of this server process that drive the queued fits. The heavy lifting
+# happens in the compute process pool, so a few threads are enough
+_executor = None
+_executor_lock = threading.Lock()
+
+# Seconds between the database checks of a running job
+HEARTBEAT_INTERVAL = 2
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "OPTIMIZATION_JOB_WORKERS", 2),
+                thread_name_prefix="optimization-job",
+            )
+        return _executor
+
+
+def submit_job(payload, owner):
+    job = OptimizationJob.objects.create(payload=payload, owner=owner)
+    get_executor().submit(run_job, job.id)
+    return job
+
+
+def cancel_job(job):
+    # Queued jobs are cancelled right away, running ones stop after the current
+    # generation
+    if job.status in ("queued", "running"):
+        OptimizationJob.objects.filter(pk=job.pk).update(cancel_requested=True)
+        OptimizationJob.objects.filter(pk=job.pk, status="queued").update(
+            status="cancelled", finished_at=timezone.now()
+        )
+    job.refresh_from_db()
+    return job
+
+
+def resume_jobs():
+    # Called when a server starts. Jobs whose server stopped while running them
+    # are queued again, then every queued job is handed to this server's threads
+    timeout = getattr(settings, "OPTIMIZATION_JOB_HEARTBEAT_TIMEOUT", 120)
+    stale = timezone.now() - timedelta(seconds=timeout)
+    try:
+        OptimizationJob.objects.filter(
+            Q(heartbeat_at__lt=stale) | Q(heartbeat_at__isnull=True), status="running"
+        ).update(status="queued", started_at=None, heartbeat_at=None)
+        job_ids = list(
+            OptimizationJob.objects.filter(status="queued").values_list("id", flat=True)
+        )
+    except DatabaseError:
+        # The table does not exist before the first migration
+        logger.warning("Optimization jobs were not resumed", exc_info=True)
+        return []
+
+    for job_id in job_ids:
+        get_executor().submit(run_job, job_id)
+    return job_ids
+
+
+class JobMonitor:
+    # Callback of the genetic algorithm. It refreshes the heartbeat of the job
+    # and stops the fit once a cancellation was requested from any server process
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last_check = 0.0
+        self.cancelled = False
+
+    def __call__(self, generation):
+        now = time.monotonic()
+        if now - self.last_check >= HEARTBEAT_INTERVAL:
+            self.last_check = now
+            OptimizationJob.objects.filter(pk=self.job_id).update(
+                heartbeat_at=timezone.now()
+            )
+            self.cancelled = OptimizationJob.objects.filter(
+                pk=self.job_id, cancel_requested=True
+            ).exists()
+        return self.cancelled
+
+
+def run_job(job_id):
+    close_old_connections()
+    try:
+        # Only one server process gets to move a queued job to running
+        now = timezone.now()
+        started = OptimizationJob.objects.filter(
+            pk=job_id, status="queued", cancel_requested=False
+        ).update(status="running", started_at=now, heartbeat_at=now)
+        if not started:
+            return
+
+        job = OptimizationJob.objects.get(pk=job_id)
+        monitor = JobMonitor(job_id)
+        try:
+            payload = load_request_dataset(job.payload, "experimentalData", job.owner)
+            result = run_parameter_optimization(payload, callback=monitor)
+        except (ValueError, TypeError, Dataset.DoesNotExist) as e:
+            job.status = "failed"
+            job.error = str(e)
+        except Exception:
+            # The details stay in the server log
+            logger.exception("Optimization job %s failed", job_id)
+            job.status = "failed"
+            job.error = "The optimization failed because of an internal error"
+        else:
+            # A cancelled fit keeps the best result found so far
+            job.status = "cancelled" if monitor.cancelled else "succeeded"
+            # The database keeps the arrays of the result as JSON lists
+            job.result = {
+                key: value.tolist() if isinstance(value, np.ndarray) else value
+                for key, value in result.items()
+            }
+        job.finished_at = timezone.now()
+        job.save(update_fields=["status", "result", "error", "finished_at"])
+    finally:
+        connection.close()
@@ -0,0 +1,744 @@
+import warnings
+from math import comb
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from scipy.optimize import minimize
+from scipy.stats import qmc
+from joblib import Parallel, delayed
+from sklearn.exceptions import ConvergenceWarning, UndefinedMetricWarning
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import KFold, ShuffleSplit
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from api.utilis.cache import get_cache, make_key
+from api.utilis.parallel import get_worker_count
+
+# Regressors of the sweep, the regularized ones are tried with every alpha
+REGULARIZATIONS = ("none", "ridge", "lasso")
+
+# Metrics of the cross-validation, the leaderboard is ranked by one of them
+SCORINGS = ("mse", "rmse", "mae", "r2")
+
+# Defaults of the sweep
+DEFAULT_DEGREES = (1, 2, 3)
+DEFAULT_ALPHAS = (0.001, 0.01, 0.1, 1.0, 10.0)
+DEFAULT_FOLDS = 5
+MAX_DEGREE = 10
+
+# Largest number of polynomial terms, as many as degree 4 of 10 factors
+MAX_FEATURES = 1000
+
+# The predicted optimum is searched from the best points of a Sobol sample of
+# 2 ** OPTIMUM_SAMPLE_POWER compositions
+OBJECTIVES = ("maximize", "minimize")
+OPTIMUM_SAMPLE_POWER = 10
+OPTIMUM_STARTS = 8
+
+# Largest number of response surfaces of one request
+MAX_SURFACES = 45
+
+# Rows read at once when the data is loaded into memory
+DEFAULT_CHUNK_ROWS = 65536
+
+# Points of each axis of the response surfaces
+DEFAULT_RESOLUTION = 100
+
+
+def get_factor_names(la_params):
+    # Independent variables of a media-optimization request, "x_vars" or the
+    # pair "x_var" and "z_var", and the dependent variable. Raises ValueError
+    names = la_params.get("x_vars")
+    if names is None:
+        names = [la_params.get("x_var"), la_params.get("z_var")]
+    names = [str(name) for name in names if name is not None]
+    y_name = la_params.get("y_var")
+    if len(names) < 2:
+        raise ValueError("Give at least two independent variables")
+    if len(set(names)) != len(names) or y_name in names:
+        raise ValueError("The variables of the analysis must be different")
+    if y_name is None:
+        raise ValueError("Give the dependent variable y_var")
+    return names, str(y_name)
+
+
+def get_media_columns(experimental_data, names):
+    # Columns of the variables by name. Rows are converted to a pandas
+    # DataFrame, the memory-mapped columns of a dataset are used as they are
+    if isinstance(experimental_data, dict):
+        columns = experimental_data
+    else:
+        columns = pd.DataFrame(experimental_data or [])
+    for name in names:
+        if name not in columns:
+            raise ValueError(f"The data has no column {name}")
+    columns = {
+        name: (
+            columns[name].to_numpy()
+            if isinstance(columns, pd.DataFrame)
+            else columns[name]
+        )
+        for name in names
+    }
+    if len({len(values) for values in columns.values()}) > 1:
+        raise ValueError("The columns of the analysis must have the same length")
+    return columns
+
+
+def iter_media_chunks(columns, names, y_name, chunk_rows=None):
+    # Independent variables, shaped (rows, len(names)), and dependent variable
+    # of consecutive chunks of rows, leaving out rows with missing values. A
+    # memory-mapped dataset is read from disk one chunk at a time
+    chunk_rows = chunk_rows or DEFAULT_CHUNK_ROWS
+    n_rows = len(columns[y_name])
+    for start in range(0, n_rows, chunk_rows):
+        try:
+            X = np.column_stack(
+                [
+                    np.asarray(columns[name][start : start + chunk_rows], dtype=float)
+                    for name in names
+                ]
+            )
+            y = np.asarray(columns[y_name][start : start + chunk_rows], dtype=float)
+        except (ValueError, TypeError):
+            raise ValueError("The columns of the data must hold numbers")
+        complete = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+        yield X[complete], y[complete]
+
+
+def get_media_data(experimental_data, la_params):
+    # Independent variables, shaped (rows, factors), and dependent variable of
+    # a media-optimization request in memory, for the sweep. Raises ValueError
+    names, y_name = get_factor_names(la_params)
+    columns = get_media_columns(experimental_data, names + [y_name])
+    chunks = list(iter_media_chunks(columns, names, y_name))
+    if not chunks:
+        return np.empty((0, len(names))), np.empty(0)
+    return np.vstack([X for X, _ in chunks]), np.concatenate([y for _, y in chunks])
+
+
+class RunningMoments:
+    # Count, mean and sum of squared deviations of columns updated chunk by
+    # chunk with the pairwise formula of Chan et al., which stays accurate
+    # where the sums of squares would cancel
+
+    def __init__(self, n_columns):
+        self.count = 0
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).reshape(len(values), -1)
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = mean - self.mean
+        self.m2 = self.m2 + m2 + delta**2 * self.count * n / total
+        self.mean = self.mean + delta * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        return self.m2 / max(self.count, 1)
+
+
+class ResponseSurfaceModel:
+    # Polynomial regression of media-optimization: optional standardization of
+    # the factors, PolynomialFeatures and least squares with an intercept,
+    # fitted from chunks of rows so that the data never has to be in memory.
+    # Instead of adding up the normal equations, whose matrix squares the
+    # condition number of the polynomial features, each chunk updates the
+    # triangular factor of a QR factorization of [1, features, y], a matrix
+    # of (features + 2) ** 2 values
+
+    def __init__(self, n_factors, degree, normalization):
+        self.degree = int(degree)
+        self.normalization = bool(normalization)
+        self.poly = PolynomialFeatures(degree=self.degree, include_bias=False)
+        self.poly.fit(np.zeros((1, n_factors)))
+        self.n_features = self.poly.n_output_features_
+        self.mean = np.zeros(n_factors)
+        self.scale = np.ones(n_factors)
+        self.R = np.zeros((0, self.n_features + 2))
+        self.coef = None
+        self.intercept = 0.0
+
+    def set_scaler(self, moments):
+        # Standardization of StandardScaler, constant factors keep a scale of 1
+        self.mean = moments.mean
+        std = np.sqrt(moments.variance)
+        self.scale = np.where(std > 0, std, 1.0)
+
+    def features(self, X):
+        return self.poly.transform(
+            (np.asarray(X, dtype=float) - self.mean) / self.scale
+        )
+
+    def partial_fit(self, X, y):
+        if len(y) == 0:
+            return
+        block = np.column_stack([np.ones(len(y)), self.features(X), y])
+        self.R = np.linalg.qr(np.vstack([self.R, block]), mode="r")
+
+    def solve(self):
+        # Least squares of the accumulated rows, minimum norm when the
+        # features are dependent, like LinearRegression. The factor is dropped
+        # afterwards, which keeps the cached models small
+        p = self.n_features + 1
+        solution = np.linalg.lstsq(self.R[:p, :p], self.R[:p, p], rcond=None)[0]
+        self.intercept, self.coef = float(solution[0]), solution[1:]
+        self.R = None
+
+    def predict(self, X):
+        return self.intercept + self.features(X) @ self.coef
+
+    def surface(self, i, j, center, x_axis, z_axis):
+        # Predictions over the grid of factors i and j, the others fixed at
+        # center, shaped (len(z_axis), len(x_axis)). With the other factors
+        # fixed the polynomial is one of u_i and u_j, whose coefficients are
+        # gathered in a (degree + 1) ** 2 matrix, so the grid is evaluated
+        # with two Vandermonde matrices instead of expanding every point
+        u = (np.asarray(center, dtype=float) - self.mean) / self.scale
+        powers = self.poly.powers_
+        others = [k for k in range(len(u)) if k not in (i, j)]
+        terms = self.coef * np.prod(u[others] ** powers[:, others], axis=1)
+        coefficients = np.zeros((self.degree + 1, self.degree + 1))
+        np.add.at(coefficients, (powers[:, j], powers[:, i]), terms)
+        coefficients[0, 0] += self.intercept
+
+        exponents = np.arange(self.degree + 1)
+        u_x = (np.asarray(x_axis, dtype=float) - self.mean[i]) / self.scale[i]
+        u_z = (np.asarray(z_axis, dtype=float) - self.mean[j]) / self.scale[j]
+        return (
+            (u_z[:, None] ** exponents) @ coefficients @ (u_x[:, None] ** exponents).T
+        )
+
+
+def find_optimum(predict, low, high, objective="maximize", seed=0):
+    # Composition of the largest (or smallest) prediction within the range of
+    # the data: L-BFGS-B from the best points of a scrambled Sobol sample, so
+    # that no dense grid of the factors is evaluated
+    sign = -1.0 if objective == "maximize" else 1.0
+    span = high - low
+    sample = (
+        low
+        + qmc.Sobol(d=len(low), scramble=True, seed=seed).random_base2(
+            OPTIMUM_SAMPLE_POWER
+        )
+        * span
+    )
+    starts = sample[np.argsort(sign * predict(sample), kind="stable")[:OPTIMUM_STARTS]]
+
+    best, best_value = starts[0], sign * predict(starts[:1])[0]
+    for start in starts:
+        result = minimize(
+            lambda x: sign * predict(x[None, :])[0],
+            start,
+            method="L-BFGS-B",
+            bounds=list(zip(low, high)),
+        )
+        if result.fun < best_value:
+            best, best_value = np.clip(result.x, low, high), result.fun
+    return best, sign * best_value
+
+
+def get_surface_pairs(la_params, names):
+    # Pairs of factors whose response surfaces are returned, the first two
+    # factors unless "surfaces" lists pairs of names
+    pairs = la_params.get("surfaces") or [names[:2]]
+    if len(pairs) > MAX_SURFACES:
+        raise ValueError(f"At most {MAX_SURFACES} surfaces can be returned")
+    indices = []
+    for pair in pairs:
+        if (
+            len(pair) != 2
+            or pair[0] == pair[1]
+            or any(name not in names for name in pair)
+        ):
+            raise ValueError("Each surface needs two different independent variables")
+        indices.append((names.index(pair[0]), names.index(pair[1])))
+    return indices
+
+
+def get_resolution(la_params):
+    # Points of the axes of the response surfaces, one number for both axes
+    # or [x points, z points]. Raises ValueError
+    resolution = la_params.get("resolution", DEFAULT_RESOLUTION)
+    if not isinstance(resolution, (list, tuple)):
+        resolution = [resolution, resolution]
+    max_resolution = getattr(settings, "MEDIA_MAX_RESOLUTION", 1000)
+    try:
+        resolution = [int(points) for points in resolution]
+    except (ValueError, TypeError):
+        resolution = []
+    if len(resolution) != 2 or not all(
+        2 <= points <= max_resolution for points in resolution
+    ):
+        raise ValueError(f"resolution must be between 2 and {max_resolution} points")
+    return resolution
+
+
+def get_window(la_params, names, low, high):
+    # Range of each factor on the axes of the surfaces: the range of the data
+    # unless "window" zooms in with {name: [min, max]}. Raises ValueError
+    low, high = np.array(low, dtype=float), np.array(high, dtype=float)
+    for name, bounds in (la_params.get("window") or {}).items():
+        if name not in names:
+            raise ValueError(
+                f"The window names {name}, which is not an independent variable"
+            )
+        try:
+            lower, upper = (float(value) for value in bounds)
+        except (ValueError, TypeError):
+            raise ValueError(f"The window of {name} must be [min, max]")
+        if not lower < upper:
+            raise ValueError(f"The window of {name} must have min < max")
+        index = names.index(name)
+        low[index], high[index] = lower, upper
+    return low, high
+
+
+def get_response_surface(model, low, high, names, pair, center, resolution):
+    # Surface of two factors with the others fixed at center: the two axes and
+    # the predictions flattened row by row, one row per point of the z axis
+    i, j = pair
+    x_axis = np.linspace(low[i], high[i], resolution[0])
+    z_axis = np.linspace(low[j], high[j], resolution[1])
+    y_surf = model.surface(i, j, center, x_axis, z_axis)
+    return {
+        "x_var": names[i],
+        "z_var": names[j],
+        "fixed": {
+            names[k]: float(center[k]) for k in range(len(names)) if k not in (i, j)
+        },
+        "x_axis": x_axis.tolist(),
+        "z_axis": z_axis.tolist(),
+        "y_surf": y_surf.ravel().tolist(),
+        "shape": [len(z_axis), len(x_axis)],
+    }
+
+
+def get_objective(la_params):
+    objective = la_params.get("objective", "maximize")
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {', '.join(OBJECTIVES)}")
+    return objective
+
+
+def get_surfaces(model, low, high, names, la_params, optimum):
+    # Response surfaces through the optimum over the window of the request
+    pairs = get_surface_pairs(la_params, names)
+    resolution = get_resolution(la_params)
+    window_low, window_high = get_window(la_params, names, low, high)
+    center = [optimum["composition"][name] for name in names]
+    return [
+        get_response_surface(
+            model, window_low, window_high, names, pair, center, resolution
+        )
+        for pair in pairs
+    ]
+
+
+def get_optimum(model, low, high, names, objective, seed):
+    composition, value = find_optimum(model.predict, low, high, objective, seed)
+    return {
+        "objective": objective,
+        "composition": dict(zip(names, composition.tolist())),
+        "predicted": float(value),
+    }
+
+
+def fit_media_model(
+    columns, names, y_name, degree, normalization, test_size, random_state
+):
+    # Fits the response surface reading the data in chunks: a first pass
+    # counts the complete rows and the range of each factor, a second computes
+    # the standardization on the training rows, a third fits and a last one
+    # scores the test rows. Returns the model, the range of the factors, the
+    # number of rows and the metrics of the test rows
+    model = ResponseSurfaceModel(len(names), degree, normalization)
+    if model.n_features > MAX_FEATURES:
+        raise ValueError(
+            f"The polynomial has {model.n_features} terms, "
+            f"at most {MAX_FEATURES} are allowed"
+        )
+    # Chunks of about MEDIA_CHUNK_VALUES features
+    chunk_values = getattr(settings, "MEDIA_CHUNK_VALUES", 2**22)
+    chunk_rows = max(1024, chunk_values // (model.n_features + 2))
+
+    def chunks():
+        return iter_media_chunks(columns, names, y_name, chunk_rows)
+
+    n_rows = 0
+    low, high = np.full(len(names), np.inf), np.full(len(names), -np.inf)
+    for X, _ in chunks():
+        if len(X):
+            n_rows += len(X)
+            low, high = np.minimum(low, X.min(axis=0)), np.maximum(high, X.max(axis=0))
+    if n_rows < 2:
+        raise ValueError("The analysis needs at least two complete rows")
+
+    # The rows of train_test_split, as a mask of the test rows
+    split = ShuffleSplit(n_splits=1, test_size=test_size, random_state=random_state)
+    test = np.zeros(n_rows, dtype=bool)
+    test[next(split.split(np.empty((n_rows, 1))))[1]] = True
+
+    def split_chunks():
+        offset = 0
+        for X, y in chunks():
+            in_test = test[offset : offset + len(y)]
+            offset += len(y)
+            yield X, y, in_test
+
+    if normalization:
+        moments = RunningMoments(len(names))
+        for X, _, in_test in split_chunks():
+            moments.update(X[~in_test])
+        model.set_scaler(moments)
+
+    for X, y, in_test in split_chunks():
+        model.partial_fit(X[~in_test], y[~in_test])
+    model.solve()
+
+    # Metrics of the test rows, r2 as r2_score, which gives 0 for a constant
+    # target that is not predicted exactly
+    squared_error, absolute_error = 0.0, 0.0
+    target = RunningMoments(1)
+    for X, y, in_test in split_chunks():
+        residuals = y[in_test] - model.predict(X[in_test])
+        squared_error += float(residuals @ residuals)
+        absolute_error += float(np.abs(residuals).sum())
+        target.update(y[in_test])
+    mse = squared_error / target.count
+    total = float(target.m2[0])
+    if total > 0:
+        r2 = 1 - squared_error / total
+    else:
+        r2 = 1.0 if squared_error == 0 else 0.0
+
+    return {
+        "model": model,
+        "low": low,
+        "high": high,
+        "n_rows": n_rows,
+        "metrics": {
+            "r2": r2,
+            "mae": absolute_error / target.count,
+            "mse": mse,
+            "rmse": np.sqrt(mse),
+        },
+    }
+
+
+def run_media_optimization(data):
+    # Response surface of a media-optimization request. The fitted model is
+    # cached by the content of the data, the hash of a dataset, and the
+    # settings of the fit, so that rendering the surfaces again at another
+    # resolution, window or through other factors skips the fit. Raises
+    # ValueError
+    la_params = data.get("LAParams") or {}
+    names, y_name = get_factor_names(la_params)
+    experimental_data = data.get("experimentalMCData")
+    columns = get_media_columns(experimental_data, names + [y_name])
+    try:
+        degree = int(la_params["polynomial_degree"])
+        test_size = float(la_params["test_size"])
+        random_state = int(la_params["random_state"])
+    except (KeyError, ValueError, TypeError):
+        raise ValueError("LAParams needs polynomial_degree, test_size and random_state")
+    normalization = bool(la_params.get("normalization"))
+    if not 1 <= degree <= MAX_DEGREE:
+        raise ValueError(f"polynomial_degree must be between 1 and {MAX_DEGREE}")
+    objective = get_objective(la_params)
+
+    # Datasets are identified by their hash instead of their values
+    content_hash = getattr(experimental_data, "content_hash", None)
+    key = make_key(
+        "media-fit",
+        {"dataset": content_hash} if content_hash else columns,
+        names,
+        y_name,
+        degree,
+        normalization,
+        test_size,
+        random_state,
+    )
+    cache = get_cache()
+    fit = cache.get(key)
+    if fit is None:
+        fit = fit_media_model(
+            columns, names, y_name, degree, normalization, test_size, random_state
+        )
+        cache.set(key, fit)
+
+    optimum_key = make_key("media-optimum", key, objective)
+    optimum = cache.get(optimum_key)
+    if optimum is None:
+        optimum = get_optimum(
+            fit["model"], fit["low"], fit["high"], names, objective, random_state
+        )
+        cache.set(optimum_key, optimum)
+
+    model = fit["model"]
+    surfaces = get_surfaces(model, fit["low"], fit["high"], names, la_params, optimum)
+
+    # PolynomialFeatures of the first version had a bias column, whose
+    # coefficient is zero next to the intercept
+    coefficients = model.coef.tolist()
+    feature_names = model.poly.get_feature_names_out(names).tolist()
+    if degree > 1:
+        coefficients = [0.0] + coefficients
+        feature_names = ["1"] + feature_names
+
+    return {
+        "response_surface": surfaces[0],
+        "additional_surfaces": surfaces[1:],
+        "optimum": optimum,
+        "model_params": {
+            "coefficients": coefficients,
+            "intercept": model.intercept,
+            "feature_names": feature_names,
+        },
+        "model_metrics": fit["metrics"],
+        "data_split": {
+            "test_size": test_size,
+            "random_state": random_state,
+            "rows": fit["n_rows"],
+        },
+        "features": {
+            "dependent_variable": y_name,
+            "independent_variables": names,
+        },
+        "preprocessing": {
+            "normalization": la_params.get("normalization"),
+            "polynomial_degree": degree,
+        },
+    }
+
+
+def get_sweep_options(sweep_params, la_params, n_rows, n_variables):
+    # Reads the grid and the cross-validation of a sweep. Raises ValueError
+    sweep_params = sweep_params or {}
+    degrees = sorted(
+        {int(degree) for degree in sweep_params.get("degrees", DEFAULT_DEGREES)}
+    )
+    normalizations = sorted(
+        {bool(value) for value in sweep_params.get("normalization", (False, True))}
+    )
+    regularizations = list(
+        dict.fromkeys(sweep_params.get("regularization", REGULARIZATIONS))
+    )
+    alphas = sorted(
+        {float(alpha) for alpha in sweep_params.get("alphas", DEFAULT_ALPHAS)}
+    )
+    folds = int(sweep_params.get("folds", DEFAULT_FOLDS))
+    scoring = sweep_params.get("scoring", "mse")
+
+    if not degrees or not 1 <= degrees[0] <= degrees[-1] <= MAX_DEGREE:
+        raise ValueError(f"degrees must be between 1 and {MAX_DEGREE}")
+    # Every fold expands the factors to the highest degree
+    terms = n_features(n_variables, degrees[-1])
+    if terms > MAX_FEATURES:
+        raise ValueError(
+            f"The polynomial has {terms} terms, at most {MAX_FEATURES} are allowed"
+        )
+    if not normalizations:
+        raise ValueError("normalization needs at least one value")
+    if not regularizations or any(r not in REGULARIZATIONS for r in regularizations):
+        raise ValueError(f"regularization must be among {', '.join(REGULARIZATIONS)}")
+    if any(r != "none" for r in regularizations) and (not alphas or alphas[0] <= 0):
+        raise ValueError("alphas must be positive")
+    if scoring not in SCORINGS:
+        raise ValueError(f"scoring must be one of {', '.join(SCORINGS)}")
+    if not 2 <= folds <= n_rows:
+        raise ValueError("folds must be between 2 and the number of rows")
+
+    regressors = [
+        (regularization, alpha)
+        for regularization in regularizations
+        for alpha in ([None] if regularization == "none" else alphas)
+    ]
+    n_fits = len(degrees) * len(normalizations) * len(regressors) * folds
+    max_fits = getattr(settings, "MEDIA_SWEEP_MAX_FITS", 20000)
+    if n_fits > max_fits:
+        raise ValueError(f"The sweep holds at most {max_fits} fits")
+
+    return {
+        "degrees": degrees,
+        "normalizations": normalizations,
+        "regressors": regressors,
+        "folds": folds,
+        "scoring": scoring,
+        "random_state": int(
+            sweep_params.get("random_state", la_params.get("random_state", 0))
+        ),
+        "n_jobs": sweep_params.get("n_jobs", -1),
+    }
+
+
+def make_regressor(regularization, alpha):
+    if regularization == "ridge":
+        return Ridge(alpha=alpha)
+    if regularization == "lasso":
+        return Lasso(alpha=alpha, max_iter=10000)
+    return LinearRegression()
+
+
+def n_features(n_variables, degree):
+    # Columns of PolynomialFeatures without the bias. They are sorted by
+    # degree, so the expansion of a lower degree is the first columns of a
+    # higher one
+    return comb(n_variables + degree, degree) - 1
+
+
+def get_metrics(y_true, y_pred):
+    mse = mean_squared_error(y_true, y_pred)
+    return {
+        "mse": mse,
+        "rmse": np.sqrt(mse),
+        "mae": mean_absolute_error(y_true, y_pred),
+        "r2": r2_score(y_true, y_pred),
+    }
+
+
+def score_fold(X, y, train, test, normalization, degrees, regressors):
+    # Metrics of every candidate with this normalization on one fold, in the
+    # order of degrees and regressors. The expansion of the largest degree is
+    # computed once and shared by every candidate
+    X_train, X_test = X[train], X[test]
+    if normalization:
+        scaler = StandardScaler().fit(X_train)
+        X_train, X_test = scaler.transform(X_train), scaler.transform(X_test)
+    poly = PolynomialFeatures(degree=max(degrees), include_bias=False)
+    F_train, F_test = poly.fit_transform(X_train), poly.transform(X_test)
+
+    scores = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        warnings.simplefilter("ignore", UndefinedMetricWarning)
+        for degree in degrees:
+            n = n_features(X.shape[1], degree)
+            for regularization, alpha in regressors:
+                model = make_regressor(regularization, alpha)
+                model.fit(F_train[:, :n], y[train])
+                scores.append(get_metrics(y[test], model.predict(F_test[:, :n])))
+    return scores
+
+
+def fit_candidate(X, y, candidate):
+    # Fits one candidate on every row, returned as a ResponseSurfaceModel
+    surface = ResponseSurfaceModel(
+        X.shape[1], candidate["polynomial_degree"], candidate["normalization"]
+    )
+    if candidate["normalization"]:
+        scaler = StandardScaler().fit(X)
+        surface.mean, surface.scale = scaler.mean_, scaler.scale_
+    regressor = make_regressor(candidate["regularization"], candidate["alpha"])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        regressor.fit(surface.features(X), y)
+    surface.intercept, surface.coef = float(regressor.intercept_), regressor.coef_
+    return surface
+
+
+def run_media_sweep(data):
+    # k-fold cross-validation of every polynomial degree, normalization and
+    # regularization of the grid. One task per fold and normalization runs on a
+    # joblib pool, the folds are the same for every candidate. Returns the
+    # candidates ranked by their mean score and the response surface of the
+    # best one refitted on every row. Raises ValueError
+    la_params = data.get("LAParams") or {}
+    X, y = get_media_data(data.get("experimentalMCData") or [], la_params)
+    options = get_sweep_options(data.get("sweepParams"), la_params, len(y), X.shape[1])
+    degrees, regressors = options["degrees"], options["regressors"]
+
+    splits = list(
+        KFold(
+            n_splits=options["folds"],
+            shuffle=True,
+            random_state=options["random_state"],
+        ).split(X)
+    )
+    tasks = [
+        (normalization, train, test)
+        for normalization in options["normalizations"]
+        for train, test in splits
+    ]
+    results = Parallel(n_jobs=get_worker_count(options["n_jobs"]))(
+        delayed(score_fold)(X, y, train, test, normalization, degrees, regressors)
+        for normalization, train, test in tasks
+    )
+
+    # Metrics of each candidate over the folds
+    leaderboard = []
+    for n, normalization in enumerate(options["normalizations"]):
+        folds = results[n * len(splits) : (n + 1) * len(splits)]
+        index = 0
+        for degree in degrees:
+            for regularization, alpha in regressors:
+                entry = {
+                    "polynomial_degree": degree,
+                    "normalization": normalization,
+                    "regularization": regularization,
+                    "alpha": alpha,
+                }
+                for metric in SCORINGS:
+                    values = [fold[index][metric] for fold in folds]
+                    entry[metric] = float(np.mean(values))
+                    entry[f"{metric}_std"] = float(np.std(values))
+                leaderboard.append(entry)
+                index += 1
+
+    # Best first, NaN scores last
+    scoring = options["scoring"]
+    sign = -1 if scoring == "r2" else 1
+    leaderboard.sort(
+        key=lambda entry: (
+            np.isnan(entry[scoring]),
+            sign * np.nan_to_num(entry[scoring]),
+        )
+    )
+    for rank, entry in enumerate(leaderboard, start=1):
+        entry["rank"] = rank
+        # JSON has no NaN, e.g. r2 on test folds of a single row
+        for key, value in entry.items():
+            if isinstance(value, float) and np.isnan(value):
+                entry[key] = None
+
+    best = leaderboard[0]
+    model = fit_candidate(X, y, best)
+    names, y_name = get_factor_names(la_params)
+    low, high = X.min(axis=0), X.max(axis=0)
+    optimum = get_optimum(
+        model, low, high, names, get_objective(la_params), options["random_state"]
+    )
+    surfaces = get_surfaces(model, low, high, names, la_params, optimum)
+
+    return {
+        "leaderboard": leaderboard,
+        "best": best,
+        "response_surface": surfaces[0],
+        "additional_surfaces": surfaces[1:],
+        "optimum": optimum,
+        "model_params": {
+            "coefficients": model.coef.tolist(),
+            "intercept": model.intercept,
+            "feature_names": model.poly.get_feature_names_out(names).tolist(),
+        },
+        "model_metrics": {metric: best[metric] for metric in SCORINGS},
+        "cross_validation": {
+            "folds": options["folds"],
+            "random_state": options["random_state"],
+            "scoring": scoring,
+            "candidates": len(leaderboard),
+        },
+        "features": {
+            "dependent_variable": y_name,
+            "independent_variables": names,
+        },
+    }
@@ -0,0 +1,511 @@
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from scipy.optimize import least_squares
+
+from api.optimization.utils import (
+    FAILED_RESIDUAL,
+    get_fit_params,
+    get_refinement_starts,
+    get_search_options,
+    run_global_search,
+)
+from api.optimization.residuals import (
+    get_residual_data,
+    residual_mask,
+    residual_scale,
+    weighted_error,
+)
+from api.utilis.cache import get_cache, make_key
+from api.utilis.model_registry import get_model
+from api.utilis.numerical_methods import (
+    get_solver_options,
+    perform_ensemble_simulation,
+    perform_sensitivity_simulation,
+    perform_simulation,
+)
+from api.utilis.parallel import (
+    SharedArray,
+    attach_shared_array,
+    get_worker_count,
+    map_population,
+)
+
+# A request fits many experiments when "experimentalData" is a list of
+# {"t", "x", "s", "p"} series, optionally with a "name" and a "weight". Each
+# series is read like the data of a single fit, with its own times per
+# variable, missing values and "initial", and "residualParams" applies to every
+# experiment: the objective is the weighted sum of their objectives. Every
+# parameter of "kineticData" is shared by the experiments unless it has
+# "shared": false, in which case it gets one optimization variable per
+# experiment, or one fixed value per experiment when "fixed" is a list. The
+# models are autonomous, so each experiment is simulated from its first point
+# on its own times shifted to start at zero
+
+
+def get_experiments(experimental_data, residual_params=None):
+    # Reads the experiments of a multi-experiment request. Raises ValueError
+    if not isinstance(experimental_data, list) or len(experimental_data) == 0:
+        raise ValueError("experimentalData must be a non-empty list of experiments")
+    max_experiments = getattr(settings, "MULTI_EXPERIMENT_MAX_EXPERIMENTS", 100)
+    if len(experimental_data) > max_experiments:
+        raise ValueError(f"A fit holds at most {max_experiments} experiments")
+
+    experiments = []
+    for i, experiment in enumerate(experimental_data):
+        if not isinstance(experiment, dict):
+            raise ValueError(f"Experiment {i} needs t, x, s and p")
+        try:
+            t, y, variable_weights = get_residual_data(experiment, residual_params)
+        except ValueError as e:
+            raise ValueError(f"Experiment {i}: {e}")
+        weight = float(experiment.get("weight", 1.0))
+        if not weight >= 0:
+            raise ValueError(f"The weight of experiment {i} must be non-negative")
+        experiments.append(
+            {
+                "name": experiment.get("name", f"Experiment {i + 1}"),
+                "t": t,
+                "y": y,
+                "variable_weights": variable_weights,
+                "weight": weight,
+            }
+        )
+    return experiments
+
+
+def pack_experiments(experiments):
+    # Common time grid of all the shifted experiments and the measurements on it,
+    # shaped (experiments, 3, len(t_union)) with NaN where an experiment has no
+    # point
+    shifted = [experiment["t"] - experiment["t"][0] for experiment in experiments]
+    t_union = np.unique(np.concatenate(shifted))
+    observed = np.full((len(experiments), 3, len(t_union)), np.nan)
+    for i, (t, experiment) in enumerate(zip(shifted, experiments)):
+        observed[i][:, np.searchsorted(t_union, t)] = experiment["y"]
+    return t_union, observed
+
+
+def get_layout(kinetic_data, n_experiments):
+    # Maps the optimization variables to the kinetic parameters of every
+    # experiment. Returns the search ranges shaped (variables, 2), the fixed
+    # parameters shaped (experiments, parameters) and, for every variable, its
+    # parameter index and experiment (None when shared), in the order of
+    # get_optimized_param_names
+    model = kinetic_data.get("model")
+    n_params = len(get_model(model).parameters)
+    params = [(name, value) for name, value in kinetic_data.items() if name != "model"]
+    if len(params) != n_params:
+        raise ValueError(f"The {model} model takes {n_params} kinetic parameters")
+
+    varbound = []
+    fixed = np.zeros((n_experiments, len(params)))
+    variables = []
+    for index, (name, value) in enumerate(params):
+        shared = value.get("shared", True)
+        if value["optimize"]:
+            experiments = [None] if shared else range(n_experiments)
+            for experiment in experiments:
+                varbound.append([value["min"], value["max"]])
+                variables.append((index, experiment))
+        else:
+            values = np.asarray(value["fixed"], dtype=float)
+            if values.ndim == 1 and (shared or len(values) != n_experiments):
+                raise ValueError(
+                    f"{name} needs one fixed value, "
+                    "or one per experiment when not shared"
+                )
+            fixed[:, index] = values
+
+    if not variables:
+        raise ValueError("At least one parameter must be optimized")
+    return np.array(varbound, dtype=float), fixed, variables
+
+
+def decode_parameters(population, fixed, variables):
+    # Ordered kinetic parameters of every experiment, shaped
+    # population.shape[:-1] + (experiments, parameters)
+    population = np.asarray(population, dtype=float)
+    ordered = np.broadcast_to(fixed, population.shape[:-1] + fixed.shape).copy()
+    for j, (index, experiment) in enumerate(variables):
+        if experiment is None:
+            ordered[..., :, index] = population[..., j, None]
+        else:
+            ordered[..., experiment, index] = population[..., j]
+    return ordered
+
+
+def experiments_error(
+    population,
+    kinetic_model,
+    fixed,
+    variables,
+    t_union,
+    observed,
+    weights,
+    solver_options,
+    variable_weights,
+):
+    # Weighted sum over the experiments of the objective of each one, for every
+    # individual of the population. variable_weights holds the weight per
+    # squared residual of each variable of each experiment, shaped
+    # (experiments, 3). All the experiments of all the individuals are
+    # simulated together as one ensemble on the common time grid
+    ordered = decode_parameters(population, fixed, variables)
+    n_population, n_experiments = ordered.shape[:2]
+
+    y0 = np.tile(observed[:, :, 0].T, (1, n_population))
+    y_estimated = perform_ensemble_simulation(
+        kinetic_model,
+        y0,
+        t_union,
+        ordered.reshape(n_population * n_experiments, -1),
+        **(solver_options or {}),
+    )
+    y_estimated = y_estimated.reshape(3, n_population, n_experiments, -1)
+    y_estimated = y_estimated.transpose(1, 2, 0, 3)
+
+    # Points an experiment does not have do not count, a failed simulation does
+    measured = ~np.isnan(observed)
+    squares = np.where(measured, (y_estimated - np.nan_to_num(observed)) ** 2, 0)
+    failed = np.isnan(y_estimated).any(axis=(1, 2, 3))
+    errors = np.einsum("pevt,ev->pe", squares, variable_weights) @ weights
+
+    return np.where(failed | ~np.isfinite(errors), np.inf, errors)
+
+
+def experiments_error_task(
+    population,
+    data_descriptor,
+    kinetic_model,
+    fixed,
+    variables,
+    weights,
+    solver_options,
+    variable_weights,
+):
+    # Runs in a pool worker, the common time grid and the measurements are read
+    # from shared memory, see experiments_objective
+    data = attach_shared_array(data_descriptor)
+    t_union, observed = data[0], data[1:].reshape(len(fixed), 3, -1)
+    return experiments_error(
+        population,
+        kinetic_model,
+        fixed,
+        variables,
+        t_union,
+        observed,
+        weights,
+        solver_options,
+        variable_weights,
+    )
+
+
+@contextmanager
+def experiments_objective(
+    kinetic_model,
+    fixed,
+    variables,
+    t_union,
+    observed,
+    weights,
+    solver_options,
+    variable_weights,
+    n_jobs=-1,
+):
+    # Yields the batch objective of the global search, the counterpart of
+    # population_objective. With more than one worker the population is split
+    # across the process pool, which receives the time grid and the
+    # measurements of all the experiments once per fit through shared memory
+    workers = get_worker_count(n_jobs)
+    if workers <= 1:
+        yield lambda population: experiments_error(
+            population,
+            kinetic_model,
+            fixed,
+            variables,
+            t_union,
+            observed,
+            weights,
+            solver_options,
+            variable_weights,
+        )
+        return
+
+    # The time grid is the first row, then the variables of every experiment
+    with SharedArray(np.vstack([t_union, observed.reshape(-1, len(t_union))])) as data:
+        yield lambda population: map_population(
+            experiments_error_task,
+            population,
+            workers,
+            data.descriptor,
+            kinetic_model,
+            fixed,
+            variables,
+            weights,
+            solver_options,
+            variable_weights,
+        )
+
+
+def refine_experiments(
+    start, varbound, kinetic_model, experiments, fixed, variables, max_nfev=50
+):
+    # Gradient-based refinement of the variables of all the experiments, the
+    # counterpart of refine_parameters. The residuals are scaled so that their
+    # sum of squares is the objective, and the Jacobian comes from one
+    # sensitivity solve per experiment. Returns the refined variables and the
+    # number of ODE solves
+    n_solves = 0
+    last = {}
+
+    def solve(params):
+        nonlocal n_solves
+        key = params.tobytes()
+        if last.get("key") != key:
+            ordered = decode_parameters(params, fixed, variables)
+            solutions = []
+            for experiment, experiment_params in zip(experiments, ordered):
+                n_solves += 1
+                with np.errstate(all="ignore"):
+                    sol = perform_sensitivity_simulation(
+                        kinetic_model,
+                        experiment["y"][:, 0],
+                        experiment["t"] - experiment["t"][0],
+                        experiment_params,
+                    )
+                if sol.success and not (
+                    np.all(np.isfinite(sol.y))
+                    and np.all(np.isfinite(sol.sensitivities))
+                ):
+                    sol.success = False
+                solutions.append(sol)
+            last.update(key=key, solutions=solutions)
+        return last["solutions"]
+
+    # Residuals of the measured points of each experiment, scaled like those
+    # of a single fit and by the square root of the weight of the experiment
+    scales = [
+        np.sqrt(experiment["weight"])
+        * residual_scale(experiment["y"], experiment["variable_weights"])
+        for experiment in experiments
+    ]
+    masks = [residual_mask(experiment["y"]) for experiment in experiments]
+
+    def residuals(params):
+        blocks = []
+        for experiment, sol, scale, measured in zip(
+            experiments, solve(params), scales, masks
+        ):
+            if sol.success:
+                blocks.append((scale * (sol.y - experiment["y"])).ravel()[measured])
+            else:
+                blocks.append(np.full(measured.sum(), FAILED_RESIDUAL))
+        return np.concatenate(blocks)
+
+    def jacobian(params):
+        blocks = []
+        for i, (experiment, sol, scale, measured) in enumerate(
+            zip(experiments, solve(params), scales, masks)
+        ):
+            block = np.zeros((measured.sum(), len(params)))
+            if sol.success:
+                # Rows follow the residuals, variable by variable and time by time
+                sensitivities = scale[:, :, None] * sol.sensitivities.transpose(0, 2, 1)
+                sensitivities = sensitivities.reshape(experiment["y"].size, -1)[
+                    measured
+                ]
+                for j, (index, variable_experiment) in enumerate(variables):
+                    if variable_experiment is None or variable_experiment == i:
+                        block[:, j] = sensitivities[:, index]
+            blocks.append(block)
+        return np.vstack(blocks)
+
+    low, high = varbound[:, 0], varbound[:, 1]
+    result = least_squares(
+        residuals,
+        np.clip(start, low, high),
+        jac=jacobian,
+        bounds=(low, high),
+        method="trf",
+        x_scale="jac",
+        max_nfev=max_nfev,
+    )
+    return result.x, n_solves
+
+
+def estimate_experiment_parameters(
+    kinetic_data, experiments, GA_params, solver_options=None, callback=None
+):
+    # Counterpart of estimate_parameters for many experiments. Returns the best
+    # variables, their objective, the ODE solves and the best objective after
+    # every batch of solves
+    kinetic_model = kinetic_data["model"]
+    algorithm_param, optimizer, global_search = get_search_options(GA_params)
+    varbound, fixed, variables = get_layout(kinetic_data, len(experiments))
+
+    t_union, observed = pack_experiments(experiments)
+    weights = np.array([experiment["weight"] for experiment in experiments])
+    variable_weights = np.array(
+        [experiment["variable_weights"] for experiment in experiments]
+    )
+    args = (
+        kinetic_model,
+        fixed,
+        variables,
+        t_union,
+        observed,
+        weights,
+        solver_options,
+        variable_weights,
+    )
+
+    # Every population is simulated as one ensemble of all its experiments,
+    # split across the process pool when there is more than one worker
+    solve_counts = {"global": 0, "local": 0}
+    trace = []
+    with experiments_objective(
+        *args, GA_params.get("n_jobs", -1)
+    ) as population_function:
+
+        def function(population):
+            solve_counts["global"] += len(population) * len(experiments)
+            scores = population_function(population)
+            best_error = trace[-1]["best_error"] if trace else np.inf
+            best_error = float(np.min(scores, initial=best_error))
+            trace.append({"solves": solve_counts["global"], "best_error": best_error})
+            return scores
+
+        population, scores, best_params, error = run_global_search(
+            function,
+            varbound,
+            algorithm_param,
+            GA_params,
+            global_search,
+            callback,
+            solves_per_point=len(experiments),
+        )
+
+    if optimizer == "hybrid":
+        for start in get_refinement_starts(
+            population, scores, GA_params, global_search
+        ):
+            refined, n_solves = refine_experiments(
+                start, varbound, kinetic_model, experiments, fixed, variables
+            )
+            # The refined fit is scored with the same simulation as the global search
+            refined_error = experiments_error(refined[None], *args)[0]
+            solve_counts["local"] += n_solves + len(experiments)
+            if refined_error < error:
+                best_params, error = refined, refined_error
+            trace.append(
+                {
+                    "solves": solve_counts["global"] + solve_counts["local"],
+                    "best_error": error,
+                }
+            )
+
+    solve_counts["total"] = solve_counts["global"] + solve_counts["local"]
+    return best_params, error, solve_counts, trace
+
+
+def run_multi_experiment_optimization(data, callback=None):
+    # Fits the kinetic parameters to every experiment of a parameter-optimization
+    # request and simulates the fitted model of each experiment
+    kinetic_data = data.get("kineticData")
+    GA_params = data.get("GAParams")
+    experimental_data = data.get("experimentalData")
+    residual_params = data.get("residualParams")
+    experiments = get_experiments(experimental_data, residual_params)
+    solver_options = get_solver_options(data.get("solverParams", {}))
+    kinetic_model = kinetic_data.get("model")
+
+    # Identical requests share one fit, the seed is part of the key
+    fit_params = get_fit_params(GA_params)
+    key = make_key(
+        "fit-experiments",
+        kinetic_data,
+        experimental_data,
+        residual_params,
+        fit_params,
+        solver_options,
+    )
+
+    cache = get_cache()
+    fit = cache.get(key)
+    if fit is None:
+        # Fits stopped by the callback are partial and are not cached
+        stopped = False
+
+        def monitor(generation):
+            nonlocal stopped
+            stopped = callback is not None and bool(callback(generation))
+            return stopped
+
+        fit = estimate_experiment_parameters(
+            kinetic_data, experiments, GA_params, solver_options, monitor
+        )
+        if not stopped:
+            cache.set(key, fit)
+
+    best_params, error, solve_counts, trace = fit
+    _, fixed, variables = get_layout(kinetic_data, len(experiments))
+    ordered = decode_parameters(best_params, fixed, variables)
+    param_names = [name for name in kinetic_data if name != "model"]
+
+    # Shared parameters have one value, the others one value per experiment
+    opt_params = {}
+    for (index, experiment), value in zip(variables, best_params):
+        if experiment is None:
+            opt_params[param_names[index]] = value
+        else:
+            opt_params.setdefault(param_names[index], []).append(value)
+
+    results = []
+    for experiment, experiment_params in zip(experiments, ordered):
+        t = experiment["t"]
+        sol = perform_simulation(
+            kinetic_model,
+            experiment["y"][:, 0],
+            t - t[0],
+            experiment_params,
+            **solver_options,
+        )
+        y = sol.y if sol.success else np.full((3, len(t)), np.nan)
+        experiment_error = weighted_error(
+            y[:, None, :], experiment["y"], experiment["variable_weights"]
+        )[0]
+        # Nested arrays go out as JSON lists, NaN as null
+        results.append(
+            {
+                "name": experiment["name"],
+                "time": t.tolist(),
+                "x": np.where(np.isfinite(y[0]), y[0], None).tolist(),
+                "s": np.where(np.isfinite(y[1]), y[1], None).tolist(),
+                "p": np.where(np.isfinite(y[2]), y[2], None).tolist(),
+                "params": dict(zip(param_names, experiment_params.tolist())),
+                "error": (
+                    float(experiment_error) if np.isfinite(experiment_error) else None
+                ),
+                "weight": experiment["weight"],
+            }
+        )
+
+    return {
+        "experiments": results,
+        "best_params": opt_params,
+        "error": error,
+        "model_type": kinetic_model,
+        "solve_counts": solve_counts,
+        # JSON has no infinite errors, before any simulation succeeded
+        "trace": [
+            {
+                "solves": entry["solves"],
+                "best_error": (
+                    entry["best_error"] if np.isfinite(entry["best_error"]) else None
+                ),
+            }
+            for entry in trace
+        ],
+    }
@@ -0,0 +1,133 @@
+import numpy as np
+
+# Measured variables in the order of the model states
+VARIABLES = ("x", "s", "p")
+
+# Scales that divide the residuals of each variable, so that variables of very
+# different magnitude weigh alike
+NORMALIZATIONS = ("none", "range", "std", "max")
+
+# The objective of a fit is
+#   sum over the variables v of w_v / scale_v ** 2 * mean of the squared
+#   residuals of v over the points where v was measured
+# With the default weights of 1 and no normalization, and every variable
+# measured at every time, this is the mse of the whole data set. Each variable
+# may be sampled at its own times ("t_x", "t_s" and "t_p", falling back to
+# "t") and missing values are null. The model is integrated once over the
+# union of all the times and compared at the points each variable has
+
+
+def read_series(experimental_data, variable):
+    t = experimental_data.get(f"t_{variable}", experimental_data.get("t"))
+    values = experimental_data.get(variable)
+    message = f"t and {variable} must be lists of numbers of the same length"
+    try:
+        t = np.asarray(t, dtype=float)
+        if isinstance(values, np.ndarray):
+            values = np.asarray(values, dtype=float)
+        else:
+            values = np.array(
+                [np.nan if value is None else value for value in values], dtype=float
+            )
+    except (ValueError, TypeError):
+        raise ValueError(message)
+    if t.ndim != 1 or values.shape != t.shape:
+        raise ValueError(message)
+    # Points without a time pad the shorter columns of a dataset
+    timed = ~np.isnan(t)
+    t, values = t[timed], values[timed]
+    if not np.all(np.isfinite(t)) or np.any(np.diff(t) <= 0):
+        raise ValueError(f"The times of {variable} must be increasing")
+    return t, values
+
+
+def get_scale(values, normalize):
+    # Scale of the measured values of one variable, 1 when they do not vary
+    if normalize == "range":
+        scale = np.ptp(values)
+    elif normalize == "std":
+        scale = np.std(values)
+    elif normalize == "max":
+        scale = np.max(np.abs(values))
+    else:
+        scale = 1.0
+    return scale if np.isfinite(scale) and scale > 0 else 1.0
+
+
+def get_residual_data(experimental_data, residual_params=None):
+    # Reads the experimental data of a fit. Returns the union of the sampling
+    # times, the measurements on it shaped (3, len(t_eval)) with NaN where a
+    # variable was not measured, and the weight of each variable per squared
+    # residual. The first column holds the initial condition of the model: a
+    # variable not measured at the first time needs its value in
+    # experimentalData["initial"]. Raises ValueError
+    residual_params = residual_params or {}
+    normalize = residual_params.get("normalize", "none")
+    if normalize not in NORMALIZATIONS:
+        raise ValueError(f"normalize must be one of {', '.join(NORMALIZATIONS)}")
+    user_weights = residual_params.get("weights") or {}
+    unknown = set(user_weights) - set(VARIABLES)
+    if unknown:
+        raise ValueError(f"weights can only be given for {', '.join(VARIABLES)}")
+
+    series = [read_series(experimental_data, variable) for variable in VARIABLES]
+    t_eval = np.unique(np.concatenate([t for t, _ in series]))
+    if len(t_eval) < 2:
+        raise ValueError("The experimental data needs at least two times")
+    y_values = np.full((3, len(t_eval)), np.nan)
+    weights = np.zeros(3)
+
+    for i, (variable, (t, values)) in enumerate(zip(VARIABLES, series)):
+        y_values[i, np.searchsorted(t_eval, t)] = values
+        measured = values[~np.isnan(values)]
+        weight = float(user_weights.get(variable, 1.0))
+        if not weight >= 0:
+            raise ValueError(f"The weight of {variable} must be non-negative")
+        # Variables without measurements do not enter the objective
+        if len(measured):
+            weights[i] = weight / (get_scale(measured, normalize) ** 2 * len(measured))
+
+    initial = experimental_data.get("initial") or {}
+    for i, variable in enumerate(VARIABLES):
+        if np.isnan(y_values[i, 0]):
+            if initial.get(variable) is None:
+                raise ValueError(
+                    f"{variable} has no value at t = {t_eval[0]:g}, "
+                    "give its initial value in experimentalData.initial"
+                )
+            # The initial value is not a measurement, its residual is always
+            # zero and its weight was set without it
+            y_values[i, 0] = float(initial[variable])
+
+    return t_eval, y_values, weights
+
+
+def default_weights(y_values):
+    # Weights of the plain mse: one over the number of points of each variable
+    counts = np.sum(~np.isnan(y_values), axis=-1)
+    return np.divide(1.0, counts, out=np.zeros(len(counts)), where=counts > 0)
+
+
+def weighted_error(y_estimated, y_values, weights=None):
+    # Objective of every member of y_estimated, shaped (3, members, len(t_eval)).
+    # Points that were not measured do not count, members whose simulation
+    # failed at a measured point get NaN
+    y_values = np.asarray(y_values, dtype=float)
+    if weights is None:
+        weights = default_weights(y_values)
+    measured = ~np.isnan(y_values)[:, None, :]
+    squares = np.where(measured, (y_estimated - y_values[:, None, :]) ** 2, 0.0)
+    return np.einsum("vmt,v->m", squares, np.asarray(weights, dtype=float))
+
+
+def residual_mask(y_values):
+    # Flat mask of the measured points, in the order of y_values.ravel()
+    return ~np.isnan(np.asarray(y_values, dtype=float)).ravel()
+
+
+def residual_scale(y_values, weights=None):
+    # Factor of the residuals of each point for least squares, so that their
+    # sum of squares is the objective. Shaped (3, 1)
+    if weights is None:
+        weights = default_weights(y_values)
+    return np.sqrt(np.asarray(weights, dtype=float))[:, None]
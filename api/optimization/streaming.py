@@ -0,0 +1,80 @@
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from api.optimization.utils import (
+    get_kinetic_data,
+    get_optimized_param_names,
+    run_parameter_optimization,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def finite_or_none(value):
+    # JSON has no representation for infinite errors
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def iter_parameter_optimization(data):
+    # Runs a parameter optimization in a background thread and yields one event
+    # per generation, then the response of the parameter-optimization endpoint.
+    # Closing the generator, e.g. when the client disconnects, stops the fit
+    events = queue.Queue()
+    stop = threading.Event()
+    experimental_data = data.get("experimentalData")
+    n_experiments = (
+        len(experimental_data) if isinstance(experimental_data, list) else None
+    )
+    kinetic_data = get_kinetic_data(data["kineticData"])
+    names = get_optimized_param_names(kinetic_data, n_experiments)
+    start = time.perf_counter()
+
+    def callback(generation):
+        events.put(
+            {
+                "event": "generation",
+                "generation": generation.generation,
+                "best_error": finite_or_none(generation.best_function),
+                "best_params": dict(zip(names, generation.best_variable.tolist())),
+                "elapsed": time.perf_counter() - start,
+            }
+        )
+        return stop.is_set()
+
+    def run():
+        try:
+            result = run_parameter_optimization(data, callback=callback)
+            events.put(
+                {
+                    "event": "result",
+                    "result": result,
+                    "elapsed": time.perf_counter() - start,
+                }
+            )
+        except (ValueError, TypeError) as e:
+            events.put({"event": "error", "error": str(e)})
+        except Exception:
+            logger.exception("Streamed parameter optimization failed")
+            events.put(
+                {"event": "error", "error": "An error occurred during the optimization"}
+            )
+        finally:
+            events.put(None)
+
+    threading.Thread(
+        target=run, name="parameter-optimization-stream", daemon=True
+    ).start()
+
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        stop.set()
@@ -1,7 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from api.optimization import views
 
+# The async version of the compute views leaves the other requests of an
+# ASGI server responsive during long computations
+async_views = getattr(settings, "ASYNC_COMPUTE_VIEWS", False)
+
 urlpatterns = [
-    path("parameter-optimization/", views.parameter_optimization),
-    path("media-optimization/", views.media_optimization),
+    path(
+        "parameter-optimization/",
+        (
+            views.async_parameter_optimization
+            if async_views
+            else views.parameter_optimization
+        ),
+    ),
+    path("parameter-optimization/stream/", views.stream_parameter_optimization),
+    path("parameter-optimization/jobs/", views.submit_parameter_optimization),
+    path(
+        "parameter-optimization/jobs/<uuid:job_id>/",
+        views.parameter_optimization_job,
+    ),
+    path(
+        "parameter-optimization/jobs/<uuid:job_id>/cancel/",
+        views.cancel_parameter_optimization_job,
+    ),
+    path(
+        "media-optimization/",
+        views.async_media_optimization if async_views else views.media_optimization,
+    ),
+    path("media-optimization/sweep/", views.media_optimization_sweep),
 ]
@@ -1,26 +1,80 @@
+from contextlib import contextmanager
+
 import numpy as np
-from geneticalgorithm import geneticalgorithm as ga
-from api.utilis.numerical_methods import perform_simulation
+from scipy.optimize import least_squares
+from scipy.stats import qmc
+
+from api.optimization.bayesian import BayesianOptimizer, get_bayesian_options
+from api.optimization.bootstrap import bootstrap_parameters, get_bootstrap_options
+from api.optimization.genetic_algorithm import GeneticAlgorithm
+from api.optimization.islands import IslandModel, get_island_options
+from api.optimization.residuals import (
+    get_residual_data,
+    residual_mask,
+    residual_scale,
+    weighted_error,
+)
+from api.utilis.cache import get_cache, make_key
+from api.utilis.model_registry import get_model
+from api.utilis.numerical_methods import (
+    get_solver_options,
+    perform_simulation,
+    perform_ensemble_simulation,
+    perform_sensitivity_simulation,
+)
+from api.utilis.parallel import (
+    SharedArray,
+    attach_shared_array,
+    get_worker_count,
+    map_population,
+)
+
+# Optimizers of estimate_parameters: the genetic algorithm alone, a short
+# global search followed by a gradient-based least-squares refinement, or a
+# surrogate-assisted search within a budget of ODE solves
+OPTIMIZERS = ("ga", "hybrid", "bayesian")
+GLOBAL_SEARCHES = ("ga", "lhs", "bayesian")
+
+# Seed of the global search when the request has none, fits are reproducible
+# so that their results can be cached
+DEFAULT_SEED = 0
+
+# Residuals returned when the model cannot be integrated, large enough for the
+# trust region to step back
+FAILED_RESIDUAL = 1e6
 
 
 def get_ordered_params(params, fixed_params):
-    dimension = len(params)
+    # params is either one vector of optimization parameters or a population
+    # with one vector per row
+    params = np.asarray(params, dtype=float)
+    dimension = params.shape[-1]
     # This array will be used to perform the simulation. It is important order the kinetic parameters for the simulation
-    ordered_params = np.zeros(dimension + len(fixed_params))
+    ordered_params = np.zeros(params.shape[:-1] + (dimension + len(fixed_params),))
     d = 0
 
-    for i in range(len(ordered_params)):
+    for i in range(ordered_params.shape[-1]):
         # If the position i corresponds to a fixed parameter add that value to ordered_params
         if fixed_params.get(i) is not None:
-            ordered_params[i] = fixed_params[i]
+            ordered_params[..., i] = fixed_params[i]
         # If the position i corresponds to a optimization parameter add that value to ordered_parms
         else:
-            ordered_params[i] = params[d]
+            ordered_params[..., i] = params[..., d]
             d += 1
     return ordered_params
 
 
-def mse(params, kinetic_model, t_eval, x_values, s_values, p_values, fixed_params):
+def mse(
+    params,
+    kinetic_model,
+    t_eval,
+    x_values,
+    s_values,
+    p_values,
+    fixed_params,
+    solver_options=None,
+    weights=None,
+):
     # Get ordered params
     ordered_params = get_ordered_params(params, fixed_params)
 
@@ -30,32 +84,201 @@ def mse(params, kinetic_model, t_eval, x_values, s_values, p_values, fixed_param
         [x_values[0], s_values[0], p_values[0]],
         t_eval,
         ordered_params,  # always pass the same ordered kinetic parameters mu, Yx, Yp, Ks (and Ki when model is inhibition model)
+        **(solver_options or {}),
     )
 
-    # Extract simulation results
-    x_estimated, s_estimated, p_estimated = sol.y[0, :], sol.y[1, :], sol.y[2, :]
+    # A failed simulation stops before the last time
+    if sol.y.shape[1] != len(t_eval):
+        return np.inf
 
-    # Calculate mean squared error
-    error = (
-        np.sum((x_estimated - x_values) ** 2)
-        + np.sum((s_estimated - s_values) ** 2)
-        + np.sum((p_estimated - p_values) ** 2)
-    ) / len(s_values)
+    # Calculate the (weighted) mean squared error over the measured points
+    y_values = np.array([x_values, s_values, p_values], dtype=float)
+    return weighted_error(sol.y[:, None, :], y_values, weights)[0]
 
-    return error
 
+def population_mse(
+    population,
+    kinetic_model,
+    t_eval,
+    x_values,
+    s_values,
+    p_values,
+    fixed_params,
+    solver_options=None,
+    weights=None,
+):
+    # Same objective as mse for every individual of the population, all of them
+    # simulated together as one ensemble
+    ordered_params = get_ordered_params(population, fixed_params)
 
-def estimate_parameters(kinetic_data, t_eval, x_values, s_values, p_values, GA_params):
-    # Initialize necessary variables
-    dimension = 0
-    varbound = []
-    fixed_params = {}
-    opt_params = {}
-    index = 0
+    y_estimated = perform_ensemble_simulation(
+        kinetic_model,
+        [x_values[0], s_values[0], p_values[0]],
+        t_eval,
+        ordered_params,
+        **(solver_options or {}),
+    )
+
+    # Calculate mean squared error of each individual
+    y_values = np.array([x_values, s_values, p_values], dtype=float)
+    errors = weighted_error(y_estimated, y_values, weights)
+
+    # Individuals whose simulation failed get the worst possible error
+    return np.where(np.isfinite(errors), errors, np.inf)
+
+
+def population_mse_task(
+    population, data_descriptor, kinetic_model, fixed_params, solver_options, weights
+):
+    # Runs in a pool worker, the experimental data is read from shared memory
+    t_eval, x_values, s_values, p_values = attach_shared_array(data_descriptor)
+    return population_mse(
+        population,
+        kinetic_model,
+        t_eval,
+        x_values,
+        s_values,
+        p_values,
+        fixed_params,
+        solver_options,
+        weights,
+    )
 
-    # Extract kinetic model and parameters
-    kinetic_model = kinetic_data.pop("model")
-    kinetic_params = kinetic_data
+
+def get_fit_params(GA_params):
+    # Settings of a fit as they enter its cache key, with the default seed and
+    # the number of workers that will run it. The worker count changes the
+    # result: every worker integrates its share of the population as one stacked
+    # system, whose steps depend on all the members it holds
+    fit_params = dict(GA_params)
+    fit_params.setdefault("seed", DEFAULT_SEED)
+    fit_params["n_jobs"] = get_worker_count(GA_params.get("n_jobs", -1))
+    return fit_params
+
+
+@contextmanager
+def population_objective(
+    kinetic_model,
+    t_eval,
+    x_values,
+    s_values,
+    p_values,
+    fixed_params,
+    solver_options=None,
+    n_jobs=-1,
+    weights=None,
+):
+    # Yields the batch objective of the genetic algorithm. With more than one
+    # worker the population is split across the process pool, which receives the
+    # experimental data once per fit through shared memory
+    workers = get_worker_count(n_jobs)
+    if workers <= 1:
+        yield lambda population: population_mse(
+            population,
+            kinetic_model,
+            t_eval,
+            x_values,
+            s_values,
+            p_values,
+            fixed_params,
+            solver_options,
+            weights,
+        )
+        return
+
+    with SharedArray(
+        np.array([t_eval, x_values, s_values, p_values], dtype=float)
+    ) as data:
+        yield lambda population: map_population(
+            population_mse_task,
+            population,
+            workers,
+            data.descriptor,
+            kinetic_model,
+            fixed_params,
+            solver_options,
+            weights,
+        )
+
+
+def refine_parameters(
+    start,
+    varbound,
+    kinetic_model,
+    t_eval,
+    x_values,
+    s_values,
+    p_values,
+    fixed_params,
+    max_nfev=50,
+    weights=None,
+):
+    # Gradient-based refinement of one vector of optimization parameters. The
+    # residuals of the measured points are scaled so that their sum of squares
+    # is the objective of the fit and the Jacobian comes from the forward
+    # sensitivities of the model. Returns the refined parameters and the number
+    # of ODE solves
+    y_values = np.array([x_values, s_values, p_values], dtype=float)
+    y0 = y_values[:, 0]
+    scale = residual_scale(y_values, weights)
+    measured = residual_mask(y_values)
+    n_solves = 0
+
+    # Columns of the sensitivities that belong to optimization parameters
+    n_params = len(start) + len(fixed_params)
+    opt_index = [i for i in range(n_params) if fixed_params.get(i) is None]
+
+    # least_squares asks for the residuals and the Jacobian at the same point,
+    # one solve of the extended system gives both
+    last = {}
+
+    def solve(params):
+        nonlocal n_solves
+        key = params.tobytes()
+        if last.get("key") != key:
+            n_solves += 1
+            with np.errstate(all="ignore"):
+                sol = perform_sensitivity_simulation(
+                    kinetic_model, y0, t_eval, get_ordered_params(params, fixed_params)
+                )
+            if sol.success and not (
+                np.all(np.isfinite(sol.y)) and np.all(np.isfinite(sol.sensitivities))
+            ):
+                sol.success = False
+            last.update(key=key, sol=sol)
+        return last["sol"]
+
+    def residuals(params):
+        sol = solve(params)
+        if not sol.success:
+            return np.full(measured.sum(), FAILED_RESIDUAL)
+        return (scale * (sol.y - y_values)).ravel()[measured]
+
+    def jacobian(params):
+        sol = solve(params)
+        if not sol.success:
+            return np.zeros((measured.sum(), len(params)))
+        # Rows follow the residuals, variable by variable and time by time
+        sensitivities = sol.sensitivities[:, opt_index, :].transpose(0, 2, 1)
+        return (scale[:, :, None] * sensitivities).reshape(y_values.size, -1)[measured]
+
+    low, high = varbound[:, 0], varbound[:, 1]
+    result = least_squares(
+        residuals,
+        np.clip(start, low, high),
+        jac=jacobian,
+        bounds=(low, high),
+        method="trf",
+        x_scale="jac",
+        max_nfev=max_nfev,
+    )
+
+    return result.x, n_solves
+
+
+def get_search_options(GA_params):
+    # Settings of the genetic algorithm, the optimizer and the global search of
+    # a fit. The Latin hypercube only seeds the hybrid optimizer
 
     # Genetic Algorithm parameters
     algorithm_param = {
@@ -66,13 +289,149 @@ def estimate_parameters(kinetic_data, t_eval, x_values, s_values, p_values, GA_p
         "crossover_probability": GA_params.get("crossover_probability", 0.8),
         "parents_portion": 0.3,
         "crossover_type": GA_params.get(
-            "parents_portion", "one_point"
+            "crossover_type", "one_point"
         ),  # or "two_point", "uniform", "one_point"
         "max_iteration_without_improv": GA_params.get(
             "max_iteration_without_improv", None
         ),
     }
 
+    # The population is split among the parents and the offspring
+    population_size = algorithm_param["population_size"]
+    try:
+        valid = float(population_size) == int(population_size) >= 2
+    except (ValueError, TypeError):
+        valid = False
+    if not valid:
+        raise ValueError("population_size must be an integer of at least 2")
+    algorithm_param["population_size"] = int(population_size)
+
+    optimizer = GA_params.get("optimizer", "ga")
+    if optimizer not in OPTIMIZERS:
+        raise ValueError(f"Optimizer must be one of {', '.join(OPTIMIZERS)}")
+    global_search = GA_params.get("global_search", "ga")
+    if global_search not in GLOBAL_SEARCHES:
+        raise ValueError(f"Global search must be one of {', '.join(GLOBAL_SEARCHES)}")
+
+    # The hybrid optimizer only needs a rough global search
+    if optimizer == "hybrid":
+        algorithm_param["max_num_iteration"] = GA_params.get("max_num_iteration", 10)
+    else:
+        global_search = optimizer
+
+    return algorithm_param, optimizer, global_search
+
+
+def run_global_search(
+    function,
+    varbound,
+    algorithm_param,
+    GA_params,
+    global_search,
+    callback=None,
+    solves_per_point=1,
+):
+    # Minimizes the batch objective function over the search ranges. Returns the
+    # final population, its scores and the best vector with its error. Every
+    # vector costs solves_per_point ODE solves, see get_bayesian_options
+    dimension = len(varbound)
+    if global_search == "lhs":
+        # Multi-start seed from a Latin hypercube over the search ranges
+        sampler = qmc.LatinHypercube(
+            d=dimension, seed=GA_params.get("seed", DEFAULT_SEED)
+        )
+        population = qmc.scale(
+            sampler.random(algorithm_param["population_size"]),
+            varbound[:, 0],
+            varbound[:, 1],
+        )
+        scores = np.asarray(function(population), dtype=float)
+        scores = np.where(np.isnan(scores), np.inf, scores)
+        order = np.argsort(scores, kind="stable")
+        population, scores = population[order], scores[order]
+        best_params, error = population[0], scores[0]
+    else:
+        if global_search == "bayesian":
+            model = BayesianOptimizer(
+                function=function,
+                dimension=dimension,
+                variable_boundaries=varbound,
+                options=get_bayesian_options(GA_params, dimension, solves_per_point),
+                seed=GA_params.get("seed", DEFAULT_SEED),
+            )
+        elif GA_params.get("islands") is not None:
+            # Several populations with migration, for fits whose single
+            # population stalls in a local minimum
+            model = IslandModel(
+                function=function,
+                dimension=dimension,
+                variable_boundaries=varbound,
+                algorithm_parameters=algorithm_param,
+                options=get_island_options(GA_params, algorithm_param),
+                seed=GA_params.get("seed", DEFAULT_SEED),
+            )
+        else:
+            model = GeneticAlgorithm(
+                function=function,
+                dimension=dimension,
+                variable_boundaries=varbound,
+                algorithm_parameters=algorithm_param,
+                seed=GA_params.get("seed", DEFAULT_SEED),
+            )
+        # Stop once the fit is good enough
+        target_error = GA_params.get("target_error")
+        for generation in model.iterate_generations():
+            if callback is not None and callback(generation):
+                break
+            if target_error is not None and generation.best_function <= float(
+                target_error
+            ):
+                break
+        population, scores = model.population, model.scores
+
+        # Retrieve the best parameters from the optimization
+        best_params = model.best_variable
+        error = model.best_function
+
+    return population, scores, best_params, error
+
+
+def get_refinement_starts(population, scores, GA_params, global_search):
+    # Best distinct candidates of the global search, a single one after the
+    # genetic algorithm and a few after the Latin hypercube by default
+    n_starts = int(GA_params.get("n_starts", 3 if global_search == "lhs" else 1))
+    starts = np.unique(population[np.isfinite(scores)], axis=0, return_index=True)[1]
+    return population[np.sort(starts)[:n_starts]]
+
+
+def estimate_parameters(
+    kinetic_data,
+    t_eval,
+    x_values,
+    s_values,
+    p_values,
+    GA_params,
+    solver_options=None,
+    callback=None,
+    weights=None,
+):
+    # callback, when given, is called with the genetic algorithm after every
+    # generation and stops the optimization by returning True. weights are the
+    # weights of x, s and p in the objective, see residuals.py
+
+    # Initialize necessary variables
+    dimension = 0
+    varbound = []
+    fixed_params = {}
+    opt_params = {}
+    index = 0
+
+    # Extract kinetic model and parameters
+    kinetic_model = kinetic_data.pop("model")
+    kinetic_params = kinetic_data
+
+    algorithm_param, optimizer, global_search = get_search_options(GA_params)
+
     # Identify which parameters need to be optimized and which are fixed
     for kinetic_param, value in kinetic_params.items():
         if value["optimize"]:
@@ -93,34 +452,292 @@ def estimate_parameters(kinetic_data, t_eval, x_values, s_values, p_values, GA_p
     # Convert varbound to numpy array
     varbound = np.array(varbound)
 
-    # Run the genetic algorithm
-    model = ga(
-        function=lambda params: mse(
-            params,
-            kinetic_model,
-            t_eval,
-            x_values,
-            s_values,
-            p_values,
-            fixed_params,
-        ),
-        dimension=dimension,
-        variable_type="real",
-        variable_boundaries=varbound,
-        algorithm_parameters={
-            **algorithm_param,
-            "n_jobs": -1,
-        },  # Use all available CPU cores
-    )
-    model.run()
+    # Number of ODE solves of the global search and of the local refinement,
+    # and the best error after every batch of solves
+    solve_counts = {"global": 0, "local": 0}
+    trace = []
 
-    # Retrieve the best parameters from the optimization
-    best_params = model.best_variable
-    error = model.best_function
+    # Run the global search, every population is evaluated as one ensemble
+    # simulation per worker of the process pool
+    with population_objective(
+        kinetic_model,
+        t_eval,
+        x_values,
+        s_values,
+        p_values,
+        fixed_params,
+        solver_options,
+        GA_params.get("n_jobs", -1),
+        weights,
+    ) as population_function:
+
+        def function(population):
+            solve_counts["global"] += len(population)
+            scores = population_function(population)
+            best_error = trace[-1]["best_error"] if trace else np.inf
+            best_error = float(np.min(scores, initial=best_error))
+            trace.append({"solves": solve_counts["global"], "best_error": best_error})
+            return scores
+
+        population, scores, best_params, error = run_global_search(
+            function, varbound, algorithm_param, GA_params, global_search, callback
+        )
+
+    if optimizer == "hybrid":
+        for start in get_refinement_starts(
+            population, scores, GA_params, global_search
+        ):
+            refined, n_solves = refine_parameters(
+                start,
+                varbound,
+                kinetic_model,
+                t_eval,
+                x_values,
+                s_values,
+                p_values,
+                fixed_params,
+                weights=weights,
+            )
+            # The refined fit is scored with the same simulation as the global search
+            refined_error = mse(
+                refined,
+                kinetic_model,
+                t_eval,
+                x_values,
+                s_values,
+                p_values,
+                fixed_params,
+                solver_options,
+                weights,
+            )
+            solve_counts["local"] += n_solves + 1
+            if refined_error < error:
+                best_params, error = refined, refined_error
+            trace.append(
+                {
+                    "solves": solve_counts["global"] + solve_counts["local"],
+                    "best_error": error,
+                }
+            )
+
+    solve_counts["total"] = solve_counts["global"] + solve_counts["local"]
 
     index = 0
     for key, value in opt_params.items():
         opt_params[key] = best_params[index]
         index += 1
 
-    return fixed_params, best_params, error, opt_params
+    return fixed_params, best_params, error, opt_params, solve_counts, trace
+
+
+def get_kinetic_data(kinetic_data):
+    # "kineticData" in the order of the parameters of its model in the registry,
+    # which is the order of the simulations. A parameter may come under one of
+    # its aliases (Yx for Y) and keeps the name it was given. Optimized
+    # parameters without a search range take the default one of the registry.
+    # Raises ValueError
+    if not isinstance(kinetic_data, dict):
+        raise ValueError("kineticData must be an object")
+    kinetic_model = get_model(kinetic_data.get("model"))
+
+    ordered = {"model": kinetic_model.name}
+    names = {}
+    for name in kinetic_model.parameters:
+        keys = [name] + [
+            alias for alias, target in kinetic_model.aliases.items() if target == name
+        ]
+        keys = [key for key in keys if key in kinetic_data]
+        if len(keys) != 1:
+            raise ValueError(f"kineticData needs one entry for {name}")
+        names[keys[0]] = name
+
+    unknown = set(kinetic_data) - set(names) - {"model"}
+    if unknown:
+        unknown = ", ".join(sorted(unknown))
+        raise ValueError(f"The {kinetic_model.name} model has no parameter {unknown}")
+
+    for key, name in names.items():
+        value = kinetic_data[key]
+        if not isinstance(value, dict) or "optimize" not in value:
+            raise ValueError(f"{key} must say whether it is optimized")
+        if value["optimize"]:
+            low, high = kinetic_model.bounds[name]
+            value = {"min": low, "max": high, **value}
+            if not float(value["min"]) < float(value["max"]):
+                raise ValueError(f"The search range of {key} must have min < max")
+        elif value.get("fixed") is None:
+            raise ValueError(f"{key} needs a fixed value when it is not optimized")
+        ordered[key] = value
+    return ordered
+
+
+def check_parameter_optimization_inputs(data):
+    # Raises ValueError when a parameter-optimization request misses an input.
+    # experimentalData is one series or a list of experiments
+    experimental_data = data.get("experimentalData") or {}
+    if isinstance(experimental_data, list):
+        series = [experiment or {} for experiment in experimental_data] or [{}]
+    else:
+        series = [experimental_data]
+
+    # Each variable needs its values and either its own times or "t"
+    if any(
+        val is None
+        for val in [data.get("kineticData"), data.get("GAParams")]
+        + [
+            experiment.get(key)
+            for experiment in series
+            for variable in ("x", "s", "p")
+            for key in (
+                variable,
+                f"t_{variable}" if f"t_{variable}" in experiment else "t",
+            )
+        ]
+    ):
+        raise ValueError("All inputs are required")
+    get_kinetic_data(data["kineticData"])
+
+
+def get_optimized_param_names(kinetic_data, n_experiments=None):
+    # Names of the kinetic parameters in the order of the optimization variables.
+    # When fitting n_experiments, parameters that are not shared get one
+    # variable per experiment, named name[i]
+    names = []
+    for kinetic_param, value in kinetic_data.items():
+        if kinetic_param == "model" or not value["optimize"]:
+            continue
+        if n_experiments is None or value.get("shared", True):
+            names.append(kinetic_param)
+        else:
+            names.extend(f"{kinetic_param}[{i}]" for i in range(n_experiments))
+    return names
+
+
+def run_parameter_optimization(data, callback=None):
+    # Fits the kinetic parameters of a parameter-optimization request and
+    # simulates the fitted model. Raises ValueError for invalid inputs
+    check_parameter_optimization_inputs(data)
+    bootstrap_options = get_bootstrap_options(data)
+    data = {**data, "kineticData": get_kinetic_data(data["kineticData"])}
+
+    # Requests with a list of experiments fit them together. Imported here
+    # because that module builds on this one
+    if isinstance(data.get("experimentalData"), list):
+        from api.optimization.multi_experiment import run_multi_experiment_optimization
+
+        if bootstrap_options is not None:
+            raise ValueError(
+                "Bootstrap intervals are available for a single experiment"
+            )
+        return run_multi_experiment_optimization(data, callback)
+
+    kinetic_data = data.get("kineticData")
+    experimental_data = data.get("experimentalData")
+    GA_params = data.get("GAParams")
+
+    # The variables may be sampled at their own times and have missing values,
+    # the fit compares the model with the measured points only
+    t_values, y_values, weights = get_residual_data(
+        experimental_data, data.get("residualParams")
+    )
+    x_values, s_values, p_values = y_values
+
+    solver_options = get_solver_options(data.get("solverParams", {}))
+
+    kinetic_model = kinetic_data.get("model")
+
+    # Identical requests share one fit, the seed is part of the key
+    fit_params = get_fit_params(GA_params)
+    key = make_key(
+        "fit",
+        kinetic_data,
+        [t_values, y_values, weights],
+        fit_params,
+        solver_options,
+    )
+
+    cache = get_cache()
+    fit = cache.get(key)
+    if fit is None:
+        # Fits stopped by the callback are partial and are not cached
+        stopped = False
+
+        def monitor(generation):
+            nonlocal stopped
+            stopped = callback is not None and bool(callback(generation))
+            return stopped
+
+        # estimate_parameters takes the model out of the kinetic data
+        fit = estimate_parameters(
+            dict(kinetic_data),
+            t_values,
+            x_values,
+            s_values,
+            p_values,
+            GA_params,
+            solver_options,
+            monitor,
+            weights,
+        )
+        if not stopped:
+            cache.set(key, fit)
+
+    fixed_params, best_params, error, opt_params, solve_counts, trace = fit
+
+    ordered_params = get_ordered_params(best_params, fixed_params)
+
+    sol = perform_simulation(
+        kinetic_model,
+        [x_values[0], s_values[0], p_values[0]],
+        t_values,
+        ordered_params,
+        **solver_options,
+    )
+
+    # The arrays are serialized by the renderer of the view
+    result = {
+        "time": sol.t,
+        "x": sol.y[0],
+        "s": sol.y[1],
+        "p": sol.y[2],
+        "best_params": opt_params,
+        "error": error,
+        "model_type": kinetic_model,
+        "solve_counts": solve_counts,
+        # JSON has no infinite errors, before any simulation succeeded
+        "trace": [
+            {
+                "solves": entry["solves"],
+                "best_error": (
+                    entry["best_error"] if np.isfinite(entry["best_error"]) else None
+                ),
+            }
+            for entry in trace
+        ],
+        # add any other relevant information
+    }
+
+    # Confidence intervals of the optimized parameters, on request
+    if bootstrap_options is not None:
+        if not sol.success:
+            raise ValueError("The fitted model could not be simulated")
+        names = get_optimized_param_names(kinetic_data)
+        varbound = np.array(
+            [[kinetic_data[name]["min"], kinetic_data[name]["max"]] for name in names],
+            dtype=float,
+        )
+        result["bootstrap"] = bootstrap_parameters(
+            kinetic_model,
+            t_values,
+            y_values,
+            sol.y,
+            best_params,
+            fixed_params,
+            varbound,
+            names,
+            bootstrap_options,
+            weights,
+        )
+        result["bootstrap"]["parameters"] = names
+
+    return result
@@ -1,162 +1,191 @@
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework import status
 
-from api.optimization.utils import estimate_parameters, get_ordered_params
-from api.utilis.numerical_methods import perform_simulation
-
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import PolynomialFeatures, StandardScaler
-import numpy as np
-import pandas as pd
-
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from api.models import Dataset, OptimizationJob
+from api.serializers import OptimizationJobSerializer
+from api.datasets.utils import get_owner, get_request_data
+from api.optimization.jobs import submit_job, cancel_job
+from api.optimization.media import run_media_optimization, run_media_sweep
+from api.optimization.streaming import iter_parameter_optimization
+from api.optimization.utils import (
+    check_parameter_optimization_inputs,
+    run_parameter_optimization,
+)
+from api.utilis.executors import async_compute_view
+from api.utilis.renderers import ColumnarRenderer, EventStreamRenderer, NDJSONRenderer
 
 
 @api_view(["POST"])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, ColumnarRenderer])
 def parameter_optimization(request):
-    kinetic_data = request.data.get("kineticData")
-    kinetic_model = kinetic_data.get("model")
-    experimental_data = request.data.get("experimentalData")
-    t_values = experimental_data.get("t")
-    x_values = experimental_data.get("x")
-    s_values = experimental_data.get("s")
-    p_values = experimental_data.get("p")
-    GA_params = request.data.get("GAParams")
-
-    if any(
-        val is None
-        for val in [kinetic_data, t_values, x_values, s_values, p_values, GA_params]
-    ):
+    try:
+        data = get_request_data(request, "experimentalData")
+        response_data = run_parameter_optimization(data)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except Dataset.DoesNotExist:
         return Response(
-            {"error": "All inputs are required"}, status=status.HTTP_400_BAD_REQUEST
+            {"error": "Dataset not found"}, status=status.HTTP_404_NOT_FOUND
         )
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    fixed_params, best_params, error, opt_params = estimate_parameters(
-        kinetic_data, t_values, x_values, s_values, p_values, GA_params
-    )
+    return Response(response_data, status=200)
+
+
+# Version of parameter_optimization for the ASGI server, see async_compute_view
+async_parameter_optimization = async_compute_view(
+    parameter_optimization, "parameter_optimization"
+)
 
-    ordered_params = get_ordered_params(best_params, fixed_params)
 
-    sol = perform_simulation(
-        kinetic_model,
-        [x_values[0], s_values[0], p_values[0]],
-        t_values,
-        ordered_params,
+@api_view(["POST"])
+@renderer_classes([JSONRenderer, NDJSONRenderer, EventStreamRenderer])
+def stream_parameter_optimization(request):
+    try:
+        data = get_request_data(request, "experimentalData")
+        check_parameter_optimization_inputs(data)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except Dataset.DoesNotExist:
+        return Response(
+            {"error": "Dataset not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Server-sent events when asked for, newline-delimited JSON otherwise
+    renderer = request.accepted_renderer
+    if not isinstance(renderer, EventStreamRenderer):
+        renderer = NDJSONRenderer()
+
+    # Closing the connection stops the fit after the current generation
+    events = iter_parameter_optimization(data)
+    response = StreamingHttpResponse(
+        (renderer.render(event) for event in events),
+        content_type=renderer.media_type,
     )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
 
-    # Serialize the simulation results
-    time_data = sol.t.tolist()
-    x_data = sol.y[0].tolist()
-    s_data = sol.y[1].tolist()
-    p_data = sol.y[2].tolist()
-
-    response_data = {
-        "time": time_data,
-        "x": x_data,
-        "s": s_data,
-        "p": p_data,
-        "best_params": opt_params,
-        "error": error,
-        "model_type": kinetic_model,
-        # add any other relevant information
-    }
+    return response
 
-    return Response(response_data, status=200)
+
+# Answer of the job endpoints for anonymous requests, jobs belong to a member
+JOB_AUTHENTICATION_ERROR = "You must be authenticated to run optimization jobs"
+
+
+def get_job(request, job_id):
+    # Job of the member of the request. Raises PermissionError and
+    # OptimizationJob.DoesNotExist, also for the jobs of another member
+    try:
+        owner = get_owner(request)
+    except PermissionError:
+        raise PermissionError(JOB_AUTHENTICATION_ERROR)
+    return owner.optimization_jobs.get(pk=job_id)
+
+
+@api_view(["POST"])
+def submit_parameter_optimization(request):
+    # Reject incomplete requests now instead of failing the job later. The job
+    # keeps the dataset id and reads the dataset when it runs
+    try:
+        owner = get_owner(request)
+    except PermissionError:
+        return Response(
+            {"error": JOB_AUTHENTICATION_ERROR}, status=status.HTTP_401_UNAUTHORIZED
+        )
+    try:
+        check_parameter_optimization_inputs(
+            get_request_data(request, "experimentalData")
+        )
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except Dataset.DoesNotExist:
+        return Response(
+            {"error": "Dataset not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    job = submit_job(request.data, owner)
+
+    serializer = OptimizationJobSerializer(job)
+
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(["GET"])
+def parameter_optimization_job(request, job_id):
+    try:
+        job = get_job(request, job_id)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except OptimizationJob.DoesNotExist:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = OptimizationJobSerializer(job)
+
+    return Response(serializer.data)
+
+
+@api_view(["POST"])
+def cancel_parameter_optimization_job(request, job_id):
+    try:
+        job = get_job(request, job_id)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except OptimizationJob.DoesNotExist:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    job = cancel_job(job)
+
+    serializer = OptimizationJobSerializer(job)
+
+    return Response(serializer.data)
 
 
 @api_view(["POST"])
 def media_optimization(request):
-    data = request.data
+    # Polynomial response surface of the medium components, see
+    # run_media_optimization. The data is inline or read from the dataset of
+    # "datasetId"
+    try:
+        data = get_request_data(request, "experimentalMCData")
+        response_data = run_media_optimization(data)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except Dataset.DoesNotExist:
+        return Response(
+            {"error": "Dataset not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Extracting the relevant data
-    experimental_data = data.get("experimentalMCData")
-    la_params = data.get("LAParams")
+    return Response(response_data, status=200)
 
-    # Converting the data to a pandas DataFrame
-    df = pd.DataFrame(experimental_data)
 
-    # Extracting the variables for analysis
-    X = df[[la_params["x_var"], la_params["z_var"]]].values  # Independent variables
-    y = df[la_params["y_var"]].values  # Dependent variable
+# Version of media_optimization for the ASGI server, see async_compute_view
+async_media_optimization = async_compute_view(media_optimization, "media_optimization")
 
-    # Splitting the data into training and testing sets
-    X_train, X_test, y_train, y_test = train_test_split(
-        X,
-        y,
-        test_size=float(la_params["test_size"]),
-        random_state=int(la_params["random_state"]),
-    )
 
-    # Normalizing the data if required
-    if la_params["normalization"]:
-        scaler = StandardScaler()
-        X_train = scaler.fit_transform(X_train)
-        X_test = scaler.transform(X_test)
-
-    # Creating polynomial features if degree is more than 1
-    if int(la_params["polynomial_degree"]) > 1:
-        poly = PolynomialFeatures(degree=int(la_params["polynomial_degree"]))
-        X_train = poly.fit_transform(X_train)
-        X_test = poly.transform(X_test)
-
-    # Performing the Linear Regression analysis
-    lr = LinearRegression()
-    lr.fit(X_train, y_train)
-    y_pred = lr.predict(X_test)
-
-    # Calculate metrics
-    r2 = r2_score(y_test, y_pred)
-    mae = mean_absolute_error(y_test, y_pred)
-    mse = mean_squared_error(y_test, y_pred)
-    rmse = np.sqrt(mse)
-
-    # Evaluating the predictions
-    # Creating a response surface (or line) for plotting predictions
-    x_surf, z_surf = np.meshgrid(
-        np.linspace(X[:, 0].min(), X[:, 0].max(), 100),
-        np.linspace(X[:, 1].min(), X[:, 1].max(), 100),
-    )
-    X_surf = np.c_[x_surf.ravel(), z_surf.ravel()]
-    if la_params["normalization"]:
-        X_surf = scaler.transform(X_surf)
-    if int(la_params["polynomial_degree"]) > 1:
-        X_surf = poly.transform(X_surf)
-    y_surf = lr.predict(X_surf)
-    y_surf = y_surf.reshape(x_surf.shape)
-
-    response_surface = {
-        "x_surf": x_surf.tolist(),
-        "z_surf": z_surf.tolist(),
-        "y_surf": y_surf.tolist(),
-    }
-
-    # Prepare the response data
-    response_data = {
-        "response_surface": response_surface,
-        "model_params": {
-            "coefficients": lr.coef_.tolist(),
-            "intercept": lr.intercept_,
-        },
-        "model_metrics": {
-            "r2": r2,
-            "mae": mae,
-            "mse": mse,
-            "rmse": rmse,
-        },
-        "data_split": {
-            "test_size": float(la_params["test_size"]),
-            "random_state": int(la_params["random_state"]),
-        },
-        "features": {
-            "dependent_variable": la_params["y_var"],
-            "independent_variables": [la_params["x_var"], la_params["z_var"]],
-        },
-        "preprocessing": {
-            "normalization": la_params["normalization"],
-            "polynomial_degree": int(la_params["polynomial_degree"]),
-        },
-    }
+@api_view(["POST"])
+def media_optimization_sweep(request):
+    # Cross-validated comparison of polynomial degrees, normalization and
+    # regularization, see run_media_sweep
+    try:
+        data = get_request_data(request, "experimentalMCData")
+        response_data = run_media_sweep(data)
+    except PermissionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    except Dataset.DoesNotExist:
+        return Response(
+            {"error": "Dataset not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     return Response(response_data, status=200)
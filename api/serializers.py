@@ -0,0 +1,23 @@
+from rest_framework import serializers
+
+from .models import Dataset, OptimizationJob
+
+
+class OptimizationJobSerializer(serializers.ModelSerializer):
+
+    job_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = OptimizationJob
+        fields = ('job_id', 'status', 'created_at', 'started_at',
+                  'finished_at', 'result', 'error')
+
+
+class DatasetSerializer(serializers.ModelSerializer):
+
+    dataset_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = Dataset
+        fields = ('dataset_id', 'name', 'columns', 'n_rows', 'content_hash',
+                  'size', 'created_at')
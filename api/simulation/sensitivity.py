@@ -0,0 +1,296 @@
+import numpy as np
+from django.conf import settings
+from scipy.stats import qmc
+
+from api.simulation.utils import simulate_batch
+from api.utilis.model_registry import get_model
+
+SENSITIVITY_ANALYSES = ("morris", "sobol")
+
+# Default sample sizes: base samples of the Sobol design, which must be a
+# power of two, and trajectories and grid levels of the Morris screening
+DEFAULT_SOBOL_SAMPLES = 256
+DEFAULT_MORRIS_TRAJECTORIES = 20
+DEFAULT_MORRIS_LEVELS = 4
+
+# Bootstrap resamples behind the confidence intervals of the Sobol indices
+BOOTSTRAP_RESAMPLES = 100
+
+DEFAULT_SEED = 0
+
+# Output variables of the simulations, in the order of the states
+OUTPUTS = ("x", "s", "p")
+
+
+def get_parameter_bounds(data, model):
+    # Reads the parameters to vary, "bounds" maps their names to [low, high].
+    # The other kinetic parameters keep the value given in the request. Returns
+    # the varied names, their bounds shaped (k, 2) and the ordered base values.
+    # Parameters may come under one of their aliases (Yx for Y), the returned
+    # names are those of the registry
+    kinetic_model = get_model(model)
+    names = kinetic_model.parameters
+
+    bounds = data.get("bounds")
+    if not isinstance(bounds, dict) or len(bounds) == 0:
+        raise ValueError("bounds must map the parameters to vary to [low, high]")
+    resolved = {
+        kinetic_model.aliases.get(name, name): value for name, value in bounds.items()
+    }
+    if len(resolved) != len(bounds):
+        raise ValueError("bounds gives a parameter more than once")
+    bounds = resolved
+    unknown = set(bounds) - set(names)
+    if unknown:
+        unknown = ", ".join(sorted(unknown))
+        raise ValueError(f"The {model} model has no parameter {unknown}")
+
+    varied = [name for name in names if name in bounds]
+    table = np.empty((len(varied), 2))
+    for i, name in enumerate(varied):
+        try:
+            low, high = (float(value) for value in bounds[name])
+        except (ValueError, TypeError):
+            raise ValueError(f"The bounds of {name} must be [low, high]")
+        if not (np.isfinite(low) and np.isfinite(high) and low < high):
+            raise ValueError(f"The bounds of {name} must be finite with low < high")
+        table[i] = low, high
+
+    base = []
+    for name in names:
+        value = kinetic_model.get_value(data, name)
+        if value is None and name not in bounds:
+            raise ValueError(f"{name} needs either a value or bounds")
+        base.append(float(value) if value is not None else np.nan)
+
+    return varied, table, np.array(base)
+
+
+def morris_design(k, trajectories, levels, rng):
+    # Trajectories of k + 1 points on the unit grid of the levels, each step
+    # moves one factor by delta in a random order. Returns the points shaped
+    # (trajectories, k + 1, k), the factor of every step and its signed move
+    delta = levels / (2 * (levels - 1))
+    points = np.empty((trajectories, k + 1, k))
+    points[:, 0] = rng.integers(0, levels, (trajectories, k)) / (levels - 1)
+    order = np.argsort(rng.random((trajectories, k)), axis=1)
+    moves = np.empty((trajectories, k))
+
+    rows = np.arange(trajectories)
+    for step in range(k):
+        factor = order[:, step]
+        current = points[rows, step, factor]
+        # Up when the level above stays in the unit range, down otherwise
+        moves[:, step] = np.where(current + delta <= 1 + 1e-12, delta, -delta)
+        points[:, step + 1] = points[:, step]
+        points[rows, step + 1, factor] = current + moves[:, step]
+
+    return points, order, moves
+
+
+def sobol_design(k, n_samples, seed):
+    # Base matrices A and B of the Saltelli design from one scrambled Sobol
+    # sequence in 2k dimensions, and the k matrices AB_i, which are A with the
+    # column i taken from B. Returns the points shaped (n_samples * (k + 2), k)
+    sample = qmc.Sobol(d=2 * k, scramble=True, seed=seed).random(n_samples)
+    A, B = sample[:, :k], sample[:, k:]
+    AB = np.repeat(A[None], k, axis=0)
+    for i in range(k):
+        AB[i, :, i] = B[:, i]
+    return np.concatenate([A, B, AB.reshape(-1, k)])
+
+
+def evaluate_design(
+    model, unit_points, bounds, base, varied, y0, t_eval, solver_options, n_jobs
+):
+    # Simulates every point of the unit design scaled to the bounds as one
+    # batch. Returns the trajectories shaped (points, 3, len(t_eval))
+    names = get_model(model).parameters
+    params = np.tile(base, (len(unit_points), 1))
+    columns = [names.index(name) for name in varied]
+    params[:, columns] = qmc.scale(unit_points, bounds[:, 0], bounds[:, 1])
+
+    y0 = np.broadcast_to(np.asarray(y0, dtype=float)[:, None], (3, len(params)))
+    y = simulate_batch(model, params, y0, t_eval, solver_options, n_jobs)
+    return y.transpose(1, 0, 2)
+
+
+def morris_indices(y, order, moves):
+    # Elementary effects of every factor at every time, in output units per
+    # unit of the scaled factor range, from y shaped (trajectories, k + 1, 3, nt).
+    # Trajectories with a failed solve are left out
+    complete = ~np.isnan(y).any(axis=(1, 2, 3))
+    y, order, moves = y[complete], order[complete], moves[complete]
+    if len(y) < 2:
+        raise ValueError("Fewer than two Morris trajectories could be simulated")
+
+    effects = np.empty(y.shape[:1] + (y.shape[1] - 1,) + y.shape[2:])
+    rows = np.arange(len(y))
+    for step in range(order.shape[1]):
+        difference = y[:, step + 1] - y[:, step]
+        effects[rows, order[:, step]] = difference / moves[:, step, None, None]
+
+    # Time-resolved statistics are shaped (k, 3, nt), the summaries average them
+    # over time
+    mu = effects.mean(axis=0)
+    mu_star = np.abs(effects).mean(axis=0)
+    sigma = effects.std(axis=0, ddof=1)
+    indices = {}
+    for j, output in enumerate(OUTPUTS):
+        indices[output] = {
+            "mu": mu[:, j].mean(axis=-1),
+            "mu_star": mu_star[:, j].mean(axis=-1),
+            "sigma": sigma[:, j].mean(axis=-1),
+            "mu_star_time": mu_star[:, j],
+            "sigma_time": sigma[:, j],
+        }
+    return indices, int(complete.sum())
+
+
+def sobol_estimates(fA, fB, fAB):
+    # Saltelli (2010) estimator of the first-order effects and Jansen estimator
+    # of the total effects. Returns the partial variances shaped (k, 3, nt) and
+    # the output variance shaped (3, nt)
+    variance = np.concatenate([fA, fB]).var(axis=0)
+    first = np.mean(fB * (fAB - fA), axis=1)
+    total = 0.5 * np.mean((fA - fAB) ** 2, axis=1)
+    return first, total, variance
+
+
+def ratio(numerator, denominator):
+    # Indices of outputs that do not vary (the initial conditions) are zero
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(np.broadcast(numerator, denominator).shape),
+        where=denominator > 0,
+    )
+
+
+def sobol_indices(y, k, n_samples, rng):
+    # First-order and total indices at every time and their summaries over time,
+    # which weigh every time by its output variance. The confidence intervals of
+    # the summaries come from bootstrap resamples of the base samples. Samples
+    # with a failed solve are left out
+    fA, fB = y[:n_samples], y[n_samples : 2 * n_samples]
+    fAB = y[2 * n_samples :].reshape((k, n_samples) + y.shape[1:])
+    complete = ~(
+        np.isnan(fA).any(axis=(1, 2))
+        | np.isnan(fB).any(axis=(1, 2))
+        | np.isnan(fAB).any(axis=(0, 2, 3))
+    )
+    fA, fB, fAB = fA[complete], fB[complete], fAB[:, complete]
+    n = int(complete.sum())
+    if n < 2:
+        raise ValueError("Fewer than two Sobol samples could be simulated")
+
+    first, total, variance = sobol_estimates(fA, fB, fAB)
+
+    resampled = {"S1": [], "ST": []}
+    for _ in range(BOOTSTRAP_RESAMPLES):
+        rows = rng.integers(0, n, n)
+        b_first, b_total, b_variance = sobol_estimates(fA[rows], fB[rows], fAB[:, rows])
+        resampled["S1"].append(ratio(b_first.sum(axis=-1), b_variance.sum(axis=-1)))
+        resampled["ST"].append(ratio(b_total.sum(axis=-1), b_variance.sum(axis=-1)))
+    # Half width of the 95 % interval, shaped (k, 3)
+    confidence = {
+        key: 1.96 * np.std(values, axis=0) for key, values in resampled.items()
+    }
+
+    S1 = ratio(first.sum(axis=-1), variance.sum(axis=-1))
+    ST = ratio(total.sum(axis=-1), variance.sum(axis=-1))
+    S1_time = ratio(first, variance)
+    ST_time = ratio(total, variance)
+    indices = {}
+    for j, output in enumerate(OUTPUTS):
+        indices[output] = {
+            "S1": S1[:, j],
+            "S1_conf": confidence["S1"][:, j],
+            "ST": ST[:, j],
+            "ST_conf": confidence["ST"][:, j],
+            "S1_time": S1_time[:, j],
+            "ST_time": ST_time[:, j],
+        }
+    return indices, n
+
+
+def get_design_options(data, analysis):
+    # Sample sizes of the analysis, the number of simulations they take and the seed
+    seed = int(data.get("seed", DEFAULT_SEED))
+    if analysis == "sobol":
+        n_samples = int(data.get("n_samples", DEFAULT_SOBOL_SAMPLES))
+        if n_samples < 2 or n_samples & (n_samples - 1):
+            raise ValueError("n_samples must be a power of two of at least 2")
+        return {"n_samples": n_samples, "seed": seed}
+
+    trajectories = int(data.get("trajectories", DEFAULT_MORRIS_TRAJECTORIES))
+    levels = int(data.get("levels", DEFAULT_MORRIS_LEVELS))
+    if trajectories < 2:
+        raise ValueError("trajectories must be at least 2")
+    if levels < 2 or levels % 2:
+        raise ValueError("levels must be an even number of at least 2")
+    return {"trajectories": trajectories, "levels": levels, "seed": seed}
+
+
+def run_sensitivity_analysis(
+    model,
+    analysis,
+    varied,
+    bounds,
+    base,
+    y0,
+    t_eval,
+    options,
+    solver_options,
+    n_jobs=-1,
+):
+    # Runs the whole design as batched simulations and returns the indices of
+    # every varied parameter for each output variable
+    if analysis not in SENSITIVITY_ANALYSES:
+        raise ValueError(f"analysis must be one of {', '.join(SENSITIVITY_ANALYSES)}")
+    k = len(varied)
+    rng = np.random.default_rng(options["seed"])
+
+    if analysis == "sobol":
+        n_runs = options["n_samples"] * (k + 2)
+    else:
+        n_runs = options["trajectories"] * (k + 1)
+    max_values = getattr(settings, "SENSITIVITY_MAX_VALUES", 2 * 10**7)
+    if n_runs * 3 * len(t_eval) > max_values:
+        raise ValueError(
+            f"The analysis takes {n_runs} simulations of {len(t_eval)} time points, "
+            "use fewer samples or time points"
+        )
+
+    if analysis == "sobol":
+        unit_points = sobol_design(k, options["n_samples"], rng)
+        y = evaluate_design(
+            model, unit_points, bounds, base, varied, y0, t_eval, solver_options, n_jobs
+        )
+        indices, n_used = sobol_indices(y, k, options["n_samples"], rng)
+    else:
+        points, order, moves = morris_design(
+            k, options["trajectories"], options["levels"], rng
+        )
+        y = evaluate_design(
+            model,
+            points.reshape(-1, k),
+            bounds,
+            base,
+            varied,
+            y0,
+            t_eval,
+            solver_options,
+            n_jobs,
+        )
+        y = y.reshape(points.shape[:2] + y.shape[1:])
+        indices, n_used = morris_indices(y, order, moves)
+
+    return {
+        "analysis": analysis,
+        "parameters": varied,
+        "time": t_eval,
+        "simulations": n_runs,
+        "samples_used": n_used,
+        **indices,
+    }
@@ -1,6 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from api.simulation.views import simulation
+from api.simulation.views import (
+    simulation,
+    async_simulation,
+    preview_simulation,
+    stream_simulation,
+    batch_simulation,
+    sensitivity_analysis,
+    cache_stats,
+    kinetic_models,
+)
+
+# The async version of the compute views leaves the other requests of an
+# ASGI server responsive during long computations
+async_views = getattr(settings, "ASYNC_COMPUTE_VIEWS", False)
 
 urlpatterns = [
-    path('simulation/', simulation),
+    path('simulation/', async_simulation if async_views else simulation),
+    path('simulation/preview/', preview_simulation),
+    path('simulation/stream/', stream_simulation),
+    path('simulation/batch/', batch_simulation),
+    path('sensitivity/', sensitivity_analysis),
+    path('cache/stats/', cache_stats),
+    path('models/', kinetic_models),
 ]
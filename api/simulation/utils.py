@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from api.utilis.model_registry import get_model
+from api.utilis.numerical_methods import (
+    perform_ensemble_simulation,
+    perform_simulation,
+)
+from api.utilis.parallel import get_worker_count, map_population
+
+# Time points integrated and sent per window of a streamed simulation
+DEFAULT_CHUNK_SIZE = 10000
+
+# Smaller batches are integrated in this process, the pool would cost more
+# in task overhead than it saves
+MIN_RUNS_PER_WORKER = 32
+
+
+def get_simulation_inputs(data):
+    # Reads the model, the initial conditions and the ordered kinetic parameters
+    # of a simulation request. Raises ValueError when an input is missing. The
+    # kinetic parameters are the ones the model registry lists for the model
+    model = data.get("model")
+    kinetic_model = get_model(model)
+    params = [kinetic_model.get_value(data, name) for name in kinetic_model.parameters]
+    X0 = data.get("X0")
+    S0 = data.get("S0")
+    P0 = data.get("P0")
+
+    if any(val is None for val in params + [X0, S0, P0]):
+        raise ValueError("All inputs are required")
+
+    # Convert the inputs to floats
+    y0 = [float(X0), float(S0), float(P0)]
+    params = tuple(float(value) for value in params)
+
+    return model, y0, params
+
+
+def get_grid_length(step_size, tf):
+    # Number of points of np.arange(0, tf + step_size, step_size)
+    return int(np.ceil((tf + step_size) / step_size))
+
+
+def iter_simulation_windows(
+    model, y0, params, step_size, tf, chunk_size=DEFAULT_CHUNK_SIZE, **solver_options
+):
+    # Integrates the time grid of step_size up to tf in windows of chunk_size
+    # points and yields each window as it completes, so memory does not grow
+    # with the length of the grid. The models are autonomous, each window is
+    # integrated from the last state of the previous one on times shifted to
+    # start at zero. A failed integration yields {"error": ...} and stops
+    n_points = get_grid_length(step_size, tf)
+    y_last = np.asarray(y0, dtype=float)
+    t_last = 0.0
+
+    for start in range(0, n_points, chunk_size):
+        # Same time points as np.arange, which computes them as k * step_size
+        t_window = np.arange(start, min(start + chunk_size, n_points)) * step_size
+
+        if start == 0:
+            sol = perform_simulation(model, y_last, t_window, params, **solver_options)
+            y_window = sol.y
+        else:
+            t_local = np.concatenate([[0.0], t_window - t_last])
+            sol = perform_simulation(model, y_last, t_local, params, **solver_options)
+            y_window = sol.y[:, 1:]
+
+        if not sol.success:
+            yield {"error": f"The integration failed after t = {t_last}: {sol.message}"}
+            return
+
+        y_last = y_window[:, -1]
+        t_last = t_window[-1]
+        yield {"time": t_window, "x": y_window[0], "s": y_window[1], "p": y_window[2]}
+
+
+def get_batch_runs(data, upload=None):
+    # Reads the runs of a batch simulation, either the "runs" list of the request
+    # or the rows of an uploaded CSV file. Values missing from a run are taken
+    # from the request itself. Returns the model, the ordered kinetic parameters
+    # shaped (runs, parameters) and the initial conditions shaped (3, runs)
+    model = data.get("model")
+    names = get_model(model).parameters + ("X0", "S0", "P0")
+
+    if upload is not None:
+        try:
+            runs = pd.read_csv(upload).to_dict("records")
+        except (ValueError, UnicodeDecodeError, pd.errors.ParserError):
+            raise ValueError("The uploaded file must be a CSV table")
+    else:
+        runs = data.get("runs")
+
+    if not isinstance(runs, list) or len(runs) == 0:
+        raise ValueError("runs must be a non-empty list")
+    max_runs = getattr(settings, "BATCH_SIMULATION_MAX_RUNS", 10000)
+    if len(runs) > max_runs:
+        raise ValueError(f"A batch holds at most {max_runs} runs")
+
+    table = np.empty((len(runs), len(names)))
+    for i, run in enumerate(runs):
+        for j, name in enumerate(names):
+            value = run.get(name)
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                value = data.get(name)
+            if value is None:
+                raise ValueError(f"Run {i} has no value for {name}")
+            table[i, j] = float(value)
+
+    return model, table[:, :-3], table[:, -3:].T
+
+
+def simulate_batch_task(rows, model, t_eval, solver_options):
+    # Runs in a pool worker, every row holds the kinetic parameters followed by
+    # the initial conditions of one run. Returns (runs, 3, len(t_eval))
+    y = perform_ensemble_simulation(
+        model, rows[:, -3:].T, t_eval, rows[:, :-3], **solver_options
+    )
+    return y.transpose(1, 0, 2)
+
+
+def simulate_batch(model, params, y0, t_eval, solver_options, n_jobs=-1):
+    # All the runs integrated as one vectorized ensemble, split across the
+    # process pool when the batch is large enough to pay for it. Returns an
+    # array shaped (3, runs, len(t_eval)), runs whose integration failed are NaN
+    workers = min(get_worker_count(n_jobs), len(params) // MIN_RUNS_PER_WORKER)
+    if workers <= 1:
+        return perform_ensemble_simulation(model, y0, t_eval, params, **solver_options)
+
+    rows = np.hstack([params, y0.T])
+    y = map_population(
+        simulate_batch_task, rows, workers, model, t_eval, solver_options
+    )
+    return y.transpose(1, 0, 2)
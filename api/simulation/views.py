@@ -1,5 +1,27 @@
-from api.utilis.numerical_methods import perform_simulation
-from rest_framework.decorators import api_view
+from django.http import StreamingHttpResponse
+
+from api.simulation.sensitivity import (
+    get_design_options,
+    get_parameter_bounds,
+    run_sensitivity_analysis,
+)
+from api.simulation.utils import (
+    DEFAULT_CHUNK_SIZE,
+    get_batch_runs,
+    get_simulation_inputs,
+    iter_simulation_windows,
+    simulate_batch,
+)
+from api.utilis.cache import get_cache
+from api.utilis.model_registry import MODELS
+from api.utilis.numerical_methods import perform_cached_simulation, get_solver_options
+from api.utilis.downsampling import downsample, get_sampling_options
+from api.utilis.executors import async_compute_view
+from api.utilis.renderers import ColumnarRenderer, CSVRenderer, NDJSONRenderer
+from api.utilis.trajectory_grid import get_grid
+from django.conf import settings
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
 import matplotlib
@@ -12,57 +34,46 @@ matplotlib.use("Agg")
 
 
 @api_view(["POST"])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, ColumnarRenderer])
 def simulation(request):
     # Get the inputs from the request
-    model = request.data.get("model")
-    mu = request.data.get("mu")
-    Y = request.data.get("Y")
-    Yp = request.data.get("Yp")
-    Ks = request.data.get("Ks")
-    Ki = request.data.get("Ki")
-    X0 = request.data.get("X0")
-    S0 = request.data.get("S0")
-    P0 = request.data.get("P0")
     step_size = request.data.get("step_size")
     tf = request.data.get("tf")
 
-    # Check that all inputs are provided
-    if any(val is None for val in [mu, Y, Yp, Ks, X0, S0, P0, step_size, tf]):
+    # Read the inputs, the integration method, tolerances and output sampling
+    try:
+        model, y0, params = get_simulation_inputs(request.data)
+        solver_options = get_solver_options(request.data)
+        times, max_points = get_sampling_options(request.data)
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # The time grid is not needed when the times are given
+    if times is None and (step_size is None or tf is None):
         return Response(
             {"error": "All inputs are required"}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    # try:
-    # Convert the inputs to floats
-    mu = float(mu)
-    Y = float(Y)
-    Yp = float(Yp)
-    Ks = float(Ks)
-    X0 = float(X0)
-    S0 = float(S0)
-    P0 = float(P0)
-    step_size = float(step_size)
-    tf = float(tf)
-
-    if Ki is not None:
-        Ki = float(Ki)
-        params = (mu, Y, Yp, Ks, Ki)
-    else:
-        params = (mu, Y, Yp, Ks)
-
     # Perform simulation
 
-    # Create an array of time points with the specified step size
-    t_eval = np.arange(0, tf + step_size, step_size)
-    sol = perform_simulation(model, [X0, S0, P0], t_eval, params)
+    # Create an array of time points with the specified step size, unless the
+    # solution is asked for at given times. The solver picks its own steps either
+    # way, the time points only say where the solution is evaluated
+    if times is None:
+        step_size = float(step_size)
+        tf = float(tf)
+        t_eval = np.arange(0, tf + step_size, step_size)
+    else:
+        t_eval = times
+    sol = perform_cached_simulation(model, y0, t_eval, params, **solver_options)
 
-    # Serialize the simulation results
-    time_data = sol.t.tolist()
-    x_data = sol.y[0].tolist()
-    s_data = sol.y[1].tolist()
-    p_data = sol.y[2].tolist()
+    # Bound the size of the response while keeping the shape of each curve
+    t_data, y_data = sol.t, sol.y
+    if max_points is not None:
+        t_data, y_data = downsample(t_data, y_data, max_points)
 
-    response_data = {"time": time_data, "x": x_data, "s": s_data, "p": p_data}
+    # The arrays are serialized by the renderer, as JSON lists or binary columns
+    response_data = {"time": t_data, "x": y_data[0], "s": y_data[1], "p": y_data[2]}
 
     return Response(response_data)
 
@@ -79,3 +90,217 @@ def simulation(request):
     #         {"error": "An error occurred during the simulation"},
     #         status=status.HTTP_500_INTERNAL_SERVER_ERROR,
     #     )
+
+
+# Version of simulation for the ASGI server, see async_compute_view
+async_simulation = async_compute_view(simulation, "simulation")
+
+
+@api_view(["POST"])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, ColumnarRenderer])
+def preview_simulation(request):
+    # Takes the inputs of a simulation and answers from the precomputed
+    # trajectory grid of the model when it covers them within the tolerance,
+    # otherwise it solves. "source" says which one happened and "error_bound"
+    # bounds the error of the grid, relative to X0 + Y * S0 and for each state
+    step_size = request.data.get("step_size")
+    tf = request.data.get("tf")
+
+    try:
+        model, y0, params = get_simulation_inputs(request.data)
+        solver_options = get_solver_options(request.data)
+        times, _ = get_sampling_options(request.data)
+        tolerance = float(
+            request.data.get(
+                "tolerance", getattr(settings, "TRAJECTORY_GRID_TOLERANCE", 1e-3)
+            )
+        )
+        if times is None:
+            if step_size is None or tf is None:
+                raise ValueError("All inputs are required")
+            step_size = float(step_size)
+            tf = float(tf)
+            t_eval = np.arange(0, tf + step_size, step_size)
+        else:
+            t_eval = times
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    grid = get_grid(model)
+    preview = grid.preview(y0, params, t_eval) if grid is not None else None
+    if preview is not None and preview[1]["relative"] <= tolerance:
+        y_data, error_bound = preview
+        source = "grid"
+    else:
+        sol = perform_cached_simulation(model, y0, t_eval, params, **solver_options)
+        y_data, error_bound = sol.y, None
+        source = "solve"
+
+    response_data = {
+        "time": t_eval,
+        "x": y_data[0],
+        "s": y_data[1],
+        "p": y_data[2],
+        "source": source,
+        "error_bound": error_bound,
+    }
+
+    return Response(response_data)
+
+
+@api_view(["POST"])
+@renderer_classes([JSONRenderer, NDJSONRenderer, CSVRenderer])
+def stream_simulation(request):
+    # Integrates the time grid window by window and sends every window as soon
+    # as it is ready, as newline-delimited JSON by default or as CSV
+    step_size = request.data.get("step_size")
+    tf = request.data.get("tf")
+    chunk_size = request.data.get("chunk_size", DEFAULT_CHUNK_SIZE)
+
+    try:
+        model, y0, params = get_simulation_inputs(request.data)
+        solver_options = get_solver_options(request.data)
+        if step_size is None or tf is None:
+            raise ValueError("All inputs are required")
+        step_size = float(step_size)
+        tf = float(tf)
+        chunk_size = int(chunk_size)
+        if step_size <= 0 or tf < 0 or chunk_size < 1:
+            raise ValueError(
+                "step_size and chunk_size must be positive and tf non-negative"
+            )
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    windows = iter_simulation_windows(
+        model, y0, params, step_size, tf, chunk_size, **solver_options
+    )
+
+    if isinstance(request.accepted_renderer, CSVRenderer):
+        renderer = request.accepted_renderer
+
+        def chunks():
+            for index, window in enumerate(windows):
+                # A CSV table cannot carry an error, it ends at the failed window
+                if "error" in window:
+                    return
+                yield renderer.render(window, renderer_context={"header": index == 0})
+
+    else:
+        renderer = NDJSONRenderer()
+
+        def chunks():
+            for window in windows:
+                yield renderer.render(window)
+
+    response = StreamingHttpResponse(chunks(), content_type=renderer.media_type)
+    response["X-Accel-Buffering"] = "no"
+
+    return response
+
+
+@api_view(["POST"])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, ColumnarRenderer])
+def batch_simulation(request):
+    # Simulates many parameter sets and initial conditions on one time grid. The
+    # runs come inline as "runs" or as an uploaded CSV file with one run per row
+    step_size = request.data.get("step_size")
+    tf = request.data.get("tf")
+
+    try:
+        model, params, y0 = get_batch_runs(request.data, request.FILES.get("file"))
+        solver_options = get_solver_options(request.data)
+        times, _ = get_sampling_options(request.data)
+        n_jobs = int(request.data.get("n_jobs", -1))
+        if times is None:
+            if step_size is None or tf is None:
+                raise ValueError("All inputs are required")
+            step_size = float(step_size)
+            tf = float(tf)
+            t_eval = np.arange(0, tf + step_size, step_size)
+        else:
+            t_eval = times
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    y = simulate_batch(model, params, y0, t_eval, solver_options, n_jobs)
+    success = ~np.isnan(y).any(axis=(0, 2))
+
+    # One row per run, failed runs are NaN in binary columns and null in JSON
+    response_data = {
+        "time": t_eval,
+        "x": y[0],
+        "s": y[1],
+        "p": y[2],
+        "success": success,
+    }
+    if not success.all() and not isinstance(
+        request.accepted_renderer, ColumnarRenderer
+    ):
+        for key in ("x", "s", "p"):
+            response_data[key] = [
+                row.tolist() if ok else None
+                for row, ok in zip(response_data[key], success)
+            ]
+
+    return Response(response_data)
+
+
+@api_view(["POST"])
+def sensitivity_analysis(request):
+    # Global sensitivity of the simulated trajectories to the kinetic parameters
+    # varied within "bounds", by Morris screening or Sobol indices
+    step_size = request.data.get("step_size")
+    tf = request.data.get("tf")
+    analysis = request.data.get("analysis", "sobol")
+
+    try:
+        model = request.data.get("model")
+        varied, bounds, base = get_parameter_bounds(request.data, model)
+        y0 = [float(request.data[name]) for name in ("X0", "S0", "P0")]
+        options = get_design_options(request.data, analysis)
+        solver_options = get_solver_options(request.data)
+        times, _ = get_sampling_options(request.data)
+        n_jobs = int(request.data.get("n_jobs", -1))
+        if times is None:
+            if step_size is None or tf is None:
+                raise ValueError("All inputs are required")
+            step_size = float(step_size)
+            tf = float(tf)
+            t_eval = np.arange(0, tf + step_size, step_size)
+        else:
+            t_eval = times
+
+        response_data = run_sensitivity_analysis(
+            model,
+            analysis,
+            varied,
+            bounds,
+            base,
+            y0,
+            t_eval,
+            options,
+            solver_options,
+            n_jobs,
+        )
+    except KeyError:
+        return Response(
+            {"error": "All inputs are required"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    except (ValueError, TypeError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(response_data)
+
+
+@api_view(["GET"])
+def cache_stats(request):
+    # Hit and miss counters of the result cache of this server process
+    return Response(get_cache().stats())
+
+
+@api_view(["GET"])
+def kinetic_models(request):
+    # Models of the registry with their ordered parameters and default search
+    # ranges
+    return Response([kinetic_model.describe() for kinetic_model in MODELS.values()])
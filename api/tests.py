@@ -1,3 +1,369 @@
-from django.test import TestCase
+import tempfile
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from api.models import Dataset
+from api.optimization.media import ResponseSurfaceModel, RunningMoments
+from api.utilis.downsampling import downsample
+from api.utilis.model_registry import MODELS
+from api.utilis.numerical_methods import (
+    perform_ensemble_simulation,
+    perform_simulation,
+)
+from api.utilis.trajectory_grid import build_grid
+from users.models import Member
 
 # Create your tests here.
+
+
+def make_member(username):
+    user = User.objects.create_user(username=username, password="password")
+    Member.objects.create(user=user, role="Lab Director")
+    return user
+
+
+def make_client(user=None):
+    client = APIClient()
+    if user is not None:
+        client.force_authenticate(user)
+    return client
+
+
+class ReducedSimulationTests(TestCase):
+    # The closed-form Monod solution and the reduced-state solves against a
+    # tight solve of the three states
+    t_eval = np.linspace(0, 40, 81)
+    y0 = [0.1, 20, 0.5]
+
+    def reference(self, model, params):
+        return perform_simulation(
+            model, self.y0, self.t_eval, params, rtol=1e-11, atol=1e-12, reduced=False
+        ).y
+
+    def test_monod_closed_form(self):
+        for params in ([0.5, 0.5, 0.3, 2], [1.2, 0.2, 0.8, 0.05], [0.1, 0.9, 0, 30]):
+            sol = perform_simulation("monod", self.y0, self.t_eval, params)
+            self.assertEqual(sol.nfev, 0)
+            np.testing.assert_allclose(
+                sol.y, self.reference("monod", params), rtol=1e-7, atol=1e-8
+            )
+
+    def test_reduced_inhibition(self):
+        params = [0.5, 0.5, 0.3, 2, 0.01]
+        sol = perform_simulation(
+            "inhibition", self.y0, self.t_eval, params, rtol=1e-8, atol=1e-10
+        )
+        np.testing.assert_allclose(
+            sol.y, self.reference("inhibition", params), rtol=1e-6, atol=1e-7
+        )
+
+    def test_ensemble_matches_single_solves(self):
+        params = np.array([[0.5, 0.5, 0.3, 2, 0.01], [0.8, 0.4, 0.1, 5, 0.05]])
+        y = perform_ensemble_simulation(
+            "inhibition", self.y0, self.t_eval, params, rtol=1e-8, atol=1e-10
+        )
+        for i, member in enumerate(params):
+            np.testing.assert_allclose(
+                y[:, i], self.reference("inhibition", member), rtol=1e-6, atol=1e-7
+            )
+
+
+class ModelJacobianTests(TestCase):
+    # Analytic Jacobians of every registered model against central differences
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def random_params(self, model):
+        low, high = np.array([model.bounds[name] for name in model.parameters]).T
+        # Away from the ends of the ranges, where the yields may be zero
+        return low + (0.1 + 0.8 * self.rng.random(len(low))) * (high - low)
+
+    def test_state_jacobian(self):
+        for name, model in MODELS.items():
+            for _ in range(5):
+                y = self.rng.uniform(0.1, 10, 3)
+                params = self.random_params(model)
+                expected = np.empty((3, 3))
+                for j in range(3):
+                    h = 1e-6 * max(1.0, abs(y[j]))
+                    step = np.zeros(3)
+                    step[j] = h
+                    expected[:, j] = (
+                        model.model_function(0, y + step, *params)
+                        - model.model_function(0, y - step, *params)
+                    ) / (2 * h)
+                np.testing.assert_allclose(
+                    model.jacobian(0, y, *params),
+                    expected,
+                    rtol=1e-5,
+                    atol=1e-8,
+                    err_msg=name,
+                )
+
+    def test_parameter_jacobian(self):
+        for name, model in MODELS.items():
+            for _ in range(5):
+                y = self.rng.uniform(0.1, 10, 3)
+                params = self.random_params(model)
+                expected = np.empty((3, len(params)))
+                for j in range(len(params)):
+                    h = 1e-6 * max(1.0, abs(params[j]))
+                    step = np.zeros(len(params))
+                    step[j] = h
+                    expected[:, j] = (
+                        model.model_function(0, y, *(params + step))
+                        - model.model_function(0, y, *(params - step))
+                    ) / (2 * h)
+                np.testing.assert_allclose(
+                    model.parameter_jacobian(0, y, *params),
+                    expected,
+                    rtol=1e-5,
+                    atol=1e-8,
+                    err_msg=name,
+                )
+
+                # sensitivity_terms gives the three of them at once
+                dydt, jacobian, parameter_jacobian = model.sensitivity_terms(
+                    0, y, *params
+                )
+                np.testing.assert_allclose(dydt, model.model_function(0, y, *params))
+                np.testing.assert_allclose(jacobian, model.jacobian(0, y, *params))
+                np.testing.assert_allclose(
+                    parameter_jacobian, expected, rtol=1e-5, atol=1e-8
+                )
+
+
+class TrajectoryGridTests(TestCase):
+    # Previews interpolated from small grids stay within their error bound
+
+    def check_previews(self, model, config, n_params):
+        rng = np.random.default_rng(1)
+        with tempfile.TemporaryDirectory() as directory:
+            grid = build_grid(model, directory, config)
+            for _ in range(20):
+                X0, S0 = rng.uniform(0.05, 1), rng.uniform(5, 50)
+                mu, Y, Yp = (
+                    rng.uniform(0.1, 1),
+                    rng.uniform(0.2, 0.8),
+                    rng.uniform(0, 1),
+                )
+                C = X0 + Y * S0
+                # Ks and Ki inside the ranges of a = Ks Y / C and b = Ki C / Y
+                params = [mu, Y, Yp, rng.uniform(0.02, 9) * C / Y]
+                params += [rng.uniform(0, 0.9) * Y / C] * (n_params - 4)
+                t_eval = np.linspace(0, 60 / mu, 50)
+
+                preview = grid.preview([X0, S0, 0.0], params, t_eval)
+                self.assertIsNotNone(preview)
+                y, error_bound = preview
+                exact = perform_simulation(
+                    model,
+                    [X0, S0, 0.0],
+                    t_eval,
+                    params,
+                    rtol=1e-10,
+                    atol=1e-12,
+                    reduced=False,
+                ).y
+                for i, name in enumerate("xsp"):
+                    self.assertLessEqual(
+                        np.max(np.abs(y[i] - exact[i])), error_bound[name] + 1e-9
+                    )
+
+    def test_monod_preview(self):
+        self.check_previews("monod", {"axes": {"a": (1e-2, 1e1, 9, 0.0)}}, 4)
+
+    def test_inhibition_preview(self):
+        config = {"axes": {"a": (1e-2, 1e1, 5, 0.0), "b": (0.0, 1.0, 5, 1e-3)}}
+        self.check_previews("inhibition", config, 5)
+
+
+class DownsampleTests(TestCase):
+
+    def test_number_of_points(self):
+        rng = np.random.default_rng(2)
+        for n in (2, 3, 10, 101, 1000, 4321):
+            t = np.sort(rng.random(n))
+            y = rng.random((3, n))
+            for max_points in (3, 10, 100, 1000):
+                t_out, y_out = downsample(t, y, max_points)
+                expected = min(n, max_points)
+                self.assertEqual(len(t_out), expected)
+                self.assertEqual(y_out.shape, (3, expected))
+                # The ends are kept and the times stay in order
+                self.assertEqual(t_out[0], t[0])
+                self.assertEqual(t_out[-1], t[-1])
+                self.assertTrue(np.all(np.diff(t_out) > 0))
+
+
+class ResponseSurfaceModelTests(TestCase):
+    # The chunked QR fit against LinearRegression on the whole data
+
+    def fit(self, X, y, degree, normalization, chunk_rows):
+        model = ResponseSurfaceModel(X.shape[1], degree, normalization)
+        if normalization:
+            moments = RunningMoments(X.shape[1])
+            for start in range(0, len(X), chunk_rows):
+                moments.update(X[start : start + chunk_rows])
+            model.set_scaler(moments)
+        for start in range(0, len(X), chunk_rows):
+            model.partial_fit(
+                X[start : start + chunk_rows], y[start : start + chunk_rows]
+            )
+        model.solve()
+        return model
+
+    def test_matches_linear_regression(self):
+        # Factors of moderate range, on which LinearRegression is accurate
+        # without standardization too
+        rng = np.random.default_rng(3)
+        X = rng.random((2000, 3)) * [2, 1, 3]
+        y = X @ [1.0, -2.0, 0.3] - 0.5 * X[:, 0] ** 2 + rng.normal(0, 0.1, len(X))
+        X_test = rng.random((50, 3)) * [2, 1, 3]
+        for degree in (1, 2, 3):
+            for normalization in (False, True):
+                steps = [
+                    PolynomialFeatures(degree, include_bias=False),
+                    LinearRegression(),
+                ]
+                if normalization:
+                    steps.insert(0, StandardScaler())
+                expected = make_pipeline(*steps).fit(X, y).predict(X_test)
+
+                model = self.fit(X, y, degree, normalization, chunk_rows=300)
+                np.testing.assert_allclose(
+                    model.predict(X_test), expected, rtol=1e-7, atol=1e-7
+                )
+
+
+@override_settings(RESULT_CACHE_DIR=None)
+class DatasetTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(DATASET_DIR=self.directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.alice = make_client(make_member("alice"))
+        self.bob = make_client(make_member("bob"))
+        self.columns = {"t": [0, 1, 2, 3], "x": [0.1, 0.2, 0.4, 0.8]}
+
+    def upload(self, client, **data):
+        return client.post("/api/datasets/", data, format="json")
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload(self.alice, name="run", data=self.columns)
+        self.assertEqual(first.status_code, 201)
+
+        # The same values as CSV give the same dataset back
+        csv = "t,x\n" + "\n".join(
+            f"{t},{x}" for t, x in zip(self.columns["t"], self.columns["x"])
+        )
+        second = self.upload(self.alice, csv=csv)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["dataset_id"], first.json()["dataset_id"])
+        self.assertEqual(Dataset.objects.count(), 1)
+
+        # Another owner gets a dataset of their own that shares the files
+        other = self.upload(self.bob, name="run", data=self.columns)
+        self.assertEqual(other.status_code, 201)
+        self.assertNotEqual(other.json()["dataset_id"], first.json()["dataset_id"])
+        self.assertEqual(other.json()["content_hash"], first.json()["content_hash"])
+
+    def test_owners_only_see_their_datasets(self):
+        dataset_id = self.upload(self.alice, data=self.columns).json()["dataset_id"]
+        url = f"/api/datasets/{dataset_id}/"
+
+        self.assertEqual(self.alice.get(url).status_code, 200)
+        self.assertEqual(self.bob.get(url).status_code, 404)
+        self.assertEqual(self.bob.delete(url).status_code, 404)
+        self.assertEqual(self.bob.get("/api/datasets/").json(), [])
+        self.assertEqual(make_client().get("/api/datasets/").status_code, 401)
+
+        # Nor can they fit another owner's dataset
+        response = self.bob.post(
+            "/api/parameter-optimization/",
+            {"datasetId": dataset_id},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(RESULT_CACHE_DIR=None)
+class OptimizationJobTests(TransactionTestCase):
+    # The jobs run in threads of their own, which only see committed rows
+
+    def setUp(self):
+        self.alice = make_client(make_member("alice"))
+        self.bob = make_client(make_member("bob"))
+
+        t = np.arange(0, 30.5, 1.0)
+        y = perform_simulation("monod", [0.1, 20, 0], t, (0.5, 0.5, 0.3, 2)).y
+        self.payload = {
+            "kineticData": {
+                "model": "monod",
+                "mu": {"optimize": True, "min": 0.1, "max": 1},
+                "Yx": {"optimize": True, "min": 0.1, "max": 1},
+                "Yp": {"optimize": False, "fixed": 0.3},
+                "Ks": {"optimize": True, "min": 0.1, "max": 5},
+            },
+            "experimentalData": {
+                "t": t.tolist(),
+                "x": y[0].tolist(),
+                "s": y[1].tolist(),
+                "p": y[2].tolist(),
+            },
+            "GAParams": {"max_num_iteration": 5, "population_size": 10, "n_jobs": 1},
+        }
+
+    def submit(self, client, payload):
+        return client.post("/api/parameter-optimization/jobs/", payload, format="json")
+
+    def wait(self, job_id, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.alice.get(f"/api/parameter-optimization/jobs/{job_id}/").json()
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.1)
+        self.fail(f"Job {job_id} did not finish")
+
+    def test_submit_and_poll(self):
+        response = self.submit(self.alice, self.payload)
+        self.assertEqual(response.status_code, 202)
+        job = self.wait(response.json()["job_id"])
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["error"], "")
+        self.assertIn("best_params", job["result"])
+
+    def test_cancel(self):
+        payload = dict(
+            self.payload,
+            GAParams={"max_num_iteration": 100000, "population_size": 10, "n_jobs": 1},
+        )
+        job_id = self.submit(self.alice, payload).json()["job_id"]
+        url = f"/api/parameter-optimization/jobs/{job_id}/cancel/"
+        response = self.alice.post(url)
+        self.assertEqual(response.status_code, 200)
+        # A cancelled fit keeps the best result found so far, if it started
+        self.assertEqual(self.wait(job_id)["status"], "cancelled")
+
+    def test_jobs_belong_to_their_owner(self):
+        self.assertEqual(self.submit(make_client(), self.payload).status_code, 401)
+
+        job_id = self.submit(self.alice, self.payload).json()["job_id"]
+        url = f"/api/parameter-optimization/jobs/{job_id}/"
+        self.assertEqual(self.bob.get(url).status_code, 404)
+        self.assertEqual(self.bob.post(f"{url}cancel/").status_code, 404)
+        self.assertEqual(make_client().get(url).status_code, 401)
+        self.wait(job_id)
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+# Part of every key, bump it when the numerical code changes the results
+CACHE_VERSION = 3
+
+
+def is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(
+        value, (bool, np.bool_)
+    )
+
+
+def digest_array(array):
+    # Numeric sequences are hashed from their float64 bytes, which stays fast
+    # for the millions of time points of a dense simulation
+    array = np.ascontiguousarray(array, dtype="<f8")
+    digest = hashlib.sha256(array.tobytes()).hexdigest()
+    return f"array:{array.shape}:{digest}"
+
+
+def canonicalize(value):
+    # Plain JSON types with every number as a float, so that equal inputs give
+    # the same key no matter whether they came as ints, floats or numpy values
+    if isinstance(value, dict):
+        return {str(key): canonicalize(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray) and value.dtype.kind in "iuf":
+        return digest_array(value)
+    if isinstance(value, (list, tuple)) and value and all(map(is_number, value)):
+        return digest_array(value)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [canonicalize(item) for item in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if value is None or isinstance(value, str):
+        return value
+    if is_number(value):
+        return float(value)
+    raise TypeError(f"Cannot build a cache key from {type(value).__name__}")
+
+
+def make_key(namespace, *parts):
+    # Content address of the inputs of a computation
+    document = json.dumps(
+        [CACHE_VERSION, namespace, canonicalize(parts)],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    # Two-tier cache of pickled results: a bounded LRU in this process and,
+    # when a directory is given, files shared by every server process on the
+    # machine. The disk tier drops its least recently used files once it grows
+    # past max_bytes. The counters belong to this process
+
+    def __init__(
+        self,
+        max_entries=256,
+        directory=None,
+        max_bytes=512 * 1024**2,
+        max_memory_bytes=128 * 1024**2,
+    ):
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_bytes = 0
+        self.directory = Path(directory) if directory else None
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "disk_evictions": 0,
+        }
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get_path(self, key):
+        return self.directory / f"{key}.pkl"
+
+    def get(self, key):
+        # Returns the cached value or None, every call returns a fresh copy
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["memory_hits"] += 1
+                return pickle.loads(data)
+
+        data = self.read_disk(key)
+        value = None
+        if data is not None:
+            try:
+                value = pickle.loads(data)
+            except Exception:
+                # Files written by an older release may no longer load
+                self.get_path(key).unlink(missing_ok=True)
+
+        with self.lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self.counters["disk_hits"] += 1
+            self.store_memory(key, data)
+        return value
+
+    def set(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.counters["writes"] += 1
+            self.store_memory(key, data)
+        self.write_disk(key, data)
+
+    def store_memory(self, key, data):
+        # Called with the lock held. Results larger than the whole memory tier
+        # only go to disk
+        if len(data) > self.max_memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+        while (
+            len(self.memory) > self.max_entries
+            or self.memory_bytes > self.max_memory_bytes
+        ):
+            self.memory_bytes -= len(self.memory.popitem(last=False)[1])
+
+    def read_disk(self, key):
+        if self.directory is None:
+            return None
+        path = self.get_path(key)
+        try:
+            data = path.read_bytes()
+            # The modification time orders the files for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def write_disk(self, key, data):
+        if self.directory is None or len(data) > self.max_bytes:
+            return
+        # Readers in other processes never see a partly written file
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temporary, self.get_path(key))
+        except OSError:
+            Path(temporary).unlink(missing_ok=True)
+            return
+        self.evict_disk()
+
+    def evict_disk(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self.lock:
+                self.counters["disk_evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if self.directory is not None:
+            for path in self.directory.glob("*.pkl"):
+                path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+            stats["memory_bytes"] = self.memory_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        if self.directory is not None:
+            sizes = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pkl"):
+                    try:
+                        sizes.append(entry.stat().st_size)
+                    except OSError:
+                        continue
+            stats["disk_entries"] = len(sizes)
+            stats["disk_bytes"] = sum(sizes)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_entries=getattr(settings, "RESULT_CACHE_MAX_ENTRIES", 256),
+                directory=getattr(settings, "RESULT_CACHE_DIR", None),
+                max_bytes=getattr(settings, "RESULT_CACHE_MAX_BYTES", 512 * 1024**2),
+                max_memory_bytes=getattr(
+                    settings, "RESULT_CACHE_MAX_MEMORY_BYTES", 128 * 1024**2
+                ),
+            )
+        return _cache
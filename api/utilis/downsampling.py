@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and, from
+    # each of n_out - 2 buckets, the point that forms the largest triangle with
+    # the point kept before it and the average of the next bucket. This keeps
+    # the peaks and turns a chart shows. y is one series or several rows
+    # sampled at x, whose triangle areas add up
+    y = np.atleast_2d(y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # The last bucket looks ahead to the last point
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[:, next_start:next_end].mean(axis=1, keepdims=True)
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[:, start:end] - y[:, a, None])
+            - (x[a] - x[start:end]) * (avg_y - y[:, a, None])
+        ).sum(axis=0)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample(t, y, max_points):
+    # Shape-preserving downsample of several series sampled at the same times
+    # to exactly max_points. The buckets are shared and each one keeps the point
+    # of largest total triangle area over the series, each scaled by its range
+    # so that none of them dominates the choice
+    t = np.asarray(t)
+    y = np.atleast_2d(y)
+    if len(t) <= max_points:
+        return t, y
+
+    scale = np.ptp(y, axis=1, keepdims=True)
+    scale[~(scale > 0)] = 1.0
+    indices = lttb_indices(t, y / scale, max_points)
+    return t[indices], y[:, indices]
+
+
+def get_sampling_options(data):
+    # Reads the optional output sampling of a simulation request: "times" asks
+    # for the solution at those times only and "max_points" bounds the number
+    # of returned points. Raises ValueError for invalid values
+    times = data.get("times")
+    if times is not None:
+        try:
+            times = np.asarray(times, dtype=float)
+        except (ValueError, TypeError):
+            raise ValueError("times must be a non-empty list of numbers")
+        if times.ndim != 1 or len(times) == 0:
+            raise ValueError("times must be a non-empty list of numbers")
+        if not np.all(np.isfinite(times)) or times[0] < 0 or np.any(np.diff(times) < 0):
+            raise ValueError("times must be non-negative and in increasing order")
+
+    max_points = data.get("max_points")
+    if max_points is not None:
+        try:
+            valid = float(max_points) == int(max_points) >= 3
+        except (ValueError, TypeError):
+            valid = False
+        if not valid:
+            raise ValueError("max_points must be an integer of at least 3")
+        max_points = int(max_points)
+
+    return times, max_points
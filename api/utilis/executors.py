@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+# Async versions of the compute views for the ASGI server. Under ASGI, Django
+# runs every sync view in one thread shared by all the requests, so a long
+# simulation or fit holds up every other sync request, logins included. The
+# async version of a view runs it in the threads of its endpoint instead: the
+# threads bound the requests of the endpoint computing at once, the others wait
+# in the queue of the executor without holding a thread, and beyond
+# ASYNC_COMPUTE_QUEUE waiting requests the server answers 503
+
+DEFAULT_LIMITS = {"simulation": 4, "parameter_optimization": 1, "media_optimization": 2}
+DEFAULT_QUEUE = 32
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class ComputeExecutor:
+    # Threads of one endpoint and the count of its requests, running or waiting
+    def __init__(self, name, workers, queue):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"compute-{name}"
+        )
+        self.max_pending = workers + queue
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+
+
+def get_executor(name):
+    with _executors_lock:
+        if name not in _executors:
+            limits = {**DEFAULT_LIMITS, **getattr(settings, "ASYNC_COMPUTE_LIMITS", {})}
+            queue = getattr(settings, "ASYNC_COMPUTE_QUEUE", DEFAULT_QUEUE)
+            _executors[name] = ComputeExecutor(name, max(1, int(limits[name])), queue)
+        return _executors[name]
+
+
+def run_view(view, request, *args, **kwargs):
+    # The response is rendered here too, serializing the arrays of a large
+    # result is part of the work. The thread closes its database connection
+    # like the request handler does
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_compute_view(view, name):
+    # Async view running the sync DRF view in the executor of the endpoint name
+    async def async_view(request, *args, **kwargs):
+        executor = get_executor(name)
+        if not executor.acquire():
+            return JsonResponse(
+                {"error": "The server is busy, retry later"},
+                status=503,
+                headers={"Retry-After": "1"},
+            )
+        try:
+            return await sync_to_async(
+                run_view, thread_sensitive=False, executor=executor.executor
+            )(view, request, *args, **kwargs)
+        finally:
+            executor.release()
+
+    # DRF views are exempt from the CSRF middleware and check it themselves
+    async_view.csrf_exempt = True
+    async_view.__name__ = f"async_{view.__name__}"
+    return async_view
@@ -1,16 +1,131 @@
-def monod_model(t, y, mu, Y, Yp, Ks):
-    X, S, P = y
+# Growth kernels of the kinetic models. Every model shares the structure
+#   dX/dt = r,  dS/dt = -r / Y,  dP/dt = Yp * r (+ beta * X)
+# so a model is given by its growth rate r(X, S) and the partial derivatives of
+# r with respect to X, S and its own parameters. The kernels only use
+# arithmetic, they run on floats and numpy arrays alike and the model registry
+# compiles them to ufuncs when numba is installed
 
-    dXdt = mu * X * S / (Ks + S)
-    dSdt = -1 / Y * dXdt
-    dPdt = Yp * dXdt
-    return [dXdt, dSdt, dPdt]
 
+# Monod: r = mu * X * S / (Ks + S)
+def monod_rate(X, S, mu, Ks):
+    return mu * X * S / (Ks + S)
 
-def inhibition_model(t, y, mu, Y, Yp, Ks, Ki):
-    X, S, P = y
 
-    dXdt = mu * X * S / (Ks + S + Ki * S**2)
-    dSdt = -1 / Y * dXdt
-    dPdt = Yp * dXdt
-    return [dXdt, dSdt, dPdt]
+def monod_rate_X(X, S, mu, Ks):
+    return mu * S / (Ks + S)
+
+
+def monod_rate_S(X, S, mu, Ks):
+    return mu * X * Ks / (Ks + S) ** 2
+
+
+def monod_rate_mu(X, S, mu, Ks):
+    return X * S / (Ks + S)
+
+
+def monod_rate_Ks(X, S, mu, Ks):
+    return -mu * X * S / (Ks + S) ** 2
+
+
+# Substrate inhibition with a quadratic term: r = mu * X * S / (Ks + S + Ki * S**2)
+def inhibition_rate(X, S, mu, Ks, Ki):
+    return mu * X * S / (Ks + S + Ki * S**2)
+
+
+def inhibition_rate_X(X, S, mu, Ks, Ki):
+    return mu * S / (Ks + S + Ki * S**2)
+
+
+def inhibition_rate_S(X, S, mu, Ks, Ki):
+    return mu * X * (Ks - Ki * S**2) / (Ks + S + Ki * S**2) ** 2
+
+
+def inhibition_rate_mu(X, S, mu, Ks, Ki):
+    return X * S / (Ks + S + Ki * S**2)
+
+
+def inhibition_rate_Ks(X, S, mu, Ks, Ki):
+    return -mu * X * S / (Ks + S + Ki * S**2) ** 2
+
+
+def inhibition_rate_Ki(X, S, mu, Ks, Ki):
+    return -mu * X * S**3 / (Ks + S + Ki * S**2) ** 2
+
+
+# Contois: the saturation constant scales with the biomass,
+# r = mu * X * S / (Ks * X + S)
+def contois_rate(X, S, mu, Ks):
+    return mu * X * S / (Ks * X + S)
+
+
+def contois_rate_X(X, S, mu, Ks):
+    return mu * S**2 / (Ks * X + S) ** 2
+
+
+def contois_rate_S(X, S, mu, Ks):
+    return mu * Ks * X**2 / (Ks * X + S) ** 2
+
+
+def contois_rate_mu(X, S, mu, Ks):
+    return X * S / (Ks * X + S)
+
+
+def contois_rate_Ks(X, S, mu, Ks):
+    return -mu * X**2 * S / (Ks * X + S) ** 2
+
+
+# Haldane: substrate inhibition with the inhibition constant in concentration
+# units, r = mu * X * S / (Ks + S + S**2 / Ki)
+def haldane_rate(X, S, mu, Ks, Ki):
+    return mu * X * S / (Ks + S + S**2 / Ki)
+
+
+def haldane_rate_X(X, S, mu, Ks, Ki):
+    return mu * S / (Ks + S + S**2 / Ki)
+
+
+def haldane_rate_S(X, S, mu, Ks, Ki):
+    return mu * X * (Ks - S**2 / Ki) / (Ks + S + S**2 / Ki) ** 2
+
+
+def haldane_rate_mu(X, S, mu, Ks, Ki):
+    return X * S / (Ks + S + S**2 / Ki)
+
+
+def haldane_rate_Ks(X, S, mu, Ks, Ki):
+    return -mu * X * S / (Ks + S + S**2 / Ki) ** 2
+
+
+def haldane_rate_Ki(X, S, mu, Ks, Ki):
+    return mu * X * S**3 / (Ki * (Ks + S + S**2 / Ki)) ** 2
+
+
+# Andrews: non-competitive substrate inhibition,
+# r = mu * X * S / ((Ks + S) * (1 + S / Ki))
+def andrews_rate(X, S, mu, Ks, Ki):
+    return mu * X * S / ((Ks + S) * (1 + S / Ki))
+
+
+def andrews_rate_X(X, S, mu, Ks, Ki):
+    return mu * S / ((Ks + S) * (1 + S / Ki))
+
+
+def andrews_rate_S(X, S, mu, Ks, Ki):
+    return (
+        mu
+        * X
+        * (Ks * (1 + S / Ki) - S * (Ks + S) / Ki)
+        / ((Ks + S) * (1 + S / Ki)) ** 2
+    )
+
+
+def andrews_rate_mu(X, S, mu, Ks, Ki):
+    return X * S / ((Ks + S) * (1 + S / Ki))
+
+
+def andrews_rate_Ks(X, S, mu, Ks, Ki):
+    return -mu * X * S / ((Ks + S) ** 2 * (1 + S / Ki))
+
+
+def andrews_rate_Ki(X, S, mu, Ks, Ki):
+    return mu * X * S**2 / (Ki**2 * (Ks + S) * (1 + S / Ki) ** 2)
@@ -0,0 +1,324 @@
+import logging
+from operator import itemgetter
+
+import numpy as np
+
+from api.utilis import mathematical_models as kernels
+
+logger = logging.getLogger(__name__)
+
+# numba is in requirements.txt. With it, the growth kernels are compiled to
+# ufuncs whose machine code is cached on disk next to mathematical_models.py,
+# later processes load it instead of compiling again. The ufuncs evaluate
+# ensembles several times faster than numpy, single states keep the plain
+# kernels since a ufunc call costs more than their arithmetic. Without numba
+# the plain kernels are used everywhere
+try:
+    import numba
+except ImportError:
+    numba = None
+    logger.warning("numba is not installed, the kinetic models are not compiled")
+
+# Registered models by name, in the order they were registered
+MODELS = {}
+
+# Alternative names of the parameters that requests may use, for every model
+COMMON_ALIASES = {"Yx": "Y"}
+
+
+# Compiled ufunc of every kernel, models may share kernels
+_compiled = {}
+
+
+def compile_kernel(kernel, n_args):
+    if numba is None:
+        return kernel
+    if kernel not in _compiled:
+        signature = numba.float64(*[numba.float64] * n_args)
+        _compiled[kernel] = numba.vectorize([signature], cache=True)(kernel)
+    return _compiled[kernel]
+
+
+class KineticModel:
+    # A kinetic model built from its growth kernels, see mathematical_models.py.
+    # The ordered parameters start with mu, Y and Yp, which the reduced and
+    # closed-form solvers rely on. rate holds the kernel of the growth rate, its
+    # derivatives with respect to X and S and then one derivative for each of
+    # rate_parameters, the ordered parameters the kernels take after X and S.
+    # A product_parameter adds non-growth-associated product formation,
+    # dP/dt = Yp * r + beta * X, after which P is no longer a function of X and
+    # the model has no reduced form. bounds are the default search ranges of
+    # the parameters
+
+    def __init__(
+        self,
+        name,
+        label,
+        parameters,
+        bounds,
+        rate,
+        rate_parameters,
+        product_parameter=None,
+        aliases=None,
+    ):
+        if tuple(parameters[:3]) != ("mu", "Y", "Yp"):
+            raise ValueError("The parameters of a model must start with mu, Y and Yp")
+        if len(rate) != 3 + len(rate_parameters):
+            raise ValueError("rate needs one derivative for each rate parameter")
+
+        self.name = name
+        self.label = label
+        self.parameters = tuple(parameters)
+        self.bounds = {name: tuple(map(float, bounds[name])) for name in parameters}
+        self.aliases = {**COMMON_ALIASES, **(aliases or {})}
+        self.compiled = numba is not None
+
+        self.kernels = tuple(rate)
+        self.ufuncs = None
+        self.rate_index = [self.parameters.index(name) for name in rate_parameters]
+        # Every model takes mu and at least one constant, so this returns a tuple
+        self.rate_args = itemgetter(*self.rate_index)
+        self.product_index = (
+            None
+            if product_parameter is None
+            else self.parameters.index(product_parameter)
+        )
+        self.reduced = product_parameter is None
+
+    def get_value(self, data, name):
+        # Value of a parameter in a request under its name or one of its aliases
+        if data.get(name) is not None:
+            return data[name]
+        for alias, target in self.aliases.items():
+            if target == name and data.get(alias) is not None:
+                return data[alias]
+        return None
+
+    def get_kernels(self, X):
+        # Compiled on first use, so that only the models in use are loaded
+        if not self.compiled or not isinstance(X, np.ndarray):
+            return self.kernels
+        if self.ufuncs is None:
+            n_args = 2 + len(self.rate_index)
+            self.ufuncs = tuple(
+                compile_kernel(kernel, n_args) for kernel in self.kernels
+            )
+        return self.ufuncs
+
+    def model_function(self, t, y, *params):
+        X, S, P = y
+        Y, Yp = params[1], params[2]
+
+        dXdt = self.get_kernels(X)[0](X, S, *self.rate_args(params))
+        dSdt = -1 / Y * dXdt
+        dPdt = Yp * dXdt
+        if self.product_index is not None:
+            dPdt = dPdt + params[self.product_index] * X
+        return np.array([dXdt, dSdt, dPdt])
+
+    def jacobian(self, t, y, *params):
+        X, S, P = y
+        Y, Yp = params[1], params[2]
+
+        # Partial derivatives of the growth rate with respect to X and S
+        args = self.rate_args(params)
+        rate_X, rate_S = self.get_kernels(X)[1:3]
+        dfdX = rate_X(X, S, *args)
+        dfdS = rate_S(X, S, *args)
+        zero = np.zeros_like(dfdX)
+        dPdX = Yp * dfdX
+        if self.product_index is not None:
+            dPdX = dPdX + params[self.product_index]
+
+        return np.array(
+            [
+                [dfdX, dfdS, zero],
+                [-1 / Y * dfdX, -1 / Y * dfdS, zero],
+                [dPdX, Yp * dfdS, zero],
+            ]
+        )
+
+    def parameter_jacobian(self, t, y, *params):
+        X, S, P = y
+        Y, Yp = params[1], params[2]
+
+        # Partial derivatives of the equations with respect to every ordered
+        # parameter, one column each
+        args = self.rate_args(params)
+        kernels = self.get_kernels(X)
+        growth = kernels[0](X, S, *args)
+        zero = np.zeros_like(growth)
+        dX = [zero] * len(params)
+        dS = [zero, growth / Y**2] + [zero] * (len(params) - 2)
+        dP = [zero, zero, growth] + [zero] * (len(params) - 3)
+        for index, derivative in zip(self.rate_index, kernels[3:]):
+            dfdp = derivative(X, S, *args)
+            dX[index], dS[index], dP[index] = dfdp, -1 / Y * dfdp, Yp * dfdp
+        if self.product_index is not None:
+            dP[self.product_index] = X + zero
+
+        return np.array([dX, dS, dP])
+
+    def sensitivity_terms(self, t, y, *params):
+        # model_function, jacobian and parameter_jacobian of one state at once,
+        # for the forward sensitivities, which need all of them at every step
+        X, S, P = y
+        Y, Yp = params[1], params[2]
+        args = self.rate_args(params)
+        kernels = self.get_kernels(X)
+
+        growth = kernels[0](X, S, *args)
+        dfdX = kernels[1](X, S, *args)
+        dfdS = kernels[2](X, S, *args)
+        zero = np.zeros_like(growth)
+        dPdt = Yp * growth
+        dPdX = Yp * dfdX
+        dX = [zero] * len(params)
+        dS = [zero, growth / Y**2] + [zero] * (len(params) - 2)
+        dP = [zero, zero, growth] + [zero] * (len(params) - 3)
+        for index, derivative in zip(self.rate_index, kernels[3:]):
+            dfdp = derivative(X, S, *args)
+            dX[index], dS[index], dP[index] = dfdp, -1 / Y * dfdp, Yp * dfdp
+        if self.product_index is not None:
+            dPdt = dPdt + params[self.product_index] * X
+            dPdX = dPdX + params[self.product_index]
+            dP[self.product_index] = X + zero
+
+        dydt = np.array([growth, -1 / Y * growth, dPdt])
+        jacobian = np.array(
+            [
+                [dfdX, dfdS, zero],
+                [-1 / Y * dfdX, -1 / Y * dfdS, zero],
+                [dPdX, Yp * dfdS, zero],
+            ]
+        )
+        return dydt, jacobian, np.array([dX, dS, dP])
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "label": self.label,
+            "parameters": [
+                {
+                    "name": name,
+                    "min": self.bounds[name][0],
+                    "max": self.bounds[name][1],
+                    "aliases": [
+                        alias
+                        for alias, target in self.aliases.items()
+                        if target == name
+                    ],
+                }
+                for name in self.parameters
+            ],
+            "growth_associated": self.reduced,
+            "compiled": self.compiled,
+        }
+
+
+def register_model(name, *args, **kwargs):
+    # Makes a model available to the simulation and optimization endpoints
+    MODELS[name] = KineticModel(name, *args, **kwargs)
+    return MODELS[name]
+
+
+def get_model(name):
+    if name not in MODELS:
+        raise ValueError(f"Model must be one of {', '.join(MODELS)}")
+    return MODELS[name]
+
+
+# Default search ranges of the parameters every model has
+YIELD_BOUNDS = {"mu": (0.01, 2.0), "Y": (0.01, 1.0), "Yp": (0.0, 1.0)}
+
+register_model(
+    "monod",
+    "Monod",
+    ("mu", "Y", "Yp", "Ks"),
+    {**YIELD_BOUNDS, "Ks": (0.01, 50.0)},
+    (
+        kernels.monod_rate,
+        kernels.monod_rate_X,
+        kernels.monod_rate_S,
+        kernels.monod_rate_mu,
+        kernels.monod_rate_Ks,
+    ),
+    ("mu", "Ks"),
+)
+register_model(
+    "inhibition",
+    "Substrate inhibition",
+    ("mu", "Y", "Yp", "Ks", "Ki"),
+    {**YIELD_BOUNDS, "Ks": (0.01, 50.0), "Ki": (0.0, 0.1)},
+    (
+        kernels.inhibition_rate,
+        kernels.inhibition_rate_X,
+        kernels.inhibition_rate_S,
+        kernels.inhibition_rate_mu,
+        kernels.inhibition_rate_Ks,
+        kernels.inhibition_rate_Ki,
+    ),
+    ("mu", "Ks", "Ki"),
+)
+register_model(
+    "contois",
+    "Contois",
+    ("mu", "Y", "Yp", "Ks"),
+    {**YIELD_BOUNDS, "Ks": (0.01, 10.0)},
+    (
+        kernels.contois_rate,
+        kernels.contois_rate_X,
+        kernels.contois_rate_S,
+        kernels.contois_rate_mu,
+        kernels.contois_rate_Ks,
+    ),
+    ("mu", "Ks"),
+)
+register_model(
+    "haldane",
+    "Haldane",
+    ("mu", "Y", "Yp", "Ks", "Ki"),
+    {**YIELD_BOUNDS, "Ks": (0.01, 50.0), "Ki": (1.0, 500.0)},
+    (
+        kernels.haldane_rate,
+        kernels.haldane_rate_X,
+        kernels.haldane_rate_S,
+        kernels.haldane_rate_mu,
+        kernels.haldane_rate_Ks,
+        kernels.haldane_rate_Ki,
+    ),
+    ("mu", "Ks", "Ki"),
+)
+register_model(
+    "andrews",
+    "Andrews",
+    ("mu", "Y", "Yp", "Ks", "Ki"),
+    {**YIELD_BOUNDS, "Ks": (0.01, 50.0), "Ki": (1.0, 500.0)},
+    (
+        kernels.andrews_rate,
+        kernels.andrews_rate_X,
+        kernels.andrews_rate_S,
+        kernels.andrews_rate_mu,
+        kernels.andrews_rate_Ks,
+        kernels.andrews_rate_Ki,
+    ),
+    ("mu", "Ks", "Ki"),
+)
+# Monod growth with Luedeking-Piret product formation, Yp is the
+# growth-associated coefficient alpha
+register_model(
+    "luedeking_piret",
+    "Luedeking-Piret",
+    ("mu", "Y", "Yp", "Ks", "beta"),
+    {**YIELD_BOUNDS, "Ks": (0.01, 50.0), "beta": (0.0, 0.5)},
+    (
+        kernels.monod_rate,
+        kernels.monod_rate_X,
+        kernels.monod_rate_S,
+        kernels.monod_rate_mu,
+        kernels.monod_rate_Ks,
+    ),
+    ("mu", "Ks"),
+    product_parameter="beta",
+    aliases={"alpha": "Yp"},
+)
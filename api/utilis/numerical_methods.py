@@ -1,24 +1,511 @@
 import numpy as np
 from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult
+from scipy.sparse import bsr_matrix, diags
+from scipy.special import expit
 
-from api.utilis.mathematical_models import monod_model, inhibition_model
+from api.utilis.cache import get_cache, make_key
+from api.utilis.model_registry import get_model
+
+# Integration methods that can be requested, "auto" picks one based on stiffness
+SOLVER_METHODS = ("auto", "RK45", "LSODA", "BDF", "Radau")
+
+# Methods that make use of the analytic Jacobian
+IMPLICIT_METHODS = ("LSODA", "BDF", "Radau")
+
+# Above this stiffness ratio (spectral radius of the Jacobian times the time span)
+# an explicit method needs more steps for stability than for accuracy
+STIFFNESS_THRESHOLD = 250
+
+
+def get_model_functions(model):
+    kinetic_model = get_model(model)
+    return kinetic_model.model_function, kinetic_model.jacobian
+
+
+def get_model_args(model, params):
+    # Ordered kinetic parameters of one simulation as a tuple, checked against
+    # the registry
+    n_params = len(get_model(model).parameters)
+    args = tuple(params)
+    if len(args) != n_params:
+        raise ValueError(f"The {model} model takes {n_params} kinetic parameters")
+    return args
+
+
+def get_solver_options(data):
+    # Read the integration settings of a request, falling back to the solve_ivp defaults
+    method = data.get("method", "RK45")
+    if method not in SOLVER_METHODS:
+        raise ValueError(f"Method must be one of {', '.join(SOLVER_METHODS)}")
+
+    # Without atol the reduced integrations follow rtol alone and the others
+    # use the solve_ivp default
+    rtol = float(data.get("rtol", 1e-3))
+    atol = data.get("atol")
+    atol = float(atol) if atol is not None else None
+    if rtol <= 0 or (atol is not None and atol <= 0):
+        raise ValueError("rtol and atol must be positive")
+
+    return {"method": method, "rtol": rtol, "atol": atol}
+
+
+def rebuild_state(xi, y0, params):
+    # Substrate consumption and product formation are proportional to growth, so
+    # S and P are affine functions of X through the yield coefficients. The reduced
+    # state is xi = ln(X / (Y * S)), the log ratio between the biomass and the biomass
+    # the remaining substrate can still yield, which keeps 0 < X < C and S > 0
+    X0, S0, P0 = y0
+    Y, Yp = params[1], params[2]
+    C = X0 + Y * S0
+    X = C * expit(xi)
+    return np.array([X, C * expit(-xi) / Y, P0 + Yp * (X - X0)])
+
+
+def has_reduced_form(y0, params):
+    X0, S0, P0 = y0
+    return np.minimum.reduce([X0, S0, params[1]]) > 0
+
+
+def reduced_initial_state(y0, params):
+    X0, S0, P0 = y0
+    return np.log(X0 / (params[1] * S0))
+
+
+def reduced_state_scale(y0, params):
+    # Largest change of X, S or P per unit of xi is C / 4 times the largest of
+    # 1, 1 / Y and |Yp|, at X = C / 2
+    X0, S0, P0 = y0
+    Y, Yp = params[1], params[2]
+    C = X0 + Y * S0
+    return C * np.maximum(np.maximum(1.0, 1.0 / Y), np.abs(Yp)) / 4
+
+
+def reduced_tolerances(rtol, atol=None, scale=1.0):
+    # An absolute error d in xi is a relative error of at most d in both X and S,
+    # so the tolerances of the reduced state follow from the requested rtol. The
+    # tighter values keep the global error in line with the 3-state integration.
+    # A requested atol on the states is an absolute error of at most
+    # atol / scale in xi, with scale from reduced_state_scale
+    tolerances = {"rtol": rtol / 1000, "atol": rtol / 10}
+    if atol is not None:
+        tolerances["atol"] = np.minimum(tolerances["atol"], atol / scale)
+    return tolerances
+
+
+def reduced_model(t, xi, model_function, y0, params):
+    # dxi/dt = dX/dt * C / (X * Y * S). The clip only guards the evaluation against
+    # S underflowing to zero long after the substrate has run out
+    X, S, P = rebuild_state(np.clip(xi, -700, 700), y0, params)
+    C = y0[0] + params[1] * y0[1]
+    return model_function(t, (X, S, P), *params)[0] * C / (X * params[1] * S)
+
+
+def reduced_jacobian(t, xi, model_function, jacobian, y0, params):
+    # With f = dX/dt and f' = df/dX - 1/Y * df/dS along the yield line,
+    # d/dxi (dxi/dt) = f' - f / X + f / (Y * S)
+    X, S, P = rebuild_state(np.clip(xi, -700, 700), y0, params)
+    Y = params[1]
+    f = model_function(t, (X, S, P), *params)[0]
+    J = jacobian(t, (X, S, P), *params)
+    return J[0, 0] - 1 / Y * J[0, 1] - f / X + f / (Y * S)
+
+
+def estimate_stiffness(jacobian, y0, t_span, params):
+    # dS/dt and dP/dt are multiples of dX/dt, so the Jacobian has rank one and its
+    # only nonzero eigenvalue is df/dX - 1/Y * df/dS. Batch fermentations are
+    # stiffest when the substrate runs out, and the yield coefficients give that
+    # state without integrating
+    X0, S0, P0 = y0
+    Y, Yp = params[1], params[2]
+
+    with np.errstate(all="ignore"):
+        eigenvalues = []
+        for X in (X0, X0 + Y * S0):
+            y = (X, S0 - (X - X0) / Y, P0 + Yp * (X - X0))
+            J = jacobian(t_span[0], y, *params)
+            eigenvalues.append(np.abs(J[0, 0] - 1 / Y * J[0, 1]))
+        eigenvalues = np.max(eigenvalues, axis=0)
+
+    # One ratio per ensemble member when the parameters are arrays
+    return np.where(np.isnan(eigenvalues), 0.0, eigenvalues) * (t_span[1] - t_span[0])
+
+
+def select_method(jacobian, y0, t_span, params):
+    if np.max(estimate_stiffness(jacobian, y0, t_span, params)) > STIFFNESS_THRESHOLD:
+        return "LSODA"
+    return "RK45"
+
+
+def monod_closed_form(y0, t_eval, params):
+    # y0 and params may hold one value per ensemble member, in which case the
+    # solution is shaped (3, members, len(t_eval))
+    X0, S0, P0 = (np.asarray(value, dtype=float)[..., None] for value in y0)
+    mu, Y, Yp, Ks = (np.asarray(value, dtype=float)[..., None] for value in params)
+
+    # Biomass reached once all the substrate is consumed
+    C = X0 + Y * S0
+    a = Ks * Y / C
+
+    # Integrating the Monod model with S = (C - X) / Y gives the implicit solution
+    # mu * t = (1 + a) * ln(X / X0) + a * ln(S0 / S)
+    tau = mu * np.asarray(t_eval, dtype=float)
+    X = np.empty_like(tau)
+    S = np.empty_like(tau)
+
+    # The equation is nearly linear in ln(X) while X < C / 2 and in ln(S) afterwards,
+    # so Newton converges in a few iterations when each regime uses its own variable.
+    # Both start on the side of the root from which the iteration is monotone
+    X_half = np.maximum(C / 2, X0)
+    tau_half = (1 + a) * np.log(X_half / X0) + a * np.log(Y * S0 / (C - X_half))
+    growth = tau < tau_half
+
+    C, a, X0, S0, Y, X_half = (
+        np.broadcast_to(value, tau.shape) for value in (C, a, X0, S0, Y, X_half)
+    )
+
+    Cg, ag, X0g, S0g, Yg = (value[growth] for value in (C, a, X0, S0, Y))
+    u = np.log(X_half[growth])
+    for _ in range(50):
+        X_growth = np.exp(u)
+        S_growth = (Cg - X_growth) / Yg
+        G = (
+            (1 + ag) * np.log(X_growth / X0g)
+            + ag * np.log(S0g / S_growth)
+            - tau[growth]
+        )
+        u_new = u - G / ((1 + ag) + ag * X_growth / (Yg * S_growth))
+        converged = np.all(np.abs(u_new - u) <= 1e-13 * (1 + np.abs(u)))
+        u = u_new
+        if converged:
+            break
+    X[growth] = np.exp(u)
+    S[growth] = (Cg - X[growth]) / Yg
+
+    Cd, ad, X0d, S0d, Yd = (value[~growth] for value in (C, a, X0, S0, Y))
+    v = np.log((Cd - X_half[~growth]) / Yd)
+    for _ in range(50):
+        S_depletion = np.exp(v)
+        X_depletion = Cd - Yd * S_depletion
+        G = (1 + ad) * np.log(X_depletion / X0d) + ad * (np.log(S0d) - v) - tau[~growth]
+        v_new = v + G / ((1 + ad) * Yd * S_depletion / X_depletion + ad)
+        converged = np.all(np.abs(v_new - v) <= 1e-13 * (1 + np.abs(v)))
+        v = v_new
+        if converged:
+            break
+    S[~growth] = np.exp(v)
+    X[~growth] = Cd - Yd * S[~growth]
+
+    return OptimizeResult(
+        t=np.asarray(t_eval, dtype=float),
+        y=np.array([X, S, P0 + Yp * (X - X0)]),
+        sol=None,
+        t_events=None,
+        y_events=None,
+        nfev=0,
+        njev=0,
+        nlu=0,
+        status=0,
+        message="Closed-form solution of the Monod model.",
+        success=True,
+    )
+
+
+def has_monod_closed_form(y0, t_eval, params):
+    X0, S0, P0 = y0
+    mu, Y, Yp, Ks = params
+    # The substrate must still register next to the biomass, X0 + Y * S0 rounds
+    # to X0 once it is depleted to the last digits
+    return (
+        (np.minimum.reduce([X0, S0, mu, Y, Ks]) > 0)
+        & (np.asarray(X0) + np.asarray(Y) * np.asarray(S0) > np.asarray(X0))
+        & (t_eval[0] >= 0)
+    )
 
 
 # Function to perform the simulation
-def perform_simulation(model, y0, t_eval, params):
+def perform_simulation(
+    model, y0, t_eval, params, method="RK45", rtol=1e-3, atol=None, reduced=True
+):
     # Define the time span
     t_span = [0, t_eval[-1]]
 
-    # Solve the differential equations
+    model_function, jacobian = get_model_functions(model)
 
-    if model == "monod":
-        mu, Yx, Yp, Ks = params
-        sol = solve_ivp(monod_model, t_span, y0, args=(mu, Yx, Yp, Ks), t_eval=t_eval)
-    elif model == "inhibition":
-        mu, Yx, Yp, Ks, Ki = params
+    # Validate the number of kinetic parameters for the model
+    args = get_model_args(model, params)
+
+    if method == "auto":
+        method = select_method(jacobian, y0, t_span, args)
+
+    # Only models whose product follows growth have the reduced form
+    if reduced and get_model(model).reduced and has_reduced_form(y0, args):
+        if model == "monod" and has_monod_closed_form(y0, t_eval, args):
+            return monod_closed_form(y0, t_eval, args)
+
+        # Integrate the reduced state alone and rebuild X, S and P from it
+        options = {}
+        if method in IMPLICIT_METHODS:
+            options["jac"] = lambda t, xi: [
+                [reduced_jacobian(t, xi[0], model_function, jacobian, y0, args)]
+            ]
+        # Working on Python floats avoids the overhead of one-element arrays
         sol = solve_ivp(
-            inhibition_model, t_span, y0, args=(mu, Yx, Yp, Ks, Ki), t_eval=t_eval
+            lambda t, xi: [reduced_model(t, xi[0], model_function, y0, args)],
+            t_span,
+            [reduced_initial_state(y0, args)],
+            method=method,
+            t_eval=t_eval,
+            **reduced_tolerances(rtol, atol, reduced_state_scale(y0, args)),
+            **options,
+        )
+        sol.y = rebuild_state(sol.y[0], y0, args)
+        return sol
+
+    # Only the implicit methods use the Jacobian, the explicit ones warn about it
+    options = {"jac": jacobian} if method in IMPLICIT_METHODS else {}
+
+    # Solve the differential equations
+    sol = solve_ivp(
+        model_function,
+        t_span,
+        y0,
+        method=method,
+        t_eval=t_eval,
+        args=args,
+        rtol=rtol,
+        atol=1e-6 if atol is None else atol,
+        **options,
+    )
+    return sol
+
+
+def perform_cached_simulation(
+    model, y0, t_eval, params, method="RK45", rtol=1e-3, atol=None
+):
+    # perform_simulation behind the result cache, for requests that are repeated
+    # as they are. Returns the time points, the trajectories and the solver status
+    cache = get_cache()
+    key = make_key("simulation", model, y0, t_eval, params, method, rtol, atol)
+    sol = cache.get(key)
+    if sol is None:
+        result = perform_simulation(model, y0, t_eval, params, method, rtol, atol)
+        sol = OptimizeResult(
+            t=result.t, y=result.y, success=result.success, message=result.message
+        )
+        # A failed integration may succeed with other solver settings, keep it out
+        if sol.success:
+            cache.set(key, sol)
+    return sol
+
+
+def integrate_ensemble(
+    model_function, jacobian, y0, t_eval, params, method, rtol, atol
+):
+    # Stack the reduced equation of every member into one system
+    args = tuple(params.T)
+    t_span = [0, t_eval[-1]]
+
+    if method == "auto":
+        method = select_method(jacobian, y0, t_span, args)
+
+    # The Jacobian of the stacked system is diagonal
+    options = {}
+    if method == "LSODA":
+        options["jac"] = lambda t, xi: reduced_jacobian(
+            t, xi, model_function, jacobian, y0, args
+        )[None, :]
+        options["lband"] = options["uband"] = 0
+    elif method in IMPLICIT_METHODS:
+        options["jac"] = lambda t, xi: diags(
+            reduced_jacobian(t, xi, model_function, jacobian, y0, args)
+        )
+
+    # The solver controls the RMS error over all members, tightening the tolerance
+    # by sqrt(members) keeps the error of each member within the requested one.
+    # The absolute tolerance of xi is one per member
+    scale = np.sqrt(len(params))
+    sol = solve_ivp(
+        lambda t, xi: reduced_model(t, xi, model_function, y0, args),
+        t_span,
+        reduced_initial_state(y0, args),
+        method=method,
+        t_eval=t_eval,
+        **reduced_tolerances(
+            rtol / scale,
+            None if atol is None else atol / scale,
+            reduced_state_scale(y0, args),
+        ),
+        **options,
+    )
+    if not sol.success:
+        return None
+
+    return rebuild_state(sol.y, y0[:, :, None], [value[:, None] for value in args])
+
+
+def integrate_full_ensemble(
+    model_function, jacobian, y0, t_eval, params, method, rtol, atol
+):
+    # Stack the full equations of every member into one system, member by
+    # member so that the Jacobian is block diagonal with 3 x 3 blocks. For the
+    # models without a reduced form
+    args = tuple(params.T)
+    n_members = len(params)
+    t_span = [0, t_eval[-1]]
+
+    if method == "auto":
+        method = select_method(jacobian, y0, t_span, args)
+
+    def blocks(z):
+        # Jacobian blocks shaped (members, 3, 3)
+        return jacobian(0, z.reshape(n_members, 3).T, *args).transpose(2, 0, 1)
+
+    options = {}
+    if method == "LSODA":
+        # Banded storage, the entry (i, j) goes to row 2 + i - j of column j
+        def banded_jacobian(t, z):
+            J = blocks(z)
+            banded = np.zeros((5, 3 * n_members))
+            for i in range(3):
+                for j in range(3):
+                    banded[2 + i - j, j::3] = J[:, i, j]
+            return banded
+
+        options["jac"] = banded_jacobian
+        options["lband"] = options["uband"] = 2
+    elif method in IMPLICIT_METHODS:
+        options["jac"] = lambda t, z: bsr_matrix(
+            (blocks(z), np.arange(n_members), np.arange(n_members + 1)),
+            shape=(3 * n_members, 3 * n_members),
         )
-    else:
-        raise ValueError("Model must be either Monod or inhibition")
+
+    # Same tightening as the reduced ensemble, the error is the RMS over members
+    scale = np.sqrt(n_members)
+    sol = solve_ivp(
+        lambda t, z: model_function(t, z.reshape(n_members, 3).T, *args).T.ravel(),
+        t_span,
+        y0.T.ravel(),
+        method=method,
+        t_eval=t_eval,
+        rtol=rtol / scale,
+        atol=(1e-6 if atol is None else atol) / scale,
+        **options,
+    )
+    if not sol.success:
+        return None
+
+    return sol.y.reshape(n_members, 3, -1).transpose(1, 0, 2)
+
+
+# Function to simulate many parameter sets at once
+def perform_ensemble_simulation(
+    model, y0, t_eval, params, method="RK45", rtol=1e-3, atol=None
+):
+    # params holds one row of ordered kinetic parameters per member, y0 is either
+    # shared by all the members or holds one column per member. The result is
+    # shaped (3, members, len(t_eval)), members whose integration fails are NaN
+    kinetic_model = get_model(model)
+    model_function, jacobian = kinetic_model.model_function, kinetic_model.jacobian
+
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    n_params = len(kinetic_model.parameters)
+    if params.shape[1] != n_params:
+        raise ValueError(f"The {model} model takes {n_params} kinetic parameters")
+    n_members = len(params)
+    t_eval = np.asarray(t_eval, dtype=float)
+    y0 = np.broadcast_to(np.asarray(y0, dtype=float).reshape(3, -1), (3, n_members))
+
+    y = np.full((3, n_members, len(t_eval)), np.nan)
+
+    with np.errstate(all="ignore"):
+        closed_form = np.zeros(n_members, dtype=bool)
+        if model == "monod":
+            closed_form = has_monod_closed_form(y0, t_eval, params.T)
+            if closed_form.any():
+                y[:, closed_form] = monod_closed_form(
+                    y0[:, closed_form], t_eval, params[closed_form].T
+                ).y
+
+        if kinetic_model.reduced:
+            integrated = ~closed_form & has_reduced_form(y0, params.T)
+        else:
+            integrated = np.ones(n_members, dtype=bool)
+        if integrated.any():
+            if kinetic_model.reduced:
+                y_integrated = integrate_ensemble(
+                    model_function,
+                    jacobian,
+                    y0[:, integrated],
+                    t_eval,
+                    params[integrated],
+                    method,
+                    rtol,
+                    atol,
+                )
+            else:
+                y_integrated = integrate_full_ensemble(
+                    model_function,
+                    jacobian,
+                    y0,
+                    t_eval,
+                    params,
+                    method,
+                    rtol,
+                    atol,
+                )
+            if y_integrated is not None:
+                y[:, integrated] = y_integrated
+            else:
+                # A single diverging member makes the stacked solve fail, integrate
+                # them one by one so the others still get their trajectories
+                integrated[:] = False
+
+        # Members without a reduced form, or left over by a failed stacked solve
+        for i in np.flatnonzero(~closed_form & ~integrated):
+            sol = perform_simulation(
+                model, y0[:, i], t_eval, params[i], method, rtol, atol
+            )
+            if sol.success:
+                y[:, i] = sol.y
+
+    return y
+
+
+def sensitivity_model(t, z, sensitivity_terms, args):
+    # Model equations extended with the forward sensitivities dy/dparams, which
+    # follow d/dt (dy/dparams) = df/dy dy/dparams + df/dparams
+    y = z[:3]
+    sensitivities = z[3:].reshape(3, len(args))
+
+    dydt, jacobian, parameter_jacobian = sensitivity_terms(t, y, *args)
+    dsdt = jacobian @ sensitivities + parameter_jacobian
+    return np.concatenate([dydt, dsdt.ravel()])
+
+
+# Function to simulate the model together with its parameter sensitivities
+def perform_sensitivity_simulation(
+    model, y0, t_eval, params, method="LSODA", rtol=1e-8, atol=1e-10
+):
+    # Returns the solution of solve_ivp with sol.y shaped (3, len(t_eval)) and
+    # sol.sensitivities shaped (3, parameters, len(t_eval)), the derivatives of
+    # the trajectories with respect to the ordered kinetic parameters
+    args = get_model_args(model, (float(value) for value in params))
+
+    # The initial state does not depend on the kinetic parameters
+    z0 = np.concatenate([np.asarray(y0, dtype=float), np.zeros(3 * len(args))])
+
+    sol = solve_ivp(
+        sensitivity_model,
+        [0, t_eval[-1]],
+        z0,
+        method="LSODA" if method == "auto" else method,
+        t_eval=t_eval,
+        args=(get_model(model).sensitivity_terms, args),
+        rtol=rtol,
+        atol=atol,
+    )
+    if sol.success:
+        sol.sensitivities = sol.y[3:].reshape(3, len(args), -1)
+        sol.y = sol.y[:3]
     return sol
@@ -0,0 +1,135 @@
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.conf import settings
+
+# Long-lived pool of worker processes shared by every request of this server process
+_pool = None
+_pool_lock = threading.Lock()
+
+# Shared memory segments attached by a worker, closed when they are evicted
+_attached = OrderedDict()
+MAX_ATTACHED = 16
+
+
+def get_pool_size():
+    return max(1, int(getattr(settings, "COMPUTE_WORKERS", os.cpu_count() or 1)))
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the server's threads, sockets or
+            # database connections
+            _pool = ProcessPoolExecutor(
+                max_workers=get_pool_size(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def reset_pool():
+    # Replace a pool whose worker died, the next call to get_pool starts a new one
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def warm_up():
+    # Import the numerical code and run a tiny simulation of every model in the worker
+    from api.utilis.numerical_methods import perform_ensemble_simulation
+
+    t_eval = np.linspace(0, 1, 3)
+    perform_ensemble_simulation("monod", [0.1, 1, 0], t_eval, [[0.1, 0.5, 0.1, 1]])
+    perform_ensemble_simulation(
+        "inhibition", [0.1, 1, 0], t_eval, [[0.1, 0.5, 0.1, 1, 0.1]]
+    )
+    return os.getpid()
+
+
+def start_pool():
+    # Start the workers when the server starts instead of on the first fit
+    if not getattr(settings, "COMPUTE_POOL_PREWARM", False) or get_pool_size() <= 1:
+        return
+    pool = get_pool()
+    for _ in range(get_pool_size()):
+        pool.submit(warm_up)
+
+
+def get_worker_count(n_jobs):
+    # n_jobs follows the joblib convention, -1 (or None) uses every worker of the pool
+    pool_size = get_pool_size()
+    if n_jobs is None or int(n_jobs) < 0:
+        return pool_size
+    return max(1, min(int(n_jobs), pool_size))
+
+
+class SharedArray:
+    # Copies an array into shared memory once so that workers can read it
+    # through its descriptor instead of receiving a pickled copy with every task
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf)
+        self.array[...] = array
+        self.descriptor = (self.shm.name, array.shape, array.dtype.str)
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_shared_array(descriptor):
+    # Worker side of SharedArray, every segment is attached once per worker
+    name, shape, dtype = descriptor
+    if name in _attached:
+        _attached.move_to_end(name)
+        return _attached[name][1]
+
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array.flags.writeable = False
+    _attached[name] = (shm, array)
+
+    while len(_attached) > MAX_ATTACHED:
+        old_shm, old_array = _attached.popitem(last=False)[1]
+        del old_array
+        try:
+            old_shm.close()
+        except BufferError:
+            # A view of the segment is still alive, it is released with the worker
+            pass
+    return array
+
+
+def map_population(task, population, workers, *args):
+    # Split the population in one chunk per worker, each chunk is evaluated by
+    # task(chunk, *args) as a vectorized batch. Returns the concatenated results
+    population = np.asarray(population)
+    n_chunks = min(workers, len(population))
+    chunks = np.array_split(population, n_chunks)
+
+    try:
+        pool = get_pool()
+        futures = [pool.submit(task, chunk, *args) for chunk in chunks]
+        return np.concatenate([future.result() for future in futures])
+    except BrokenProcessPool:
+        reset_pool()
+        raise
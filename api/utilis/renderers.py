@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+
+import numpy as np
+from django.utils.http import parse_header_parameters
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+class NDJSONRenderer(BaseRenderer):
+    # One JSON document per line, used for streamed responses
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data, cls=encoders.JSONEncoder) + "\n").encode("utf-8")
+
+
+class EventStreamRenderer(BaseRenderer):
+    # Server-sent events, the "event" key of the data names the event
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        event = data.get("event", "error" if "error" in data else "message")
+        payload = json.dumps(data, cls=encoders.JSONEncoder)
+        return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class ColumnarRenderer(BaseRenderer):
+    # Binary format for time series. The body is
+    #   magic (8 bytes) | header length (uint32, little endian) | JSON header |
+    #   padding to 8 bytes | raw little-endian columns, each padded to 8 bytes
+    # The header lists the name, dtype, length, shape and offset of each column
+    # and holds the remaining values of the response under "metadata", offsets
+    # count from the first column. Columns are the numeric arrays of the
+    # response in C order, float64 by default or float32 when asked for with
+    # "; dtype=float32" or the dtype query parameter
+    media_type = "application/vnd.fermapp.columns"
+    format = "columns"
+    charset = None
+
+    MAGIC = b"FERMCOL1"
+    ALIGNMENT = 8
+    DTYPES = {"float64": "<f8", "float32": "<f4"}
+
+    def get_dtype(self, accepted_media_type, renderer_context):
+        dtype = None
+        if accepted_media_type:
+            dtype = parse_header_parameters(accepted_media_type)[1].get("dtype")
+        request = (renderer_context or {}).get("request")
+        if dtype is None and request is not None:
+            dtype = request.query_params.get("dtype")
+        return self.DTYPES.get(dtype or "float64", self.DTYPES["float64"])
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        dtype = self.get_dtype(accepted_media_type, renderer_context)
+
+        columns = []
+        metadata = {}
+        for name, value in (data or {}).items():
+            if isinstance(value, np.ndarray) and value.dtype.kind in "iuf":
+                # No copy unless the values need another dtype or layout
+                columns.append((name, np.ascontiguousarray(value, dtype=dtype)))
+            else:
+                metadata[name] = value
+
+        header = {"columns": [], "metadata": metadata}
+        offset = 0
+        for name, column in columns:
+            header["columns"].append(
+                {
+                    "name": name,
+                    "dtype": column.dtype.str,
+                    "length": column.size,
+                    "shape": column.shape,
+                    "offset": offset,
+                }
+            )
+            offset += -(-column.nbytes // self.ALIGNMENT) * self.ALIGNMENT
+        header = json.dumps(header, cls=encoders.JSONEncoder).encode("utf-8")
+
+        start = len(self.MAGIC) + 4 + len(header)
+        parts = [
+            self.MAGIC,
+            len(header).to_bytes(4, "little"),
+            header,
+            bytes(-start % self.ALIGNMENT),
+        ]
+        for _, column in columns:
+            parts.append(memoryview(column).cast("B"))
+            parts.append(bytes(-column.nbytes % self.ALIGNMENT))
+        return b"".join(parts)
+
+
+class CSVRenderer(BaseRenderer):
+    # Columns of equal length as comma-separated rows under a header line.
+    # Pass {"header": False} as renderer context to continue a streamed table
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        names = list(data)
+        columns = np.column_stack([np.asarray(data[name]) for name in names])
+
+        output = io.StringIO()
+        if (renderer_context or {}).get("header", True):
+            output.write(",".join(names) + "\n")
+        if columns.dtype.kind in "iuf":
+            np.savetxt(output, columns, fmt="%.17g", delimiter=",")
+        else:
+            # Error messages and other text
+            csv.writer(output, lineterminator="\n").writerows(columns.tolist())
+        return output.getvalue().encode(self.charset)
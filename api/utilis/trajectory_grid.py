@@ -0,0 +1,343 @@
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from scipy.integrate import cumulative_trapezoid
+from scipy.special import expit, logit
+
+from api.utilis.numerical_methods import (
+    get_model_functions,
+    perform_ensemble_simulation,
+)
+
+# Both models reduce to one equation in a few dimensionless numbers. With the
+# biomass reached once all the substrate is consumed, C = X0 + Y * S0, the
+# fraction x = X / C follows
+#   dx/dtau = x (1 - x) / (a + (1 - x) + b (1 - x) ** 2)
+# with tau = mu * t, a = Ks * Y / C and b = Ki * C / Y (zero for Monod). S and P
+# follow from x through the yield coefficients. The equation is autonomous, so
+# the trajectories of every x(0) are shifts in time of one master trajectory
+# per (a, b). The grid stores, for each grid point, the time at which the master
+# trajectory reaches every value of xi = logit(x), the reduced state of the
+# integrators. That time is a smooth function of xi even where x bends sharply
+# as the substrate runs out. It is measured in s = tau / (1 + a + b) - s_half,
+# zero where x = 1 / 2, which lines up the tables of neighbouring grid points
+# and keeps the interpolation between them accurate
+#
+# Each axis is (low, high, points, offset): the points are spaced evenly in
+# log(value + offset) and interpolation is linear in that coordinate
+DEFAULT_GRIDS = {
+    "monod": {"axes": {"a": (1e-3, 1e2, 81, 0.0)}},
+    "inhibition": {"axes": {"a": (1e-3, 1e2, 61, 0.0), "b": (0.0, 1e2, 61, 1e-3)}},
+}
+
+# Range of xi covered by the tables, x is 1 to double precision beyond the top
+XI_MIN = float(logit(1e-7))
+XI_MAX = 36.0
+
+# Largest xi(0) of a preview, the trajectory needs room in the table to move forward
+XI0_MAX = 30.0
+
+# Spacing of xi in the tables and in the quadrature that fills them
+XI_STEP = 0.025
+FINE_STEP = 0.001
+
+# Tolerance of the direct solves that measure the error of the grid
+CHECK_RTOL = 1e-7
+
+# Fractions X0 / C at which the error of every cell is measured
+CHECK_FRACTIONS = (1e-6, 1e-3, 0.1, 0.5, 0.9)
+
+# Factor between the error bound of a cell and the largest error measured at
+# its corners, edge midpoints and center, which covers the points and initial
+# fractions in between
+ERROR_SAFETY = 3.0
+
+# Loaded grids with the identity of their table file, (mtime, inode)
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def get_grid_config(model):
+    return getattr(settings, "TRAJECTORY_GRIDS", DEFAULT_GRIDS)[model]
+
+
+def get_grid_directory():
+    default = settings.BASE_DIR / "trajectory_grids"
+    return Path(getattr(settings, "TRAJECTORY_GRID_DIR", default))
+
+
+def axis_points(low, high, n, offset):
+    return np.exp(np.linspace(np.log(low + offset), np.log(high + offset), n)) - offset
+
+
+def time_scale(a, b=0.0):
+    # Initial growth rate of the dimensionless model is 1 / (1 + a + b)
+    return 1 + a + b
+
+
+def get_dimensionless_params(model, members):
+    # Kinetic parameters for which the model is the dimensionless equation
+    # itself: C = Y = 1, mu = 1 and no product
+    a = members[:, 0]
+    params = [np.ones_like(a), np.ones_like(a), np.zeros_like(a), a]
+    if model == "inhibition":
+        params.append(members[:, 1])
+    return params
+
+
+def dimensionless_inputs(model, y0, params):
+    # Returns the grid coordinates of a simulation, x(0) and the constant C, or
+    # None when the reduction does not apply
+    X0, S0, P0 = y0
+    mu, Y, Yp, Ks = params[:4]
+    Ki = params[4] if model == "inhibition" else 0.0
+    if min(X0, S0, mu, Y, Ks) <= 0 or Ki < 0:
+        return None
+
+    C = X0 + Y * S0
+    coordinates = {"a": Ks * Y / C}
+    if model == "inhibition":
+        coordinates["b"] = Ki * C / Y
+    return coordinates, X0 / C, C
+
+
+def master_tables(model, members, xi):
+    # Shifted time s(xi) of the master trajectory of each row of (a[, b]). Along
+    # a trajectory dtau/dxi = x (1 - x) / (dx/dtau), so the tables are a
+    # quadrature of the model equations
+    model_function = get_model_functions(model)[0]
+    fine = np.arange(xi[0], xi[-1] + FINE_STEP / 2, FINE_STEP)
+    x = expit(fine)[:, None]
+    params = get_dimensionless_params(model, members)
+    growth = model_function(0, (x, 1 - x, np.zeros_like(x)), *params)[0]
+
+    tau = cumulative_trapezoid(x * (1 - x) / growth, fine, axis=0, initial=0)
+    tau_half = np.array([np.interp(0.0, fine, column) for column in tau.T])
+    s = (tau - tau_half) / time_scale(*members.T)
+    return np.array([np.interp(xi, fine, column) for column in s.T])
+
+
+def simulate_master(model, members, x0, s):
+    # Direct solves of the dimensionless model of each row of (a[, b]) from x0
+    # over the scaled time s, returns x shaped (members, len(s))
+    params = get_dimensionless_params(model, members)
+    params[0] = time_scale(*members.T)
+    y = perform_ensemble_simulation(
+        model,
+        [x0, 1 - x0, 0.0],
+        s,
+        np.column_stack(params),
+        rtol=CHECK_RTOL,
+        atol=CHECK_RTOL,
+    )
+    return y[0]
+
+
+class TrajectoryGrid:
+    # Memory-mapped time tables of one model with the interpolation error of each cell
+
+    def __init__(self, model, directory):
+        self.model = model
+        with open(directory / f"{model}.json") as file:
+            self.meta = json.load(file)
+        self.table = np.load(directory / f"{model}_table.npy", mmap_mode="r")
+        self.cell_error = np.load(directory / f"{model}_error.npy", mmap_mode="r")
+
+        self.names = list(self.meta["axes"])
+        self.offsets = np.array([self.meta["axes"][name][3] for name in self.names])
+        self.coordinates = [
+            np.log(axis_points(*self.meta["axes"][name]) + self.meta["axes"][name][3])
+            for name in self.names
+        ]
+        n_xi = self.table.shape[-1]
+        self.xi = self.meta["xi_min"] + self.meta["xi_step"] * np.arange(n_xi)
+
+    def locate(self, coordinates):
+        # Cell index and position inside the cell along every axis, or None
+        # outside of the grid
+        point = np.log(
+            np.array([coordinates[name] for name in self.names]) + self.offsets
+        )
+        cells, weights = [], []
+        for axis, value in zip(self.coordinates, point):
+            if not axis[0] <= value <= axis[-1]:
+                return None
+            i = min(int(np.searchsorted(axis, value, side="right")) - 1, len(axis) - 2)
+            cells.append(i)
+            weights.append((value - axis[i]) / (axis[i + 1] - axis[i]))
+        return cells, weights
+
+    def blend(self, cells, weights):
+        # Multilinear interpolation of the tables at the corners of the cell
+        corner = self.table[tuple(slice(i, i + 2) for i in cells)]
+        for w in weights:
+            corner = corner[0] * (1 - w) + corner[1] * w
+        return corner
+
+    def interpolate(self, coordinates, x0, s):
+        # x over the scaled time s for the grid coordinates and x(0), with the
+        # error bound of the cell. None outside of the grid
+        location = self.locate(coordinates)
+        xi0 = logit(x0)
+        if location is None or not self.xi[0] <= xi0 <= XI0_MAX:
+            return None
+        cells, weights = location
+
+        table = self.blend(cells, weights)
+        s0 = np.interp(xi0, self.xi, table)
+        # Past the end of the table the substrate is exhausted, np.interp keeps
+        # the last value
+        x = expit(np.interp(s0 + s, table, self.xi))
+        return x, float(self.cell_error[tuple(cells)])
+
+    def preview(self, y0, params, t_eval):
+        # Trajectories of X, S and P interpolated from the grid with the bound
+        # of their error, or None when the simulation is outside of the grid
+        inputs = dimensionless_inputs(self.model, y0, params)
+        t_eval = np.asarray(t_eval, dtype=float)
+        if inputs is None or len(t_eval) == 0 or t_eval[0] < 0:
+            return None
+        coordinates, x0, C = inputs
+
+        X0, S0, P0 = y0
+        mu, Y, Yp = params[:3]
+        s = mu * t_eval / time_scale(coordinates["a"], coordinates.get("b", 0.0))
+        result = self.interpolate(coordinates, x0, s)
+        if result is None:
+            return None
+        x, error = result
+
+        X = C * x
+        y = np.array([X, C * (1 - x) / Y, P0 + Yp * (X - X0)])
+        # The error of x, relative to C, and the absolute errors of the states
+        error_bound = {
+            "relative": error,
+            "x": C * error,
+            "s": C * error / Y,
+            "p": abs(Yp) * C * error,
+        }
+        return y, error_bound
+
+
+def save_atomic(path, write):
+    # Writes a file next to path and renames it over path, so that readers,
+    # including servers that memory-map the old file, never see a partial file
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            write(file)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def save_grid(directory, model, meta, table, cell_error):
+    # The table is replaced last: servers reload a grid when its table file
+    # changes, and find the matching metadata and errors by then
+    save_atomic(
+        directory / f"{model}.json", lambda file: file.write(json.dumps(meta).encode())
+    )
+    save_atomic(
+        directory / f"{model}_error.npy", lambda file: np.save(file, cell_error)
+    )
+    save_atomic(directory / f"{model}_table.npy", lambda file: np.save(file, table))
+
+
+def cell_maximum(values):
+    # Largest value of each cell from values at the corners, edge midpoints and
+    # centers of the cells, that is on the grid refined by two along every axis
+    for axis in range(values.ndim):
+        n = values.shape[axis]
+        values = np.maximum.reduce(
+            [
+                values.take(range(0, n - 2, 2), axis=axis),
+                values.take(range(1, n - 1, 2), axis=axis),
+                values.take(range(2, n, 2), axis=axis),
+            ]
+        )
+    return values
+
+
+def build_grid(model, directory=None, config=None):
+    # Fills the tables of the model and bounds the error of every cell from
+    # direct solves at its corners, edge midpoints and center
+    directory = Path(directory or get_grid_directory())
+    directory.mkdir(parents=True, exist_ok=True)
+    config = config or get_grid_config(model)
+
+    names = list(config["axes"])
+    axes = [axis_points(*config["axes"][name]) for name in names]
+    shape = tuple(len(axis) for axis in axes)
+    members = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(
+        -1, len(names)
+    )
+
+    xi = XI_MIN + XI_STEP * np.arange(int((XI_MAX - XI_MIN) / XI_STEP) + 1)
+    table = np.empty((len(members), len(xi)))
+    for start in range(0, len(members), 128):
+        batch = slice(start, start + 128)
+        table[batch] = master_tables(model, members[batch], xi)
+
+    # The error is measured on a grid built in a temporary directory, the
+    # published files are only replaced once it is known
+    meta = {"axes": config["axes"], "xi_min": float(xi[0]), "xi_step": XI_STEP}
+    table = table.reshape(shape + (len(xi),))
+    with tempfile.TemporaryDirectory(dir=directory, prefix=f".{model}-") as temporary:
+        temporary = Path(temporary)
+        save_grid(temporary, model, meta, table, np.zeros(tuple(n - 1 for n in shape)))
+        grid = TrajectoryGrid(model, temporary)
+
+        # Error of x on the grid refined by two, for a few initial fractions,
+        # over the longest time any grid point takes to consume the substrate
+        refined = [
+            axis_points(low, high, 2 * n - 1, offset)
+            for low, high, n, offset in (config["axes"][name] for name in names)
+        ]
+        refined_members = np.stack(np.meshgrid(*refined, indexing="ij"), axis=-1)
+        refined_members = refined_members.reshape(-1, len(names))
+        s = np.linspace(0, np.max(table[..., -1] - table[..., 0]), 2000)
+        errors = np.zeros(len(refined_members))
+        for x0 in CHECK_FRACTIONS:
+            for start in range(0, len(refined_members), 128):
+                batch = refined_members[start : start + 128]
+                exact = simulate_master(model, batch, x0, s)
+                for i, member in enumerate(batch):
+                    x, _ = grid.interpolate(dict(zip(names, member)), x0, s)
+                    error = np.max(np.abs(x - exact[i]))
+                    # A failed solve leaves the cell without a bound
+                    errors[start + i] = max(
+                        errors[start + i], np.nan_to_num(error, nan=np.inf)
+                    )
+        del grid
+    cell_error = ERROR_SAFETY * cell_maximum(
+        errors.reshape(tuple(2 * n - 1 for n in shape))
+    )
+
+    # Servers load the new tables the next time they look the grid up
+    save_grid(directory, model, meta, table, cell_error)
+    return TrajectoryGrid(model, directory)
+
+
+def get_grid(model):
+    # Grid of the model, or None when it has not been built yet. The grid is
+    # loaded again when build_grid replaced its files
+    if model not in DEFAULT_GRIDS:
+        return None
+    try:
+        stat = os.stat(get_grid_directory() / f"{model}_table.npy")
+    except OSError:
+        return None
+    identity = (stat.st_mtime_ns, stat.st_ino)
+    with _grids_lock:
+        if model not in _grids or _grids[model][1] != identity:
+            try:
+                _grids[model] = (TrajectoryGrid(model, get_grid_directory()), identity)
+            except (OSError, ValueError, KeyError):
+                return None
+        return _grids[model][0]
@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# Compute in threads of their own, see ASYNC_COMPUTE_VIEWS in settings.py
+os.environ.setdefault('ASYNC_COMPUTE_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Start the compute workers with the server so the first fit does not pay for it,
+# and pick up the optimization jobs that were queued before a restart
+from api.utilis.parallel import start_pool  # noqa: E402
+from api.optimization.jobs import resume_jobs  # noqa: E402
+
+start_pool()
+resume_jobs()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -162,6 +163,85 @@ CORS_ALLOW_ALL_ORIGINS = True
 X_FRAME_OPTIONS = "ALLOW-FROM http://localhost:5173/"
 
 
+# Worker processes shared by all requests for fitness evaluations and simulations
+COMPUTE_WORKERS = int(os.environ.get("COMPUTE_WORKERS", os.cpu_count() or 1))
+
+# Start the compute workers with the server instead of on the first request
+COMPUTE_POOL_PREWARM = True
+
+# Threads per server process that run queued parameter-optimization jobs
+OPTIMIZATION_JOB_WORKERS = 2
+
+# Seconds without heartbeat after which a running job is considered abandoned
+OPTIMIZATION_JOB_HEARTBEAT_TIMEOUT = 120
+
+# Largest number of experiments fitted together by a parameter optimization
+MULTI_EXPERIMENT_MAX_EXPERIMENTS = 100
+
+# Largest number of bootstrap refits of a parameter optimization
+BOOTSTRAP_MAX_REPLICATES = 2000
+
+# Largest number of runs accepted by the batch simulation endpoint
+BATCH_SIMULATION_MAX_RUNS = 10000
+
+# Results of simulations and fits kept in memory by each server process
+RESULT_CACHE_MAX_ENTRIES = 256
+
+# Size in bytes of the results kept in memory by each server process
+RESULT_CACHE_MAX_MEMORY_BYTES = 128 * 1024**2
+
+# Directory of the cache shared by the server processes, disabled when empty
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+
+# Size in bytes above which the oldest shared cache files are removed
+RESULT_CACHE_MAX_BYTES = 512 * 1024**2
+
+# Largest number of simulated values (simulations x time points x 3) of a
+# sensitivity analysis
+SENSITIVITY_MAX_VALUES = 2 * 10**7
+
+# Directory of the precomputed trajectory grids, built with
+# python manage.py build_trajectory_grids
+TRAJECTORY_GRID_DIR = (
+    os.environ.get("TRAJECTORY_GRID_DIR") or BASE_DIR / "trajectory_grids"
+)
+
+# Largest error of a grid preview, relative to X0 + Y * S0, above which the
+# simulation is solved instead
+TRAJECTORY_GRID_TOLERANCE = 1e-3
+
+# Directory of the uploaded experiment datasets, one float64 .npy file per column
+DATASET_DIR = os.environ.get("DATASET_DIR") or MEDIA_ROOT / "datasets"
+
+# Largest size in bytes of the columns of one uploaded dataset
+DATASET_MAX_BYTES = 512 * 1024**2
+
+# Largest number of regressions (candidates x folds) of a media-optimization sweep
+MEDIA_SWEEP_MAX_FITS = 20000
+
+# Polynomial features read at once by media-optimization, which fits any
+# number of rows chunk by chunk
+MEDIA_CHUNK_VALUES = 2**22
+
+# Largest number of points of each axis of a media-optimization response surface
+MEDIA_MAX_RESOLUTION = 1000
+
+# Route simulation, parameter-optimization and media-optimization to their async
+# views, which compute in threads of their own instead of the single thread of
+# the sync views of an ASGI server. backend/asgi.py turns them on, WSGI servers
+# already run requests in threads of their own and keep the sync views
+ASYNC_COMPUTE_VIEWS = os.environ.get("ASYNC_COMPUTE_VIEWS") == "1"
+
+# Requests of each endpoint computing at once, and requests that may wait
+# beyond them before the server answers 503
+ASYNC_COMPUTE_LIMITS = {
+    "simulation": 4,
+    "parameter_optimization": 1,
+    "media_optimization": 2,
+}
+ASYNC_COMPUTE_QUEUE = 32
+
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
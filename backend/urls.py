@@ -7,6 +7,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.simulation.urls')),
     path('api/', include('api.optimization.urls')),
+    path('api/', include('api.datasets.urls')),
 
     # Users
     path('users/', include('users.urls')),
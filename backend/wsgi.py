@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Start the compute workers with the server so the first fit does not pay for it,
+# and pick up the optimization jobs that were queued before a restart
+from api.utilis.parallel import start_pool  # noqa: E402
+from api.optimization.jobs import resume_jobs  # noqa: E402
+
+start_pool()
+resume_jobs()